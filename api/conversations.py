@@ -0,0 +1,161 @@
+"""Conversas no servidor (/api/conversations e conversation_id no /api/chat)
+
+O navegador mandava de novo o contexto inteiro a cada pergunta (o e-mail para
+a construtora colava a análise completa no prompt). Agora cada turno (pergunta
++ resposta + ID da resposta na OpenAI) fica no SQLite e a pergunta seguinte
+leva só a mensagem nova. O servidor remonta o contexto:
+- "resumo" (padrão): os turnos anteriores em versão compacta. As perguntas
+  ficam só com o começo, sem os documentos colados. As respostas vão sem HTML,
+  e a última fica com mais espaço que as antigas. Tudo dentro de
+  CONVERSATION_SUMMARY_TOKENS.
+- "completo": no GPT-5, previous_response_id (a OpenAI guarda o contexto);
+  nos outros modelos, os turnos inteiros (fit_messages corta se passar do limite)
+
+O system prompt do primeiro turno fica guardado e é reusado quando a pergunta
+seguinte não traz o seu.
+"""
+import html
+import re
+import uuid
+
+from api.token_budget import content_text, count_text_tokens, truncate_middle
+
+CONVERSATION_SUMMARY_TOKENS = 3000  # Orçamento total do histórico compacto
+CONVERSATION_QUESTION_TOKENS = 200  # Cada pergunta anterior (documentos ficam de fora)
+CONVERSATION_LAST_ANSWER_TOKENS = 1500  # Última resposta (ex: a análise que gerou o e-mail)
+CONVERSATION_OLDER_ANSWER_TOKENS = 300
+CONTEXT_MODES = ('resumo', 'completo')
+
+CELL_END_RE = re.compile(r'</t[dh]\s*>', re.IGNORECASE)
+LINE_END_RE = re.compile(r'<br\s*/?>|</(tr|p|div|li|h\d|table)\s*>', re.IGNORECASE)
+TAG_RE = re.compile(r'<[^>]+>')
+SPACES_RE = re.compile(r'[ \t]+')
+BLANK_LINES_RE = re.compile(r'\n\s*\n+')
+
+
+def ensure_conversation_schema(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS conversas (
+            id TEXT PRIMARY KEY,
+            usuario TEXT,
+            instrucoes TEXT,
+            ultimo_response_id TEXT,
+            criado_em DATETIME DEFAULT CURRENT_TIMESTAMP,
+            atualizado_em DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS conversa_turnos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversa_id TEXT NOT NULL REFERENCES conversas(id),
+            pergunta TEXT,
+            resposta TEXT,
+            response_id TEXT,
+            modelo TEXT,
+            tokens_entrada INTEGER,
+            tokens_cache INTEGER,
+            data DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_conversa_turnos ON conversa_turnos (conversa_id, id)')
+
+
+def create_conversation(conn, usuario=None):
+    conversation_id = uuid.uuid4().hex
+    conn.execute('INSERT INTO conversas (id, usuario) VALUES (?, ?)', (conversation_id, usuario))
+    return conversation_id
+
+
+def load_conversation(conn, conversation_id):
+    """Conversa com os turnos em ordem, ou None"""
+    row = conn.execute(
+        'SELECT id, usuario, instrucoes, ultimo_response_id, criado_em, atualizado_em FROM conversas WHERE id = ?',
+        (conversation_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    turns = conn.execute(
+        'SELECT pergunta, resposta, response_id, modelo, tokens_entrada, tokens_cache, data '
+        'FROM conversa_turnos WHERE conversa_id = ? ORDER BY id', (conversation_id,)
+    ).fetchall()
+    return {
+        'id': row[0], 'usuario': row[1], 'instrucoes': row[2], 'ultimo_response_id': row[3],
+        'criado_em': row[4], 'atualizado_em': row[5],
+        'turnos': [
+            {'pergunta': turn[0], 'resposta': turn[1], 'response_id': turn[2], 'modelo': turn[3],
+             'tokens_entrada': turn[4], 'tokens_cache': turn[5], 'data': turn[6]}
+            for turn in turns
+        ],
+    }
+
+
+def append_turn(conn, conversation_id, instructions, question, answer, model, response_id=None, usage=None):
+    usage = usage or {}
+    conn.execute(
+        'INSERT INTO conversa_turnos (conversa_id, pergunta, resposta, response_id, modelo, tokens_entrada, tokens_cache) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+        (conversation_id, question, answer, response_id, model, usage.get('input_tokens'), usage.get('cached_tokens'))
+    )
+    conn.execute('''
+        UPDATE conversas SET instrucoes = COALESCE(instrucoes, ?), ultimo_response_id = ?,
+                             atualizado_em = CURRENT_TIMESTAMP
+        WHERE id = ?
+    ''', (instructions or None, response_id, conversation_id))
+
+
+def compact_text(text, max_tokens):
+    """Texto sem HTML (tabelas viram linhas 'a | b | c'), cortado no meio se passar do orçamento"""
+    text = CELL_END_RE.sub(' | ', text or '')
+    text = LINE_END_RE.sub('\n', text)
+    text = html.unescape(TAG_RE.sub('', text))
+    text = BLANK_LINES_RE.sub('\n', SPACES_RE.sub(' ', text)).strip()
+    return truncate_middle(text, max_tokens) if count_text_tokens(text) > max_tokens else text
+
+
+def split_request(messages):
+    """(system prompts do início, demais mensagens, texto da última pergunta)"""
+    leading = 0
+    while leading < len(messages) and messages[leading].get('role') == 'system':
+        leading += 1
+    question = next(
+        (content_text(msg.get('content')) for msg in reversed(messages) if msg.get('role') == 'user'), ''
+    )
+    return messages[:leading], messages[leading:], question
+
+
+def compact_turns(turns, budget=CONVERSATION_SUMMARY_TOKENS):
+    """Turnos anteriores compactos, do mais recente para trás até acabar o orçamento"""
+    compacted = []
+    remaining = budget
+    for position, turn in enumerate(reversed(turns)):
+        if remaining <= 0:
+            break
+        answer_budget = CONVERSATION_LAST_ANSWER_TOKENS if position == 0 else CONVERSATION_OLDER_ANSWER_TOKENS
+        question = compact_text(turn['pergunta'], min(CONVERSATION_QUESTION_TOKENS, remaining))
+        answer = compact_text(turn['resposta'], max(0, min(answer_budget, remaining - count_text_tokens(question))))
+        remaining -= count_text_tokens(question) + count_text_tokens(answer)
+        compacted[:0] = [{'role': 'user', 'content': question}, {'role': 'assistant', 'content': answer}]
+    return compacted
+
+
+def conversation_messages(conversation, messages, model, mode='resumo'):
+    """Mensagens para a OpenAI a partir da conversa guardada + mensagens novas.
+
+    Retorna (messages, previous_response_id).
+    """
+    system, new_messages, _ = split_request(messages)
+    if not system and conversation.get('instrucoes'):
+        system = [{'role': 'system', 'content': conversation['instrucoes']}]
+    turns = conversation['turnos']
+    # Só um ID da Responses API serve (o último turno pode ter sido Chat Completions ou cache)
+    last_on_responses = bool(turns) and (turns[-1]['modelo'] or '').startswith('gpt-5')
+    if mode == 'completo' and model.startswith('gpt-5') and last_on_responses and conversation.get('ultimo_response_id'):
+        return system + new_messages, conversation['ultimo_response_id']
+    if mode == 'completo':
+        history = []
+        for turn in turns:
+            history += [{'role': 'user', 'content': turn['pergunta'] or ''},
+                        {'role': 'assistant', 'content': turn['resposta'] or ''}]
+    else:
+        history = compact_turns(turns)
+    return system + history + new_messages, None
@@ -0,0 +1,145 @@
+"""Pool de conexões SQLite por processo
+
+Cada worker do gunicorn mantém até `max_size` conexões abertas e as reutiliza
+(junto com o cache de statements preparados do sqlite3). O banco roda em modo
+WAL: leituras de /api/historico não esperam as gravações do histórico.
+
+Com metrics, registra a disputa pelo banco: espera por uma conexão livre
+(db_wait_seconds), tempo com a conexão em uso (db_hold_seconds) e erros
+"database is locked/busy" (db_busy_total).
+"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+POOL_SIZE = int(os.getenv('SQLITE_POOL_SIZE', 8))
+BUSY_TIMEOUT = 10  # Segundos esperando lock antes de "database is locked"
+CACHED_STATEMENTS = 256  # Statements preparados reutilizados por conexão
+
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',  # Seguro em WAL; fsync só no checkpoint
+    'PRAGMA mmap_size=268435456',  # 256MB mapeados em memória para leitura
+    'PRAGMA cache_size=-16000',  # ~16MB de page cache por conexão
+    'PRAGMA temp_store=MEMORY',
+)
+
+
+def connect(db_path):
+    """Abre uma conexão já configurada (usada pelo pool e por scripts avulsos)"""
+    conn = sqlite3.connect(
+        db_path,
+        timeout=BUSY_TIMEOUT,
+        check_same_thread=False,  # O pool garante um único dono por vez
+        cached_statements=CACHED_STATEMENTS
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+_inherited = []  # Filas de conexões herdadas por fork (nunca fechadas no filho)
+
+
+class SQLitePool:
+    """Pool simples baseado em fila; recriado automaticamente após fork"""
+
+    def __init__(self, db_path, max_size=POOL_SIZE, metrics=None):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        if getattr(self, '_idle', None) is not None and self._idle.qsize():
+            # Conexões herdadas do master: o GC do filho chamaria sqlite3_close em um handle
+            # compartilhado pelo fork. Ficam referenciadas (o master fecha as dele antes do fork)
+            _inherited.append(self._idle)
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue(maxsize=self.max_size)  # LIFO: conexões "quentes" primeiro
+        self._created = 0
+
+    def _acquire(self):
+        if self._pid != os.getpid():
+            # Conexões herdadas do master (preload_app) não podem ser usadas no worker
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.max_size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return connect(self.db_path)
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            return self._idle.get(timeout=BUSY_TIMEOUT)
+        except queue.Empty:
+            # Mesmo tipo de erro de um lock do SQLite: quem chama já trata (e o /api/health mostra)
+            raise sqlite3.OperationalError(
+                f'pool exhausted: {self.max_size} conexões em uso há mais de {BUSY_TIMEOUT}s'
+            ) from None
+
+    def _release(self, conn, broken=False):
+        if conn is None:
+            return
+        if not broken:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()  # Nunca devolver conexão com transação aberta
+                self._idle.put_nowait(conn)
+                return
+            except Exception:
+                pass
+        try:
+            conn.close()
+        finally:
+            with self._lock:
+                self._created -= 1
+
+    @contextmanager
+    def connection(self):
+        started = time.perf_counter()
+        conn = self._acquire()
+        acquired = time.perf_counter()
+        broken = False
+        try:
+            yield conn
+        except sqlite3.DatabaseError as e:
+            broken = not isinstance(e, (sqlite3.IntegrityError, sqlite3.OperationalError))
+            if self.metrics and isinstance(e, sqlite3.OperationalError) and ('locked' in str(e) or 'busy' in str(e)):
+                self.metrics.inc('db_busy_total')
+            raise
+        finally:
+            self._release(conn, broken)
+            if self.metrics:
+                self.metrics.observe('db_wait_seconds', acquired - started)
+                self.metrics.observe('db_hold_seconds', time.perf_counter() - acquired)
+
+    def stats(self):
+        return {'size': self._created, 'idle': self._idle.qsize(), 'max_size': self.max_size}
+
+    def close_all(self):
+        """Fecha as conexões ociosas (as em uso continuam com quem as pegou)"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
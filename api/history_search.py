@@ -0,0 +1,157 @@
+"""Busca textual no histórico de análises (SQLite FTS5)
+
+O índice `historico_fts` é "contentless": guarda só o índice invertido, não uma
+segunda cópia do texto (o histórico já fica comprimido em historico.*_z). Quem
+grava no histórico mantém o índice em sincronia, em Python
+(history_store.insert_rows / index_search_rows), com o texto ainda sem
+compressão. Não há triggers com funções SQL próprias: o banco aceita gravações
+de qualquer conexão (sqlite3 na linha de comando, scripts de carga).
+
+Linhas inseridas em historico sem passar por insert_rows não entram na busca;
+linhas apagadas deixam entradas órfãs no índice, descartadas pelo JOIN com
+historico. Para reconstruir o índice: DROP TABLE historico_fts e
+ensure_search_schema(conn).
+
+Os trechos (snippets) são montados em Python, descomprimindo só as respostas
+que entram no resultado.
+"""
+import re
+import unicodedata
+
+from api.history_store import MIGRATION_BATCH, decompress_text, index_search_rows, user_text
+
+SNIPPET_CHARS = 240
+MAX_SEARCH_RESULTS = 100
+
+# Palavras que não ajudam na busca ("compare os preços do concreto")
+STOPWORDS = {
+    'a', 'o', 'as', 'os', 'de', 'da', 'do', 'das', 'dos', 'e', 'em', 'no', 'na', 'nos', 'nas',
+    'um', 'uma', 'para', 'por', 'com', 'que', 'ao', 'aos', 'se', 'compare', 'comparar',
+    'the', 'for', 'of', 'and', 'to', 'in', 'on', 'with',
+}
+
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+# Versões anteriores sincronizavam o índice por triggers que chamavam funções Python
+OLD_TRIGGERS = ('trg_historico_fts_insert', 'trg_historico_fts_delete', 'trg_historico_fts_update')
+
+
+def ensure_search_schema(conn, batch_size=MIGRATION_BATCH):
+    """Cria o índice FTS5 e indexa as linhas já existentes; remove os triggers antigos"""
+    for trigger in OLD_TRIGGERS:
+        conn.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'historico_fts'"
+    ).fetchone()
+    if exists:
+        return
+    conn.execute('''
+        CREATE VIRTUAL TABLE historico_fts USING fts5(
+            prompt_usuario, resposta,
+            content='',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    ''')
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            'SELECT id, prompt_z, resposta_z FROM historico WHERE prompt_z IS NOT NULL AND id > ? ORDER BY id LIMIT ?',
+            (last_id, batch_size)
+        ).fetchall()
+        if not rows:
+            break
+        index_search_rows(conn, [
+            (row_id, user_text(prompt_z), decompress_text(resposta_z)) for row_id, prompt_z, resposta_z in rows
+        ])
+        last_id = rows[-1][0]
+
+
+def fold(text):
+    """Minúsculas e sem acentos (mesma normalização do tokenizer remove_diacritics)"""
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def extract_terms(query):
+    terms = [term for term in TERM_RE.findall(query or '') if fold(term) not in STOPWORDS]
+    return terms or TERM_RE.findall(query or '')
+
+
+def quote(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def build_match(terms, filters, operator):
+    """Monta a expressão MATCH: termos (AND/OR) + filtros obrigatórios na resposta"""
+    parts = []
+    if terms:
+        parts.append('(' + f' {operator} '.join(quote(term) for term in terms) + ')')
+    for value in filters:
+        parts.append('resposta : ' + quote(value))
+    return ' AND '.join(parts)
+
+
+def make_snippet(text, terms, size=SNIPPET_CHARS):
+    """Trecho em torno da primeira ocorrência de um termo, com os termos em **negrito**"""
+    if not text:
+        return ''
+    folded = fold(text)
+    # fold() pode mudar o tamanho em alguns caracteres raros; nesse caso usa o início do texto
+    aligned = len(folded) == len(text)
+    positions = [folded.find(fold(term)) for term in terms] if aligned else []
+    positions = [pos for pos in positions if pos >= 0]
+    start = max(0, min(positions) - size // 3) if positions else 0
+    snippet = text[start:start + size]
+    if aligned and terms:
+        pattern = re.compile('|'.join(re.escape(term) for term in sorted(terms, key=len, reverse=True)))
+        folded_snippet = folded[start:start + size]
+        pieces, last = [], 0
+        for match in pattern.finditer(folded_snippet):
+            pieces.append(snippet[last:match.start()])
+            pieces.append(f"**{snippet[match.start():match.end()]}**")
+            last = match.end()
+        pieces.append(snippet[last:])
+        snippet = ''.join(pieces)
+    prefix = '...' if start > 0 else ''
+    suffix = '...' if start + size < len(text) else ''
+    return prefix + snippet.replace('\n', ' ') + suffix
+
+
+def search_history(conn, query, fornecedor=None, item=None, usuario=None, limit=20):
+    """Busca ranqueada (bm25). Tenta todos os termos (AND) e, sem resultados, qualquer termo (OR)."""
+    terms = extract_terms(query)
+    filters = [value for value in (fornecedor, item) if value]
+    if not terms and not filters:
+        return []
+    limit = max(1, min(limit, MAX_SEARCH_RESULTS))
+
+    sql = '''
+        SELECT h.id, h.usuario, h.data, h.resposta_z, bm25(historico_fts) AS score
+        FROM historico_fts
+        JOIN historico h ON h.id = historico_fts.rowid
+        WHERE historico_fts MATCH ?
+    '''
+    params_suffix = []
+    if usuario:
+        sql += ' AND h.usuario = ?'
+        params_suffix.append(usuario)
+    sql += ' ORDER BY score LIMIT ?'
+    params_suffix.append(limit)
+
+    rows = []
+    for operator in ('AND', 'OR') if len(terms) > 1 else ('AND',):
+        rows = conn.execute(sql, [build_match(terms, filters, operator)] + params_suffix).fetchall()
+        if rows:
+            break
+
+    folded_terms = [fold(term) for term in terms + filters]
+    return [
+        {
+            'id': row[0],
+            'usuario': row[1],
+            'data': row[2],
+            'score': round(-row[4], 4),  # bm25: menor é melhor; invertido para "maior é melhor"
+            'snippet': make_snippet(decompress_text(row[3]), folded_terms),
+        }
+        for row in rows
+    ]
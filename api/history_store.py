@@ -0,0 +1,314 @@
+"""Armazenamento compacto do histórico
+
+- system prompts gravados uma única vez (deduplicados por hash) e referenciados por ID
+- mensagens salvas como JSON (antes: repr Python da lista inteira)
+- campos grandes comprimidos com zlib; /api/historico lê apenas as colunas
+  de prévia (texto puro), sem tocar nos BLOBs
+
+Migração de bancos antigos: `python -m api.history_store [caminho.db]`
+(também é executada automaticamente pelo init_db).
+"""
+import ast
+import hashlib
+import json
+import sys
+import zlib
+
+from api.db_pool import connect
+
+PROMPT_PREVIEW_CHARS = 500
+RESPOSTA_PREVIEW_CHARS = 1000
+COMPRESS_MIN_BYTES = 256  # Abaixo disso o cabeçalho do zlib não compensa
+COMPRESSION_LEVEL = 6
+MIGRATION_BATCH = 500
+
+# Primeiro byte do BLOB indica o formato
+PLAIN = b'T'
+ZLIB = b'Z'
+
+
+def compress_text(text):
+    if text is None:
+        return None
+    data = text.encode('utf-8')
+    if len(data) < COMPRESS_MIN_BYTES:
+        return PLAIN + data
+    return ZLIB + zlib.compress(data, COMPRESSION_LEVEL)
+
+
+def decompress_text(blob):
+    if blob is None:
+        return None
+    blob = bytes(blob)
+    if blob[:1] == ZLIB:
+        return zlib.decompress(blob[1:]).decode('utf-8')
+    return blob[1:].decode('utf-8')
+
+
+def decompress_preview(blob, max_chars):
+    """Descomprime só o necessário para os primeiros max_chars caracteres.
+
+    Retorna (texto, truncado).
+    """
+    if blob is None:
+        return None, False
+    blob = bytes(blob)
+    if blob[:1] == ZLIB:
+        # UTF-8 usa até 4 bytes por caractere: isso garante max_chars + 1 caracteres
+        data = zlib.decompressobj().decompress(blob[1:], max_chars * 4 + 4)
+    else:
+        data = blob[1:max_chars * 4 + 5]
+    text = data.decode('utf-8', errors='ignore')
+    return text[:max_chars], len(text) > max_chars
+
+
+def messages_user_text(messages):
+    """Texto das mensagens do usuário (para indexação); prompts antigos em texto passam direto"""
+    if not isinstance(messages, list):
+        return str(messages or '')
+    return "\n\n".join(
+        msg.get('content', '') for msg in messages
+        if isinstance(msg, dict) and msg.get('role') == 'user' and isinstance(msg.get('content'), str)
+    )
+
+
+def user_text(prompt_z):
+    """Texto das mensagens do usuário de um prompt_z (para indexação)"""
+    text = decompress_text(prompt_z)
+    if not text:
+        return ''
+    try:
+        messages = json.loads(text)
+    except ValueError:
+        return text
+    return messages_user_text(messages) if isinstance(messages, list) else text
+
+
+def index_search_rows(conn, entries):
+    """Acrescenta [(id, texto do usuário, resposta)] ao índice de busca (api/history_search.py).
+
+    O índice é mantido aqui, em Python, e não por triggers: uma gravação no
+    histórico feita por qualquer conexão (sqlite3, scripts) não depende de
+    funções SQL registradas. Sem a tabela historico_fts (banco ainda não
+    migrado) não faz nada; a migração indexa as linhas existentes.
+    """
+    if not entries:
+        return
+    has_index = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'historico_fts'"
+    ).fetchone()
+    if has_index:
+        conn.executemany(
+            'INSERT INTO historico_fts (rowid, prompt_usuario, resposta) VALUES (?, ?, ?)',
+            [(row_id, prompt, resposta or '') for row_id, prompt, resposta in entries]
+        )
+
+
+def split_system_prompt(messages):
+    """Separa o system prompt (guardado à parte) das demais mensagens"""
+    system_parts = [msg.get('content', '') for msg in messages if msg.get('role') == 'system']
+    others = [msg for msg in messages if msg.get('role') != 'system']
+    system_text = "\n\n".join(part for part in system_parts if isinstance(part, str)) or None
+    return system_text, others
+
+
+def ensure_schema(conn):
+    """Cria system_prompts, as colunas compactas/de prévia, o índice de paginação e o contador"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS system_prompts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            hash TEXT UNIQUE,
+            conteudo BLOB,
+            data DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(historico)')}
+    for column, column_type in (
+        ('system_prompt_id', 'INTEGER'), ('prompt_z', 'BLOB'), ('resposta_z', 'BLOB'),
+        ('prompt_preview', 'TEXT'), ('resposta_preview', 'TEXT'),
+    ):
+        if column not in columns:
+            conn.execute(f'ALTER TABLE historico ADD COLUMN {column} {column_type}')
+
+    # Paginação por cursor (data, id) sem varrer a tabela
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_historico_data_id ON historico(data DESC, id DESC)')
+
+    # Total de registros mantido por triggers (evita COUNT(*) a cada chamada)
+    has_stats = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'historico_stats'"
+    ).fetchone()
+    if not has_stats:
+        conn.execute('CREATE TABLE historico_stats (chave TEXT PRIMARY KEY, valor INTEGER NOT NULL)')
+        conn.execute("INSERT INTO historico_stats (chave, valor) SELECT 'total', COUNT(*) FROM historico")
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_historico_total_insert AFTER INSERT ON historico BEGIN
+            UPDATE historico_stats SET valor = valor + 1 WHERE chave = 'total';
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_historico_total_delete AFTER DELETE ON historico BEGIN
+            UPDATE historico_stats SET valor = valor - 1 WHERE chave = 'total';
+        END
+    ''')
+
+
+def count_rows(conn):
+    row = conn.execute("SELECT valor FROM historico_stats WHERE chave = 'total'").fetchone()
+    return row[0] if row else conn.execute('SELECT COUNT(*) FROM historico').fetchone()[0]
+
+
+def make_previews(prompt_json, resposta):
+    """Prévias em texto puro com 1 caractere a mais (o SQL detecta o corte e adiciona '...')"""
+    return (
+        (prompt_json or '')[:PROMPT_PREVIEW_CHARS + 1],
+        (resposta or '')[:RESPOSTA_PREVIEW_CHARS + 1],
+    )
+
+
+def get_system_prompt_id(conn, system_text, cache=None):
+    """ID do system prompt, gravando-o na primeira vez que aparece"""
+    if not system_text:
+        return None
+    digest = hashlib.sha256(system_text.encode('utf-8')).hexdigest()
+    if cache is not None and digest in cache:
+        return cache[digest]
+    conn.execute(
+        'INSERT OR IGNORE INTO system_prompts (hash, conteudo) VALUES (?, ?)',
+        (digest, compress_text(system_text))
+    )
+    prompt_id = conn.execute('SELECT id FROM system_prompts WHERE hash = ?', (digest,)).fetchone()[0]
+    if cache is not None:
+        cache[digest] = prompt_id
+    return prompt_id
+
+
+def encode_row(conn, messages, resposta, cache=None):
+    """Converte (mensagens, resposta) para
+    ((system_prompt_id, prompt_z, resposta_z, prompt_preview, resposta_preview), texto do usuário)"""
+    if isinstance(messages, str):
+        messages = parse_legacy_prompt(messages)
+    if isinstance(messages, list):
+        system_text, others = split_system_prompt(messages)
+        prompt_json = json.dumps(others, ensure_ascii=False)
+    else:
+        system_text, prompt_json = None, str(messages)
+    encoded = (
+        get_system_prompt_id(conn, system_text, cache),
+        compress_text(prompt_json),
+        compress_text(resposta),
+    ) + make_previews(prompt_json, resposta)
+    return encoded, messages_user_text(messages)
+
+
+def insert_rows(conn, rows):
+    """Grava [(usuario, mensagens, resposta)] no formato compacto e no índice de busca (sem commit).
+
+    Retorna os IDs gravados, na mesma ordem das linhas.
+    """
+    cache = {}
+    ids = []
+    entries = []
+    for usuario, messages, resposta in rows:
+        encoded, prompt_text = encode_row(conn, messages, resposta, cache)
+        cursor = conn.execute(
+            'INSERT INTO historico (usuario, system_prompt_id, prompt_z, resposta_z, prompt_preview, resposta_preview) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (usuario,) + encoded
+        )
+        ids.append(cursor.lastrowid)
+        entries.append((cursor.lastrowid, prompt_text, resposta))
+    index_search_rows(conn, entries)
+    return ids
+
+
+def parse_legacy_prompt(prompt):
+    """Registros antigos guardavam str(messages); recupera a lista quando possível"""
+    try:
+        value = ast.literal_eval(prompt)
+        if isinstance(value, list):
+            return value
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        pass
+    return prompt
+
+
+def load_messages(conn, system_prompt_id, prompt_z):
+    """Reconstrói a lista completa de mensagens (system + demais)"""
+    messages = json.loads(decompress_text(prompt_z) or '[]')
+    if system_prompt_id:
+        row = conn.execute('SELECT conteudo FROM system_prompts WHERE id = ?', (system_prompt_id,)).fetchone()
+        if row:
+            messages.insert(0, {'role': 'system', 'content': decompress_text(row[0])})
+    return messages
+
+
+def migrate_legacy_rows(conn, batch_size=MIGRATION_BATCH):
+    """Converte linhas antigas (prompt/resposta em TEXT) para o formato compacto.
+
+    Processa em lotes e libera as colunas antigas. Retorna quantas linhas migrou.
+    """
+    migrated = 0
+    cache = {}
+    while True:
+        rows = conn.execute(
+            'SELECT id, prompt, resposta FROM historico WHERE prompt_z IS NULL AND '
+            '(prompt IS NOT NULL OR resposta IS NOT NULL) LIMIT ?',
+            (batch_size,)
+        ).fetchall()
+        if not rows:
+            break
+        entries = []
+        for row_id, prompt, resposta in rows:
+            encoded, prompt_text = encode_row(conn, prompt or '[]', resposta, cache)
+            conn.execute(
+                'UPDATE historico SET system_prompt_id = ?, prompt_z = ?, resposta_z = ?, '
+                'prompt_preview = ?, resposta_preview = ?, prompt = NULL, resposta = NULL WHERE id = ?',
+                encoded + (row_id,)
+            )
+            entries.append((row_id, prompt_text, resposta))
+        # Linhas antigas (prompt_z nulo) ainda não estavam no índice
+        index_search_rows(conn, entries)
+        conn.commit()
+        migrated += len(rows)
+    return migrated + backfill_previews(conn, batch_size)
+
+
+def backfill_previews(conn, batch_size=MIGRATION_BATCH):
+    """Preenche as prévias de linhas já compactadas antes de existirem as colunas de prévia"""
+    filled = 0
+    while True:
+        rows = conn.execute(
+            'SELECT id, prompt_z, resposta_z FROM historico '
+            'WHERE prompt_preview IS NULL AND prompt_z IS NOT NULL LIMIT ?',
+            (batch_size,)
+        ).fetchall()
+        if not rows:
+            break
+        for row_id, prompt_z, resposta_z in rows:
+            prompt_preview, _ = decompress_preview(prompt_z, PROMPT_PREVIEW_CHARS + 1)
+            resposta_preview, _ = decompress_preview(resposta_z, RESPOSTA_PREVIEW_CHARS + 1)
+            conn.execute(
+                'UPDATE historico SET prompt_preview = ?, resposta_preview = ? WHERE id = ?',
+                (prompt_preview or '', resposta_preview or '', row_id)
+            )
+        conn.commit()
+        filled += len(rows)
+    return filled
+
+
+if __name__ == '__main__':
+    import os
+
+    default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'historico_base.db')
+    db_path = sys.argv[1] if len(sys.argv) > 1 else default_path
+    size_before = os.path.getsize(db_path)
+    conn = connect(db_path)
+    ensure_schema(conn)
+    from api.history_search import ensure_search_schema
+    ensure_search_schema(conn)
+    conn.commit()
+    total = migrate_legacy_rows(conn)
+    conn.execute('VACUUM')  # Devolve ao disco o espaço das colunas antigas
+    conn.close()
+    size_after = os.path.getsize(db_path)
+    print(f"✅ {total} registros migrados | {size_before / 1024:.0f}KB → {size_after / 1024:.0f}KB")
@@ -0,0 +1,151 @@
+"""Gravador de histórico em lote com fila limitada
+
+Substitui "uma thread + uma conexão por resposta": uma única thread por
+processo consome a fila e grava vários registros por transação. Com a fila
+cheia, quem chama espera um pouco (backpressure) e, se ainda assim não houver
+espaço, o registro é descartado e contabilizado. No desligamento a fila é
+esvaziada antes de sair.
+"""
+import os
+import queue
+import threading
+import time
+
+HISTORY_QUEUE_SIZE = int(os.getenv('HISTORY_QUEUE_SIZE', 1000))
+HISTORY_BATCH_SIZE = int(os.getenv('HISTORY_BATCH_SIZE', 50))
+HISTORY_FLUSH_INTERVAL = float(os.getenv('HISTORY_FLUSH_INTERVAL', 0.5))  # Espera máxima para juntar um lote
+HISTORY_PUT_TIMEOUT = 0.5  # Backpressure: quanto quem chama espera por espaço na fila
+
+_STOP = object()
+
+
+def _empty_stats():
+    return {
+        'written': 0, 'dropped': 0, 'failed': 0, 'batches': 0,
+        'last_flush_ms': 0.0, 'max_flush_ms': 0.0, 'total_flush_ms': 0.0,
+    }
+
+
+class HistoryWriter:
+    """Uma thread de gravação por processo (criada sob demanda, inclusive após fork)"""
+
+    def __init__(self, write_batch, maxsize=HISTORY_QUEUE_SIZE, batch_size=HISTORY_BATCH_SIZE,
+                 flush_interval=HISTORY_FLUSH_INTERVAL):
+        self.write_batch = write_batch  # função(lista_de_linhas) que grava em uma transação
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+        self._queue = None
+        self._stats = _empty_stats()
+
+    def _ensure_started(self):
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                # Processo novo (worker após fork): fila e contadores próprios
+                self._queue = queue.Queue(maxsize=self.maxsize)
+                self._stats = _empty_stats()
+                self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, row):
+        """Enfileira uma linha. Retorna False se ela foi descartada (fila cheia)."""
+        self._ensure_started()
+        try:
+            self._queue.put(row, timeout=HISTORY_PUT_TIMEOUT)
+            return True
+        except queue.Full:
+            with self._lock:
+                self._stats['dropped'] += 1
+            print(f"⚠️ Fila do histórico cheia ({self.maxsize}); registro descartado")
+            return False
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+            for _ in range(len(batch) + (1 if stop else 0)):
+                self._queue.task_done()
+            if stop:
+                return
+
+    def _flush(self, batch):
+        start = time.perf_counter()
+        try:
+            self.write_batch(batch)
+            ok = True
+        except Exception as e:
+            ok = False
+            print(f"❌ Erro ao salvar lote do histórico ({len(batch)} registros): {e}")
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            if ok:
+                self._stats['written'] += len(batch)
+            else:
+                self._stats['failed'] += len(batch)
+            self._stats['batches'] += 1
+            self._stats['last_flush_ms'] = elapsed_ms
+            self._stats['max_flush_ms'] = max(self._stats['max_flush_ms'], elapsed_ms)
+            self._stats['total_flush_ms'] += elapsed_ms
+
+    def flush(self, timeout=10):
+        """Espera a fila esvaziar (usado no desligamento). Retorna True se esvaziou a tempo."""
+        if self._pid != os.getpid() or not self._queue:
+            return True
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() > deadline or not (self._thread and self._thread.is_alive()):
+                return False
+            time.sleep(0.01)
+        return True
+
+    def shutdown(self, timeout=10):
+        """Grava o que estiver pendente e encerra a thread"""
+        if self._pid != os.getpid() or not (self._thread and self._thread.is_alive()):
+            return True
+        pending = self._queue.qsize()
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return False
+        self._thread.join(timeout)
+        if pending:
+            print(f"💾 Histórico: {pending} registros pendentes gravados no desligamento")
+        return not self._thread.is_alive()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        batches = stats['batches']
+        total_flush_ms = stats.pop('total_flush_ms')
+        stats['avg_flush_ms'] = round(total_flush_ms / batches, 2) if batches else 0.0
+        stats['last_flush_ms'] = round(stats['last_flush_ms'], 2)
+        stats['max_flush_ms'] = round(stats['max_flush_ms'], 2)
+        stats['queue_depth'] = self._queue.qsize() if self._queue and self._pid == os.getpid() else 0
+        stats['queue_max'] = self.maxsize
+        return stats
@@ -4,274 +4,876 @@ import signal
 import sys
 import threading
 import time
+import json
+import math
+import queue
+import uuid
+import atexit
+import base64
+import re
 from contextlib import contextmanager
 
-# Função para inicializar o banco e criar tabela se não existir
+# Módulos auxiliares em api/ (funciona via gunicorn, Vercel ou `python api/index.py`)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from api.db_pool import SQLitePool, connect
+from api.history_writer import HistoryWriter
+from api.history_search import search_history
+from api.semantic_index import SemanticIndex, analysis_text
+from api.single_flight import SingleFlight
+from api.metrics import Metrics, StageTimer
+from api.memory import memory_manager
+from api.static_assets import StaticAssets
+from api.jobs import JobQueue
+from api.conversations import (
+    CONTEXT_MODES, append_turn, conversation_messages, create_conversation, load_conversation, split_request
+)
+from api.model_router import DEFAULT_EFFORT, ModelRouter
+from api.settings_cache import DEFAULT_SETTINGS, SettingsCache, settings_etag
+from api.prompt_assembly import cached_tokens, responses_prompt
+from api.price_store import find_items, item_stats, record_prices, resolve_item_id
+from api.history_store import PROMPT_PREVIEW_CHARS, RESPOSTA_PREVIEW_CHARS, count_rows, insert_rows
+from api.lazy import LazyObject, is_loaded, load, once
+from api.migrations import SKIP_MIGRATIONS, migrate
+
+# Caminho do banco (HISTORICO_DB_PATH permite apontar para outro arquivo, ex: benchmarks)
+DB_PATH = os.getenv('HISTORICO_DB_PATH', os.path.join(os.path.dirname(__file__), 'historico_base.db'))
+
+# Índice vetorial das análises (memmap ao lado do banco)
+semantic_index = SemanticIndex(os.getenv('SEMANTIC_INDEX_PATH', f"{DB_PATH}-vetores"))
+
+# Banco: migrações versionadas (api/migrations.py). Roda no primeiro uso do banco
+# (get_db_connection) ou no master do gunicorn (warm_up); rotas estáticas e de
+# arquivos nunca esperam por ela. Se falhar (ex: "database is locked", disco só
+# leitura), a exceção sobe para quem pediu a conexão e o próximo uso tenta de novo.
+@once
 def init_db():
     try:
-        db_path = os.path.join(os.path.dirname(__file__), 'historico_base.db')
-        conn = sqlite3.connect(db_path, timeout=10)
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS historico (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                usuario TEXT,
-                prompt TEXT,
-                resposta TEXT,
-                data DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        # Criar tabela de configurações
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS configuracoes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                api_key TEXT UNIQUE,
-                modelo TEXT DEFAULT 'gpt-5',
-                max_tokens INTEGER DEFAULT 8000,
-                chunk_size INTEGER DEFAULT 8000,
-                data_atualizacao DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        conn.commit()
-        conn.close()
-        print("✅ Banco de dados inicializado com sucesso")
+        conn = connect(DB_PATH)  # Também ativa o modo WAL (persistente no arquivo)
+        try:
+            if not SKIP_MIGRATIONS:
+                migrate(conn)
+        finally:
+            conn.close()
     except Exception as e:
         print(f"❌ Erro ao inicializar banco: {e}")
+        raise
+    print("✅ Banco de dados inicializado com sucesso")
 
-# Pool de conexões para SQLite
-@contextmanager
-def get_db_connection():
-    conn = None
+# Análises gravadas por outros processos (ou antes do índice existir) entram no
+# índice semântico fora do caminho da requisição: em uma thread, depois do
+# primeiro uso do banco, ou direto no warm_up do master do gunicorn.
+@once
+def sync_semantic_index():
     try:
-        db_path = os.path.join(os.path.dirname(__file__), 'historico_base.db')
-        conn = sqlite3.connect(db_path, timeout=10)
-        yield conn
+        conn = connect(DB_PATH)
+        try:
+            indexed = semantic_index.sync(conn)
+        finally:
+            conn.close()
+        if indexed:
+            print(f"🧭 {indexed} análises adicionadas ao índice semântico")
     except Exception as e:
-        if conn:
+        print(f"⚠️ Índice semântico não sincronizado: {e}")
+
+@once
+def start_semantic_sync():
+    if not sync_semantic_index.done():
+        threading.Thread(target=sync_semantic_index, name='semantic-sync', daemon=True).start()
+
+# Histogramas por etapa, agregados entre workers em /api/metrics
+metrics = Metrics()
+atexit.register(metrics.flush)
+
+# Pool de conexões para SQLite (reutilizadas por processo, modo WAL)
+db_pool = SQLitePool(DB_PATH, metrics=metrics)
+
+@contextmanager
+def get_db_connection():
+    init_db()  # Só o primeiro uso do processo espera
+    start_semantic_sync()
+    with db_pool.connection() as conn:
+        try:
+            yield conn
+        except Exception as e:
             conn.rollback()
-        print(f"❌ Erro na conexão com banco: {e}")
-        raise
-    finally:
-        if conn:
-            conn.close()
+            print(f"❌ Erro na conexão com banco: {e}")
+            raise
 
-# Inicializar banco ao iniciar app
-init_db()
+# Cache das configurações por processo (invalidado por versão no SQLite)
+settings_cache = SettingsCache(get_db_connection)
 
-from flask import Flask, request, jsonify, send_from_directory, send_file
+from flask import Blueprint, Flask, Response, request, jsonify, send_from_directory, send_file
 from flask_cors import CORS
-import os
-from openai import OpenAI
 from dotenv import load_dotenv
 
+from api.response_cache import ResponseCache, make_cache_key
+from api.ingest import MAX_ESSENTIAL_CHARS, UnsupportedDocumentError, extract_document
+from api.map_reduce import MAP_MAX_TOKENS, run_map_reduce
+from api.token_budget import PromptTooLargeError, count_message_tokens, fit_messages, resolve_max_tokens
+from api.upstream_scheduler import PRIORITIES, UpstreamScheduler, parse_priority
+
 load_dotenv()
-app = Flask(__name__)
-CORS(app)
+# Rotas no blueprint; a aplicação (CORS + middleware) sai de create_app(), no fim do arquivo
+bp = Blueprint('api', __name__)
 
 # Configurações de timeout
 REQUEST_TIMEOUT = 120  # 2 minutos para requisições OpenAI
 OPENAI_TIMEOUT = 90    # 1.5 minutos para OpenAI especificamente
 
 # Middleware de monitoramento
-@app.before_request
 def before_request():
     request.start_time = time.time()
 
-@app.after_request
 def after_request(response):
     duration = time.time() - request.start_time
+    endpoint = (request.endpoint or 'desconhecido').rsplit('.', 1)[-1]  # Sem o prefixo "api." do blueprint
     if duration > 5:  # Log apenas requisições longas
-        print(f"⚠️ Requisição lenta: {request.endpoint} - {duration:.2f}s")
+        print(f"⚠️ Requisição lenta: {endpoint} - {duration:.2f}s")
+    metrics.observe('request_seconds', duration, endpoint=endpoint, status=str(response.status_code))
+    # Coleta de lixo só após payloads grandes, em segundo plano (api/memory.py)
+    memory_manager.after_request(request.content_length, response.content_length)
     return response
 
-# Middleware para limpeza de memória
-import gc
-
-@app.teardown_appcontext  
-def cleanup(exception):
-    gc.collect()  # Forçar garbage collection
-
 # Tratamento de sinais para graceful shutdown
 def signal_handler(signum, frame):
     print(f"\n🛑 Recebido sinal {signum}. Finalizando aplicação...")
+    history_writer.shutdown()
     sys.exit(0)
 
-signal.signal(signal.SIGTERM, signal_handler)
-signal.signal(signal.SIGINT, signal_handler)
+# Workers do gunicorn saem via sys.exit: gravar o histórico pendente antes
+atexit.register(lambda: history_writer.shutdown())
+
+def install_signal_handlers():
+    """Só no servidor de desenvolvimento: no gunicorn os workers têm os próprios handlers"""
+    signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGINT, signal_handler)
+
+# Frontend (HTML/CSS/imagens da raiz) pré-comprimido e versionado no primeiro acesso
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+static_assets = StaticAssets(PROJECT_ROOT)
+
+@bp.route('/assets/<path:filename>')
+def fingerprinted_assets(filename):
+    """Arquivos com hash no nome: cache imutável de 1 ano"""
+    response = static_assets.serve_fingerprinted(request, filename)
+    if response is None:
+        return jsonify({'error': 'Arquivo não encontrado'}), 404
+    return response
 
 # Rota otimizada para servir arquivos estáticos 
-@app.route('/static/<path:filename>')
+@bp.route('/static/<path:filename>')
 def static_files(filename):
     try:
-        static_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'analise-bid-ia-tools')
-        return send_from_directory(static_path, filename, as_attachment=False, cache_timeout=3600)
+        static_path = os.path.join(PROJECT_ROOT, 'analise-bid-ia-tools')
+        return send_from_directory(static_path, filename, as_attachment=False, max_age=3600)
     except Exception as e:
         print(f"❌ Erro ao servir arquivo estático {filename}: {e}")
         return jsonify({'error': 'Arquivo não encontrado'}), 404
 
-# Inicializar o cliente OpenAI com configurações otimizadas
-client = OpenAI(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    timeout=OPENAI_TIMEOUT,
-    max_retries=2
-)
+# Conexões HTTP simultâneas com a OpenAI por worker. O cliente (httpx) é
+# thread-safe e é compartilhado por todas as threads/greenlets do worker.
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", 500))
+
+# Tempo até o primeiro byte da OpenAI: o hook do httpx roda na mesma thread da chamada
+_upstream_timing = threading.local()
+
+def start_upstream_timer(endpoint, model):
+    _upstream_timing.started = time.perf_counter()
+    _upstream_timing.labels = {'endpoint': endpoint, 'model': model}
+
+def record_upstream_ttfb(response):
+    started = getattr(_upstream_timing, 'started', None)
+    if started is not None:
+        _upstream_timing.started = None  # Só a primeira tentativa (retries não contam)
+        metrics.observe('stage_seconds', time.perf_counter() - started, stage='upstream_ttfb',
+                        **_upstream_timing.labels)
+
+def usage_summary(usage):
+    """Tokens da chamada (Responses API ou Chat Completions); cached_tokens = entrada vinda do cache de prompt"""
+    if usage is None:
+        return None
+    return {
+        'input_tokens': getattr(usage, 'input_tokens', None) or getattr(usage, 'prompt_tokens', 0) or 0,
+        'cached_tokens': cached_tokens(usage),
+        'output_tokens': getattr(usage, 'output_tokens', None) or getattr(usage, 'completion_tokens', 0) or 0,
+    }
+
+def record_token_usage(model, usage):
+    summary = usage_summary(usage)
+    if summary is None:
+        return
+    metrics.inc('tokens_total', summary['input_tokens'], model=model, direction='input')
+    metrics.inc('tokens_total', summary['cached_tokens'], model=model, direction='cached_input')
+    metrics.inc('tokens_total', summary['output_tokens'], model=model, direction='output')
+
+# Limites de taxa da OpenAI: fila com prioridade, token buckets e retries com jitter
+upstream_scheduler = UpstreamScheduler(metrics=metrics)
+
+# Modelo, max_tokens e esforço de raciocínio por tipo de tarefa (comparação, pergunta, e-mail, conversa)
+model_router = ModelRouter(metrics=metrics)
+
+def upstream_call(model, messages, max_tokens, priority, func, hold=False):
+    """Executa a chamada pelo agendador (orçamento = entrada estimada + saída máxima)"""
+    return upstream_scheduler.call(model, count_message_tokens(messages) + max_tokens, priority, func, hold=hold)
+
+# Cliente OpenAI com configurações otimizadas
+def create_openai_client():
+    # O SDK leva ~0,7s para importar: só quando a primeira chamada precisar dele
+    import httpx
+    from openai import OpenAI, DefaultHttpxClient
+
+    return OpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        timeout=OPENAI_TIMEOUT,
+        max_retries=0,  # Retries ficam com o upstream_scheduler (backoff com jitter, pausa em 429)
+        http_client=DefaultHttpxClient(
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=100
+            ),
+            event_hooks={'response': [record_upstream_ttfb, upstream_scheduler.observe_response]}
+        )
+    )
+
+client = LazyObject(create_openai_client)  # Criado no primeiro client.responses/client.chat
+
+# Responses API: system prompt fixo em instructions (prefixo em cache) + conversa completa em input
+def build_responses_prompt(messages):
+    """Argumentos instructions/input/prompt_cache_key a partir das mensagens do chat"""
+    prompt = responses_prompt(messages)
+    print(f"📝 System prompt length: {len(prompt.get('instructions', ''))} chars")
+    print(f"📝 Input: {len(prompt['input'])} mensagens")
+    return prompt
 
 # Função para processar requisição com timeout
-def process_openai_request(messages, model, max_tokens):
+def process_openai_request(messages, model, max_tokens, endpoint='chat', priority=PRIORITIES['interativa'],
+                           previous_response_id=None, effort=DEFAULT_EFFORT):
     """Processa requisição OpenAI com controle de timeout"""
+    started = time.perf_counter()
+    start_upstream_timer(endpoint, model)
     try:
-        print(f"� DEBUG: Preparando requisição para {model}...")
-        print(f"   Max Tokens: {max_tokens}")
-        print(f"   Messages count: {len(messages)}")
+        return _process_openai_request(messages, model, max_tokens, priority, previous_response_id, effort)
+    except Exception as e:
+        print(f"❌ ERRO CRÍTICO em process_openai_request: {type(e).__name__}: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        metrics.inc('errors_total', endpoint=endpoint, type=type(e).__name__)
+        return None, str(e)
+    finally:
+        metrics.observe('stage_seconds', time.perf_counter() - started, stage='upstream_total',
+                        endpoint=endpoint, model=model)
+
+def _process_openai_request(messages, model, max_tokens, priority, previous_response_id=None, effort=DEFAULT_EFFORT):
+    """Chamada à OpenAI propriamente dita (exceções tratadas em process_openai_request)"""
+    print(f"� DEBUG: Preparando requisição para {model}...")
+    print(f"   Max Tokens: {max_tokens}")
+    print(f"   Messages count: {len(messages)}")
+    
+    # ⚠️ GPT-5 usa Responses API, não Chat Completions!
+    if model.startswith('gpt-5'):
+        print("🔄 Usando Responses API para GPT-5...")
         
-        # ⚠️ GPT-5 usa Responses API, não Chat Completions!
-        if model.startswith('gpt-5'):
-            print("🔄 Usando Responses API para GPT-5...")
-            
-            # Combinar mensagens para input único (Responses API requer input, não messages)
-            # ⭐ CORREÇÃO: Incluir SYSTEM PROMPT + USER MESSAGE no campo input
-            system_content = ""
-            user_message = ""
-            for msg in messages:
-                if msg.get("role") == "system":
-                    system_content = msg.get("content", "")
-                elif msg.get("role") == "user":
-                    user_message = msg.get("content", "")
-            
-            # Concatenar system prompt com user message para Responses API
-            combined_input = f"INSTRUÇÕES:\n{system_content}\n\nCONTEÚDO:\n{user_message}"
-            
-            print(f"📝 System prompt length: {len(system_content)} chars")
-            print(f"📝 User message length: {len(user_message)} chars")
-            print(f"📝 Combined input length: {len(combined_input)} chars")
-            
-            response = client.responses.create(
-                model=model,
-                input=combined_input,
-                max_output_tokens=max_tokens,
-                reasoning={"effort": "low"},  # Baixo esforço para velocidade
-                text={"verbosity": "high"}  # Alta verbosidade para análise completa
-            )
-            print(f"✅ Resposta GPT-5 recebida | Output tokens: {max_tokens}")
-            
-            # Converter resposta para formato compatível com Chat Completions
-            class CompatResponse:
-                class Choice:
-                    class Message:
-                        def __init__(self, content):
-                            self.content = content
+        prompt = build_responses_prompt(messages)
+        if previous_response_id:
+            prompt['previous_response_id'] = previous_response_id  # Contexto da conversa fica na OpenAI
+        
+        response = upstream_call(model, messages, max_tokens, priority, lambda: client.responses.create(
+            model=model,
+            **prompt,
+            max_output_tokens=max_tokens,
+            reasoning={"effort": effort},  # Definido pela rota (low por padrão, minimal em tarefas simples)
+            text={"verbosity": "high"}  # Alta verbosidade para análise completa
+        ))
+        usage = getattr(response, 'usage', None)
+        print(f"✅ Resposta GPT-5 recebida | Output tokens: {max_tokens} | "
+              f"Tokens em cache: {cached_tokens(usage)}")
+        record_token_usage(model, usage)
+        
+        # Converter resposta para formato compatível com Chat Completions
+        class CompatResponse:
+            class Choice:
+                class Message:
                     def __init__(self, content):
-                        self.message = self.Message(content)
-                        self.finish_reason = "stop"
-                
+                        self.content = content
                 def __init__(self, content):
-                    self.choices = [self.Choice(content)]
+                    self.message = self.Message(content)
+                    self.finish_reason = "stop"
             
-            return CompatResponse(response.output_text), None
+            def __init__(self, content, usage, response_id):
+                self.choices = [self.Choice(content)]
+                self.usage = usage
+                self.id = response_id
         
-        else:
-            # Chat Completions API para outros modelos (GPT-4, etc)
-            print(f"🔄 Usando Chat Completions API para {model}...")
-            temperature = 0.7
-            
-            try:
-                response = client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    max_completion_tokens=max_tokens,
-                    temperature=temperature,
-                    timeout=OPENAI_TIMEOUT
-                )
-                print(f"✅ Usando max_completion_tokens: {max_tokens} | temperature: {temperature}")
-                return response, None
-            except TypeError:
-                # Fallback para versão antiga do SDK
-                response = client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    max_tokens=max_tokens,
-                    temperature=temperature,
-                    timeout=OPENAI_TIMEOUT
-                )
-                print(f"✅ Usando max_tokens (compatibilidade): {max_tokens}")
-                return response, None
-                
+        return CompatResponse(response.output_text, usage, getattr(response, 'id', None)), None
+    
+    else:
+        # Chat Completions API para outros modelos (GPT-4, etc)
+        print(f"🔄 Usando Chat Completions API para {model}...")
+        temperature = 0.7
+        
+        try:
+            response = upstream_call(model, messages, max_tokens, priority, lambda: client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_completion_tokens=max_tokens,
+                temperature=temperature,
+                timeout=OPENAI_TIMEOUT
+            ))
+            print(f"✅ Usando max_completion_tokens: {max_tokens} | temperature: {temperature}")
+            record_token_usage(model, getattr(response, 'usage', None))
+            return response, None
+        except TypeError:
+            # Fallback para versão antiga do SDK
+            response = upstream_call(model, messages, max_tokens, priority, lambda: client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                timeout=OPENAI_TIMEOUT
+            ))
+            print(f"✅ Usando max_tokens (compatibilidade): {max_tokens}")
+            record_token_usage(model, getattr(response, 'usage', None))
+            return response, None
+
+# Cache de respostas (memória + SQLite compartilhado entre workers)
+response_cache = LazyObject(ResponseCache)  # SQLite do cache aberto no primeiro uso
+
+single_flight = LazyObject(SingleFlight)  # Diretório das travas criado no primeiro uso
+
+def coalesced_completion(key, messages, model, max_tokens, endpoint='chat', priority=PRIORITIES['interativa'],
+                         previous_response_id=None, effort=DEFAULT_EFFORT):
+    """process_openai_request com single-flight por chave.
+
+    Retorna ({'content', 'finish_reason'} ou {'error'}, coalescido) — um dict
+    simples para poder ser repassado a outros workers.
+    """
+    def call():
+        response, error = process_openai_request(messages, model, max_tokens, endpoint, priority, previous_response_id,
+                                                 effort)
+        if error:
+            return {'error': f'Erro na API OpenAI: {error}'}
+        if not response:
+            return {'error': 'Resposta nula da OpenAI'}
+        if not response.choices:
+            return {'error': 'Resposta vazia da OpenAI (choices vazio)'}
+        choice = response.choices[0]
+        return {'content': choice.message.content, 'finish_reason': getattr(choice, 'finish_reason', None),
+                'usage': usage_summary(getattr(response, 'usage', None)), 'response_id': getattr(response, 'id', None)}
+    result, coalesced = single_flight.do(key, call)
+    metrics.inc('single_flight_total', endpoint=endpoint, result='coalesced' if coalesced else 'leader')
+    return result, coalesced
+
+def get_cache_mode(data):
+    """Modo de cache da requisição: True (padrão), False (ignorar) ou 'refresh' (recalcular)"""
+    if 'no-cache' in request.headers.get('Cache-Control', '').lower():
+        return 'refresh'
+    mode = data.get('cache', True)
+    if mode in (False, 'false', '0', 'bypass'):
+        return False
+    if mode == 'refresh':
+        return 'refresh'
+    return True
+
+# Streaming: gera apenas os trechos de texto (deltas) conforme chegam da OpenAI
+def stream_openai_request(messages, model, max_tokens, endpoint='chat', priority=PRIORITIES['interativa'],
+                          previous_response_id=None, info=None, effort=DEFAULT_EFFORT):
+    """Gera os deltas de texto da OpenAI (Responses API ou Chat Completions).
+
+    info (dict opcional) recebe response_id e usage quando o stream termina.
+    """
+    start_upstream_timer(endpoint, model)
+    error = None
+    info = {} if info is None else info
+    if model.startswith('gpt-5'):
+        print("🔄 Usando Responses API (stream) para GPT-5...")
+        prompt = build_responses_prompt(messages)
+        if previous_response_id:
+            prompt['previous_response_id'] = previous_response_id
+        # A vaga no agendador fica ocupada até o fim do stream
+        stream, ticket = upstream_call(model, messages, max_tokens, priority, lambda: client.responses.create(
+            model=model,
+            **prompt,
+            max_output_tokens=max_tokens,
+            reasoning={"effort": effort},
+            text={"verbosity": "high"},
+            stream=True
+        ), hold=True)
+        try:
+            for event in stream:
+                if event.type == "response.output_text.delta":
+                    yield event.delta
+                elif event.type == "response.completed":
+                    completed = getattr(event, 'response', None)
+                    record_token_usage(model, getattr(completed, 'usage', None))
+                    info['response_id'] = getattr(completed, 'id', None)
+                    info['usage'] = usage_summary(getattr(completed, 'usage', None))
+                elif event.type in ("response.failed", "error"):
+                    raise RuntimeError(f"Falha no stream da Responses API: {event.type}")
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            stream.close()
+            if ticket:
+                upstream_scheduler.release(ticket, error)
+    else:
+        print(f"🔄 Usando Chat Completions API (stream) para {model}...")
+        stream, ticket = upstream_call(model, messages, max_tokens, priority, lambda: client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_completion_tokens=max_tokens,
+            temperature=0.7,
+            timeout=OPENAI_TIMEOUT,
+            stream=True
+        ), hold=True)
+        try:
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            stream.close()
+            if ticket:
+                upstream_scheduler.release(ticket, error)
+
+# Intervalo entre comentários keep-alive do SSE (evita timeout de proxies)
+SSE_KEEPALIVE_SECONDS = 15
+
+def sse_event(payload, event=None):
+    """Formata um evento Server-Sent Events"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+def stream_chat_response(messages, model, max_tokens, usuario, start_time, cache_key=None, tokens_info=None,
+                         priority=PRIORITIES['interativa'], conversation=None, route=None):
+    """Relaya os tokens da OpenAI como SSE.
+
+    O consumo do upstream roda em uma thread própria: se o cliente desconectar
+    no meio, a thread continua até o fim e o texto final ainda vai para o histórico.
+    """
+    events = queue.Queue()
+
+    def upstream_task():
+        parts = []
+        info = {}
+        started = time.perf_counter()
+        try:
+            for delta in stream_openai_request(messages, model, max_tokens, priority=priority,
+                                               previous_response_id=(conversation or {}).get('previous_response_id'),
+                                               info=info, effort=(route or {}).get('esforco', DEFAULT_EFFORT)):
+                parts.append(delta)
+                events.put(("delta", delta))
+            metrics.observe('stage_seconds', time.perf_counter() - started, stage='upstream_total',
+                            endpoint='chat', model=model)
+            model_router.record(route, time.perf_counter() - started, info.get('usage'))
+            content = "".join(parts) or "(Resposta vazia recebida da OpenAI)"
+            processing_time = time.time() - start_time
+            print(f"✅ Stream concluído | {len(content)} caracteres | {processing_time:.2f}s")
+            save_to_history_async(usuario, messages, content, precos=is_comparison(route))
+            if cache_key and parts:
+                response_cache.set(cache_key, model, content)
+            record_conversation_turn(conversation, model, content, info.get('response_id'), info.get('usage'))
+            events.put(("done", {
+                'processing_time': round(processing_time, 2),
+                'content_length': len(content),
+                'cache_hit': False,
+                'tokens_info': tokens_info,
+                'conversation_id': (conversation or {}).get('id'),
+                'roteamento': route
+            }))
+        except Exception as e:
+            print(f"❌ ERRO no stream OpenAI: {type(e).__name__}: {str(e)}")
+            metrics.inc('errors_total', endpoint='chat', type=type(e).__name__)
+            if parts:
+                # Salvar o que já foi pago, mesmo incompleto
+                save_to_history_async(usuario, messages, "".join(parts) + "\n\n[resposta interrompida]")
+            events.put(("error", {'error': f'Erro na API OpenAI: {str(e)}'}))
+
+    thread = threading.Thread(target=upstream_task)
+    thread.daemon = True
+    thread.start()
+
+    def generate():
+        try:
+            while True:
+                try:
+                    kind, payload = events.get(timeout=SSE_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if kind == "delta":
+                    yield sse_event({'delta': payload})
+                else:
+                    yield sse_event(payload, event=kind)
+                    return
+        except GeneratorExit:
+            # Cliente desconectou: a thread do upstream segue e salva o histórico
+            print("⚠️ Cliente desconectou durante o stream; concluindo em segundo plano")
+            raise
+
+    return sse_response(generate())
+
+def sse_response(generator):
+    return Response(generator, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+# Gravação do histórico em lote (uma transação por lote, uma thread por worker)
+def write_history_batch(rows):
+    """rows: [(usuario, mensagens, resposta, extrair_precos)]"""
+    with get_db_connection() as conn:
+        ids = insert_rows(conn, [row[:3] for row in rows])  # Serialização e compressão ficam fora da requisição
+        cache = {}
+        for historico_id, (_, _, resposta, precos) in zip(ids, rows):
+            # Falha na extração de preços nunca impede a gravação do histórico
+            record_prices(conn, historico_id, resposta, precos, cache=cache)
+        conn.commit()
+    try:
+        semantic_index.append(ids, [analysis_text(messages, resposta) for _, messages, resposta, _ in rows])
     except Exception as e:
-        print(f"❌ ERRO CRÍTICO em process_openai_request: {type(e).__name__}: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return None, str(e)
+        print(f"⚠️ Erro ao atualizar índice semântico: {e}")
+    print(f"✅ Histórico salvo com sucesso ({len(rows)} registros)")
+
+history_writer = HistoryWriter(write_history_batch)
 
 # Função assíncrona para salvar histórico
-def save_to_history_async(usuario, prompt, resposta):
-    """Salva histórico de forma assíncrona para não bloquear resposta"""
-    def save_task():
-        try:
+def save_to_history_async(usuario, prompt, resposta, precos=False):
+    """Enfileira o histórico para o gravador em lote, sem bloquear a resposta.
+
+    precos=True só para análises comparativas: perguntas e e-mails não alimentam a tabela de preços.
+    """
+    return history_writer.submit((usuario, prompt, resposta, precos))
+
+def is_comparison(route):
+    return (route or {}).get('tarefa') == 'comparacao'
+
+def load_documents(document_ids):
+    """Busca documentos ingeridos. Retorna ({id: (nome, conteudo)}, ids_nao_encontrados)"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        placeholders = ','.join('?' for _ in document_ids)
+        cursor.execute(
+            f'SELECT id, nome, conteudo FROM documentos WHERE id IN ({placeholders})',
+            list(document_ids)
+        )
+        found = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+    return found, [doc_id for doc_id in document_ids if doc_id not in found]
+
+def attach_documents(messages, document_ids):
+    """Anexa o conteúdo dos documentos ingeridos à última mensagem do usuário.
+
+    Retorna (messages, ids_nao_encontrados).
+    """
+    found, missing = load_documents(document_ids)
+    if missing:
+        return messages, missing
+
+    documents_text = "\n\n".join(
+        f"=== ARQUIVO: {found[doc_id][0]} ===\n{found[doc_id][1]}" for doc_id in document_ids
+    )
+    messages = [dict(msg) for msg in messages]
+    for msg in reversed(messages):
+        if msg.get('role') == 'user':
+            msg['content'] = f"{msg.get('content', '')}\n\n{documents_text}".strip()
+            break
+    else:
+        messages.append({'role': 'user', 'content': documents_text})
+    return messages, []
+
+SEMANTIC_TOP_K = int(os.getenv('SEMANTIC_TOP_K', 3))
+SEMANTIC_MIN_SCORE = 0.2  # Abaixo disso a análise antiga não é relevante o bastante
+HISTORY_QUESTION_RE = re.compile(
+    r'hist[óo]ric|anteriores|j[áa] cotad|compar\w*\s+com\s+(as\s+|os\s+)?(an[áa]lises|cota[çc][õo]es|pre[çc]os)',
+    re.IGNORECASE
+)
+
+def attach_history_context(messages, use_history=None):
+    """Injeta as análises anteriores mais parecidas (índice semântico) antes da última pergunta.
+
+    use_history: True/False força; None decide pela pergunta ("compare com o histórico").
+    Retorna (messages, ids_das_analises_usadas).
+    """
+    question = next(
+        (msg.get('content') for msg in reversed(messages)
+         if msg.get('role') == 'user' and isinstance(msg.get('content'), str)),
+        ''
+    )
+    if use_history is None:
+        use_history = bool(HISTORY_QUESTION_RE.search(question))
+    if not use_history or not question:
+        return messages, []
+
+    hits = [(hit_id, score) for hit_id, score in semantic_index.search([question], SEMANTIC_TOP_K)[0]
+            if score >= SEMANTIC_MIN_SCORE]
+    if not hits:
+        return messages, []
+    with get_db_connection() as conn:
+        placeholders = ','.join('?' * len(hits))
+        rows = conn.execute(
+            f'SELECT id, data, resposta_preview FROM historico WHERE id IN ({placeholders})',
+            [hit_id for hit_id, _ in hits]
+        ).fetchall()
+    previews = {row[0]: (row[1], row[2]) for row in rows}
+    hits = [(hit_id, score) for hit_id, score in hits if hit_id in previews]
+    if not hits:
+        return messages, []
+    blocks = [
+        f"--- Análise #{hit_id} ({previews[hit_id][0]}, similaridade {score:.2f}) ---\n{previews[hit_id][1]}"
+        for hit_id, score in hits
+    ]
+
+    context = {
+        'role': 'system',
+        'content': "ANÁLISES ANTERIORES RELEVANTES (base histórica, use para comparar):\n\n" + "\n\n".join(blocks)
+    }
+    last_user = max(index for index, msg in enumerate(messages) if msg.get('role') == 'user')
+    return messages[:last_user] + [context] + messages[last_user:], [hit_id for hit_id, _ in hits]
+
+@bp.route('/api/ingest', methods=['POST'])
+def ingest():
+    """Recebe PDFs/planilhas (multipart), extrai o conteúdo essencial e devolve IDs para o /api/chat"""
+    start_time = time.time()
+    files = request.files.getlist('files') + request.files.getlist('file')
+    if not files:
+        return jsonify({'error': 'Nenhum arquivo enviado (campo "files")'}), 400
+
+    max_chars = request.form.get('max_chars', MAX_ESSENTIAL_CHARS, type=int)
+    max_chars = max(500, min(max_chars, 50000))
+
+    documentos = []
+    try:
+        for file in files:
+            try:
+                tipo, conteudo, blocos, truncado = extract_document(file.stream, file.filename, max_chars)
+            except UnsupportedDocumentError as e:
+                return jsonify({'error': str(e)}), 415
+
+            doc_id = uuid.uuid4().hex
             with get_db_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute(
-                    'INSERT INTO historico (usuario, prompt, resposta) VALUES (?, ?, ?)',
-                    (usuario, str(prompt), resposta)
+                    'INSERT INTO documentos (id, nome, tipo, conteudo, caracteres, blocos, truncado) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (doc_id, file.filename, tipo, conteudo, len(conteudo), blocos, int(truncado))
                 )
                 conn.commit()
-                print("✅ Histórico salvo com sucesso")
-        except Exception as e:
-            print(f"❌ Erro ao salvar histórico: {e}")
-    
-    # Executar em thread separada
-    thread = threading.Thread(target=save_task)
-    thread.daemon = True
-    thread.start()
 
-@app.route('/api/chat', methods=['POST'])
+            print(f"📄 Documento ingerido: {file.filename} ({tipo}) | {blocos} blocos | {len(conteudo)} caracteres")
+            documentos.append({
+                'document_id': doc_id,
+                'nome': file.filename,
+                'tipo': tipo,
+                'caracteres': len(conteudo),
+                'blocos': blocos,
+                'truncado': truncado,
+                'preview': conteudo[:500]
+            })
+    except Exception as e:
+        print(f"❌ Erro na ingestão de documentos: {type(e).__name__}: {e}")
+        return jsonify({'error': f'Erro ao processar arquivo: {str(e)}'}), 422
+
+    return jsonify({
+        'documentos': documentos,
+        'processing_time': round(time.time() - start_time, 2)
+    })
+
+class ChatRequestError(Exception):
+    """Erro no pedido do cliente (vira resposta 4xx)"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def prepare_conversation(data, messages, model):
+    """Com conversation_id, remonta o contexto guardado no servidor.
+
+    Retorna (messages, conversa); conversa é None sem conversation_id.
+    """
+    conversation_id = data.get('conversation_id')
+    if not conversation_id:
+        return messages, None
+    mode = data.get('contexto') or 'resumo'
+    if mode not in CONTEXT_MODES:
+        raise ChatRequestError(f'contexto deve ser um de: {", ".join(CONTEXT_MODES)}')
+    with get_db_connection() as conn:
+        stored = load_conversation(conn, conversation_id)
+    if stored is None:
+        raise ChatRequestError('Conversa não encontrada', 404)
+    system, _, question = split_request(messages)
+    messages, previous_response_id = conversation_messages(stored, messages, model, mode)
+    print(f"💬 Conversa {conversation_id[:8]}: {len(stored['turnos'])} turno(s) anteriores | contexto: {mode}")
+    return messages, {
+        'id': conversation_id,
+        'instructions': "\n\n".join(msg.get('content') or '' for msg in system if isinstance(msg.get('content'), str)),
+        'question': question,
+        'previous_response_id': previous_response_id,
+    }
+
+def request_key(model, max_tokens, messages, conversation=None):
+    """Chave do cache/single-flight; com previous_response_id o contexto não está nas mensagens"""
+    previous_response_id = (conversation or {}).get('previous_response_id')
+    if previous_response_id:
+        messages = messages + [{'role': 'system', 'content': f'previous_response_id={previous_response_id}'}]
+    return make_cache_key(model, max_tokens, messages)
+
+def record_conversation_turn(conversation, model, answer, response_id=None, usage=None):
+    """Guarda pergunta e resposta na conversa (sem conversa, não faz nada)"""
+    if not conversation:
+        return
+    try:
+        with get_db_connection() as conn:
+            append_turn(conn, conversation['id'], conversation['instructions'], conversation['question'],
+                        answer, model, response_id, usage)
+            conn.commit()
+    except Exception as e:
+        print(f"⚠️ Erro ao salvar turno da conversa {conversation['id'][:8]}: {e}")
+
+def prepare_chat_messages(data, messages, model, max_tokens):
+    """Documentos do /api/ingest, contexto histórico e orçamento de tokens.
+
+    Retorna (messages, tokens_info, historico_ids); usado por /api/chat e /api/jobs.
+    """
+    document_ids = data.get('document_ids') or []
+    if document_ids:
+        messages, missing = attach_documents(messages, document_ids)
+        if missing:
+            raise ChatRequestError(f'Documento(s) não encontrado(s): {", ".join(missing)}', 404)
+
+    # Contexto da base histórica: {"historico_contexto": true/false}; sem o campo, decide pela pergunta
+    messages, historico_ids = attach_history_context(messages, data.get('historico_contexto'))
+    if historico_ids:
+        print(f"🧭 Análises anteriores no contexto: {historico_ids}")
+
+    # Orçamento de tokens do modelo: corta o excesso em vez de recusar
+    try:
+        messages, tokens_info = fit_messages(messages, model, max_tokens)
+    except PromptTooLargeError as e:
+        raise ChatRequestError(f'Prompt muito longo. {str(e)}')
+    print(f"🔢 Tokens de entrada: {tokens_info['input_tokens']} / {tokens_info['max_input_tokens']}")
+    return messages, tokens_info, historico_ids
+
+@bp.route('/api/chat', methods=['POST'])
 def chat():
     start_time = time.time()
+    stages = StageTimer()
+    model = '-'
     
     try:
         data = request.json
+        stages.lap('parse')
         messages = data.get('messages', [])
-        model = data.get('model', 'gpt-4')
+        # Fila do upstream: "interativa" (padrão) passa na frente de "normal" e "baixa" (ex: gerar e-mail)
+        priority = parse_priority(data.get('prioridade'))
         
-        # Limites por modelo: GPT-5 permite mais tokens
-        if model.startswith('gpt-5'):
-            max_tokens = min(data.get('max_tokens', 6000), 12000)  # GPT-5: até 12k tokens
-        else:
-            max_tokens = min(data.get('max_tokens', 2000), 4000)   # Outros: até 4k tokens
+        # Documentos extraídos via /api/ingest são referenciados por ID
+        document_ids = data.get('document_ids') or []
+
+        # Modelo e max_tokens pela rota da tarefa (limites por modelo: GPT-5 até 12k de saída, outros até 4k)
+        route = model_router.route(data, messages)
+        model, max_tokens = route['modelo'], route['max_tokens']
         
         print("🚀 === NOVA REQUISIÇÃO DE ANÁLISE ===")
+        print(f"🧭 Rota: {route['tarefa']} | {route['modelo_pedido']} -> {model} | esforço: {route['esforco']}")
         print(f"📧 Modelo: {model}")
         print(f"🔢 Max Tokens: {max_tokens}")
         print(f"📝 Total de mensagens: {len(messages)}")
         print("=" * 50)
 
         # Validação básica
-        if not messages:
+        if not messages and not document_ids:
             return jsonify({'error': 'Nenhuma mensagem fornecida'}), 400
+        stages.lap('validation')
         
-        if len(str(messages)) > 50000:  # Limitar tamanho do prompt
-            return jsonify({'error': 'Prompt muito longo. Reduza o tamanho do texto.'}), 400
+        try:
+            # Conversa no servidor: a pergunta chega sozinha e o contexto vem do SQLite
+            messages, conversation = prepare_conversation(data, messages, model)
+            messages, tokens_info, historico_ids = prepare_chat_messages(data, messages, model, max_tokens)
+        except ChatRequestError as e:
+            return jsonify({'error': str(e)}), e.status
+        stages.lap('prompt_assembly')
 
-        # Processar requisição OpenAI
-        response, error = process_openai_request(messages, model, max_tokens)
-        
-        if error:
-            print(f"❌ ERRO na API OpenAI: {error}")
-            return jsonify({'error': f'Erro na API OpenAI: {error}'}), 500
-        
-        if not response:
-            print("❌ Response é None!")
-            return jsonify({'error': 'Resposta nula da OpenAI'}), 500
+        streaming = request.args.get('stream') in ('1', 'true') or data.get('stream') is True
 
-        if not response.choices:
-            print("❌ Response.choices vazio!")
-            return jsonify({'error': 'Resposta vazia da OpenAI (choices vazio)'}), 500
+        # Cache de respostas: {"cache": false} ignora, {"cache": "refresh"} recalcula
+        cache_mode = get_cache_mode(data)
+        cache_key = request_key(model, max_tokens, messages, conversation) if cache_mode else None
+        if cache_key and cache_mode == 'refresh':
+            response_cache.invalidate(cache_key)
+        elif cache_key:
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                processing_time = time.time() - start_time
+                print(f"⚡ Cache hit ({cache_key[:12]}) em {processing_time * 1000:.1f}ms")
+                record_conversation_turn(conversation, model, cached)
+                if streaming:
+                    return sse_response(iter([
+                        sse_event({'delta': cached}),
+                        sse_event({
+                            'processing_time': round(processing_time, 2),
+                            'content_length': len(cached),
+                            'cache_hit': True,
+                            'tokens_info': tokens_info,
+                            'conversation_id': data.get('conversation_id'),
+                            'roteamento': route
+                        }, event='done')
+                    ]))
+                return jsonify({
+                    'choices': [{
+                        'message': {
+                            'content': cached
+                        }
+                    }],
+                    'processing_time': round(processing_time, 2),
+                    'cache_hit': True,
+                    'tokens_info': tokens_info,
+                    'historico_relacionado': historico_ids,
+                    'conversation_id': data.get('conversation_id'),
+                    'roteamento': route
+                })
+
+        stages.lap('cache_lookup')
+
+        # Modo streaming (SSE): POST /api/chat?stream=1 ou {"stream": true}
+        if streaming:
+            return stream_chat_response(
+                messages, model, max_tokens,
+                data.get('usuario', 'anonimo'),
+                start_time,
+                cache_key=cache_key,
+                tokens_info=tokens_info,
+                priority=priority,
+                conversation=conversation,
+                route=route
+            )
+
+        # Processar requisição OpenAI (requisições idênticas simultâneas compartilham a chamada)
+        upstream_started = time.perf_counter()
+        result, coalesced = coalesced_completion(
+            cache_key or request_key(model, max_tokens, messages, conversation), messages, model, max_tokens,
+            priority=priority, previous_response_id=(conversation or {}).get('previous_response_id'),
+            effort=route['esforco']
+        )
+        if not result.get('error') and not coalesced:
+            model_router.record(route, time.perf_counter() - upstream_started, result.get('usage'))
+        if coalesced:
+            print("🔗 Requisição idêntica em andamento: resultado compartilhado")
+        stages.skip()  # upstream_ttfb/upstream_total são medidos em process_openai_request
+
+        if result.get('error'):
+            print(f"❌ ERRO na API OpenAI: {result['error']}")
+            return jsonify({'error': result['error']}), 500
 
-        content = response.choices[0].message.content
+        content = result.get('content')
         
         if not content:
             print("⚠️ WARNING: Content é None ou vazio!")
-            print(f"   Finish reason: {response.choices[0].finish_reason}")
+            print(f"   Finish reason: {result.get('finish_reason')}")
             content = "(Resposta vazia recebida da OpenAI)"
+        elif cache_key and not coalesced:
+            response_cache.set(cache_key, model, content)
         
         processing_time = time.time() - start_time
         
@@ -281,20 +883,33 @@ def chat():
         print("=" * 50)
 
         # Salvar histórico de forma assíncrona
+        stages.skip()
         save_to_history_async(
             data.get('usuario', 'anonimo'),
             messages,
-            content
+            content,
+            precos=is_comparison(route)
         )
+        record_conversation_turn(conversation, model, content, result.get('response_id'), result.get('usage'))
+        stages.lap('db_enqueue')
 
-        return jsonify({
+        response = jsonify({
             'choices': [{
                 'message': {
                     'content': content
                 }
             }],
-            'processing_time': round(processing_time, 2)
+            'processing_time': round(processing_time, 2),
+            'cache_hit': False,
+            'coalesced': coalesced,
+            'usage': result.get('usage'),
+            'tokens_info': tokens_info,
+            'historico_relacionado': historico_ids,
+            'conversation_id': data.get('conversation_id'),
+            'roteamento': route
         })
+        stages.lap('serialization')
+        return response
         
     except Exception as e:
         processing_time = time.time() - start_time
@@ -302,23 +917,233 @@ def chat():
         print(f"❌ ERRO GERAL: {error_msg}")
         print(f"⏱️ Tempo até erro: {processing_time:.2f}s")
         print("=" * 50)
+        metrics.inc('errors_total', endpoint='chat', type=type(e).__name__)
         return jsonify({'error': error_msg}), 500
+    finally:
+        stages.record(metrics, endpoint='chat', model=model)
+
+def run_job(payload):
+    """Executa um job do /api/jobs (thread do pool). Retorna (texto, erro)."""
+    model = payload['model']
+    max_tokens = payload['max_tokens']
+    messages = payload['messages']
+    cache_key = payload.get('cache_key')
+    conversation = payload.get('conversation')
+    route = payload.get('route')
+    started = time.perf_counter()
+    result, coalesced = coalesced_completion(
+        cache_key or request_key(model, max_tokens, messages, conversation), messages, model, max_tokens,
+        endpoint='job', priority=payload.get('priority', PRIORITIES['normal']),
+        previous_response_id=(conversation or {}).get('previous_response_id'),
+        effort=(route or {}).get('esforco', DEFAULT_EFFORT)
+    )
+    if result.get('error'):
+        return None, result['error']
+    if not coalesced:
+        model_router.record(route, time.perf_counter() - started, result.get('usage'))
+    content = result.get('content') or "(Resposta vazia recebida da OpenAI)"
+    if cache_key and result.get('content') and not coalesced:
+        response_cache.set(cache_key, model, content)
+    save_to_history_async(payload.get('usuario', 'anonimo'), messages, content, precos=is_comparison(route))
+    record_conversation_turn(conversation, model, content, result.get('response_id'), result.get('usage'))
+    return content, None
+
+job_queue = JobQueue(get_db_connection, run_job)
+
+@bp.route('/api/jobs', methods=['POST'])
+def create_job():
+    """Mesmo corpo do /api/chat; responde na hora com o ID e a análise roda em segundo plano"""
+    try:
+        data = request.json
+        messages = data.get('messages', [])
+        route = model_router.route(data, messages)
+        model, max_tokens = route['modelo'], route['max_tokens']
+        if not messages and not data.get('document_ids'):
+            return jsonify({'error': 'Nenhuma mensagem fornecida'}), 400
+        try:
+            messages, conversation = prepare_conversation(data, messages, model)
+            messages, tokens_info, historico_ids = prepare_chat_messages(data, messages, model, max_tokens)
+        except ChatRequestError as e:
+            return jsonify({'error': str(e)}), e.status
+
+        cache_mode = get_cache_mode(data)
+        cache_key = request_key(model, max_tokens, messages, conversation) if cache_mode else None
+        if cache_key and cache_mode == 'refresh':
+            response_cache.invalidate(cache_key)
+        cached = response_cache.get(cache_key) if cache_key and cache_mode is True else None
+
+        # Jobs ficam atrás do chat interativo na fila do upstream, salvo pedido explícito
+        priority = parse_priority(data.get('prioridade'), default='normal')
+        payload = {
+            'model': model, 'max_tokens': max_tokens, 'messages': messages, 'cache_key': cache_key,
+            'priority': priority, 'usuario': data.get('usuario', 'anonimo'), 'conversation': conversation,
+            'route': route,
+        }
+        job_id = job_queue.submit(payload, model, priority, result=cached)
+        if cached is not None:
+            record_conversation_turn(conversation, model, cached)
+        print(f"🧵 Job {job_id[:8]} criado | Rota: {route['tarefa']} | Modelo: {model}"
+              f"{' | cache hit' if cached is not None else ''}")
+
+        response = jsonify({
+            'id': job_id,
+            'status': 'concluido' if cached is not None else 'pendente',
+            'tokens_info': tokens_info,
+            'historico_relacionado': historico_ids,
+            'conversation_id': data.get('conversation_id'),
+            'roteamento': route
+        })
+        response.headers['Location'] = f'/api/jobs/{job_id}'
+        return response, 202
+    except Exception as e:
+        print(f"❌ Erro ao criar job: {e}")
+        return jsonify({'error': f"Erro interno do servidor: {str(e)}"}), 500
+
+@bp.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Estado do job; ?wait=N (até 30s) espera a conclusão antes de responder"""
+    try:
+        wait = float(request.args.get('wait', 0))
+    except ValueError:
+        return jsonify({'error': 'wait deve ser um número'}), 400
+    if not math.isfinite(wait):  # nan/inf: o prazo nunca venceria e a thread ficaria presa
+        return jsonify({'error': 'wait deve ser um número finito'}), 400
+    job = job_queue.get(job_id, wait)
+    if job is None:
+        return jsonify({'error': 'Job não encontrado'}), 404
+    if 'resultado' in job:
+        # Mesmo formato do /api/chat
+        job['choices'] = [{'message': {'content': job.pop('resultado')}}]
+    return jsonify(job)
+
+@bp.route('/api/conversations', methods=['POST'])
+def create_conversation_endpoint():
+    """Abre uma conversa; as perguntas seguintes mandam só a mensagem nova com o conversation_id"""
+    try:
+        data = request.get_json(silent=True) or {}
+        with get_db_connection() as conn:
+            conversation_id = create_conversation(conn, data.get('usuario', 'anonimo'))
+            conn.commit()
+        return jsonify({'conversation_id': conversation_id}), 201
+    except Exception as e:
+        print(f"❌ Erro ao criar conversa: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/conversations/<conversation_id>', methods=['GET'])
+def get_conversation(conversation_id):
+    """Turnos da conversa (para restaurar a tela e ver os tokens de cada pergunta)"""
+    with get_db_connection() as conn:
+        conversation = load_conversation(conn, conversation_id)
+    if conversation is None:
+        return jsonify({'error': 'Conversa não encontrada'}), 404
+    return jsonify(conversation)
+
+def complete_text(messages, model, max_tokens, use_cache=True, priority=PRIORITIES['normal']):
+    """Chamada OpenAI que retorna só o texto (com cache). Retorna (texto, erro)."""
+    try:
+        messages, _ = fit_messages(messages, model, max_tokens)
+    except PromptTooLargeError as e:
+        return None, str(e)
+    cache_key = make_cache_key(model, max_tokens, messages) if use_cache else None
+    if cache_key:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return cached, None
+
+    result, coalesced = coalesced_completion(
+        cache_key or make_cache_key(model, max_tokens, messages), messages, model, max_tokens,
+        endpoint='map_reduce', priority=priority
+    )
+    if result.get('error'):
+        return None, result['error']
+    content = result.get('content')
+    if not content:
+        return None, 'Resposta vazia da OpenAI'
+    if cache_key and not coalesced:
+        response_cache.set(cache_key, model, content)
+    return content, None
+
+@bp.route('/api/chat/map-reduce', methods=['POST'])
+def chat_map_reduce():
+    """Análise map-reduce: resume cada documento em paralelo e compara os resumos em uma chamada final"""
+    start_time = time.time()
+    try:
+        data = request.json
+        messages = data.get('messages', [])
+        model = data.get('model', 'gpt-4')
+        use_cache = get_cache_mode(data) is True
+        priority = parse_priority(data.get('prioridade'), default='normal')  # Várias chamadas: atrás do chat
 
-@app.route('/api/health', methods=['GET'])
+        max_tokens = resolve_max_tokens(model, data.get('max_tokens'))
+
+        # Documentos: IDs do /api/ingest e/ou [{"nome": ..., "conteudo": ...}] inline
+        documents = [
+            (doc.get('nome', f'Documento {index}'), doc.get('conteudo', ''))
+            for index, doc in enumerate(data.get('documents') or [], start=1)
+        ]
+        document_ids = data.get('document_ids') or []
+        if document_ids:
+            found, missing = load_documents(document_ids)
+            if missing:
+                return jsonify({'error': f'Documento(s) não encontrado(s): {", ".join(missing)}'}), 404
+            documents.extend(found[doc_id] for doc_id in document_ids)
+
+        if not documents:
+            return jsonify({'error': 'Nenhum documento fornecido (documents ou document_ids)'}), 400
+
+        print("🚀 === NOVA ANÁLISE MAP-REDUCE ===")
+        print(f"📧 Modelo: {model} | 📄 Documentos: {len(documents)}")
+
+        map_tokens = min(MAP_MAX_TOKENS, max_tokens)
+        content, error, timings = run_map_reduce(
+            documents,
+            messages,
+            summarize=lambda map_messages: complete_text(map_messages, model, map_tokens, use_cache, priority),
+            reduce=lambda reduce_messages: complete_text(reduce_messages, model, max_tokens, use_cache, priority)
+        )
+
+        print(f"⏱️ Map: {timings['map_wall']}s ({timings['map_tasks']} chamadas) | "
+              f"Reduce: {timings.get('reduce', '-')}s | Total: {timings['total']}s")
+
+        if error:
+            print(f"❌ ERRO no map-reduce: {error}")
+            return jsonify({'error': f'Erro na API OpenAI: {error}', 'timings': timings}), 500
+
+        save_to_history_async(data.get('usuario', 'anonimo'), messages, content, precos=True)  # Sempre comparação
+
+        return jsonify({
+            'choices': [{
+                'message': {
+                    'content': content
+                }
+            }],
+            'processing_time': round(time.time() - start_time, 2),
+            'timings': timings
+        })
+    except Exception as e:
+        print(f"❌ ERRO GERAL no map-reduce: {e}")
+        return jsonify({'error': f"Erro interno do servidor: {str(e)}"}), 500
+
+@bp.route('/api/health', methods=['GET'])
 def health():
     """Endpoint de saúde com informações detalhadas"""
     try:
         # Testar conexão com banco
         with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT COUNT(*) FROM historico')
-            total_records = cursor.fetchone()[0]
+            total_records = count_rows(conn)
         
         return jsonify({
             "status": "ok",
             "openai_configured": bool(os.getenv("OPENAI_API_KEY")),
             "database_working": True,
             "total_records": total_records,
+            "history_writer": history_writer.stats(),
+            "single_flight": single_flight.stats(),
+            "upstream": upstream_scheduler.stats(),
+            "router": model_router.stats(),
+            "jobs": job_queue.stats(),
+            "settings_cache": settings_cache.stats(),
+            "memory": memory_manager.stats(),
             "timeout_config": {
                 "request_timeout": REQUEST_TIMEOUT,
                 "openai_timeout": OPENAI_TIMEOUT
@@ -332,90 +1157,183 @@ def health():
             "error": str(e)
         }), 500
 
-@app.route('/api/historico', methods=['GET'])
+@bp.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Histogramas por etapa, tokens e erros de todos os workers (formato Prometheus)"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@bp.route('/api/historico', methods=['GET'])
 def get_historico():
-    """Endpoint otimizado para buscar histórico"""
+    """Endpoint otimizado para buscar histórico (paginação por cursor)"""
     try:
         limit = request.args.get('limit', 50, type=int)
         offset = request.args.get('offset', 0, type=int)
+        cursor_param = request.args.get('cursor')
         
         # Limitar resultados para evitar sobrecarga
-        limit = min(limit, 100)
+        limit = max(1, min(limit, 100))
+
+        # Prévias calculadas no SQL a partir das colunas de texto curto (sem ler os BLOBs)
+        columns = f'''
+            id, usuario,
+            CASE WHEN length(prompt_preview) > {PROMPT_PREVIEW_CHARS}
+                 THEN substr(prompt_preview, 1, {PROMPT_PREVIEW_CHARS}) || '...' ELSE prompt_preview END,
+            CASE WHEN length(resposta_preview) > {RESPOSTA_PREVIEW_CHARS}
+                 THEN substr(resposta_preview, 1, {RESPOSTA_PREVIEW_CHARS}) || '...' ELSE resposta_preview END,
+            data
+        '''
         
         with get_db_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute(
-                'SELECT id, usuario, prompt, resposta, data FROM historico ORDER BY data DESC LIMIT ? OFFSET ?',
-                (limit, offset)
-            )
+            if cursor_param:
+                # Keyset: continua depois do último (data, id) entregue; custo constante em qualquer página
+                try:
+                    last_data, last_id = decode_historico_cursor(cursor_param)
+                except ValueError:
+                    return jsonify({'error': 'Cursor inválido'}), 400
+                cursor.execute(
+                    f'SELECT {columns} FROM historico WHERE (data, id) < (?, ?) '
+                    'ORDER BY data DESC, id DESC LIMIT ?',
+                    (last_data, last_id, limit)
+                )
+            else:
+                cursor.execute(
+                    f'SELECT {columns} FROM historico ORDER BY data DESC, id DESC LIMIT ? OFFSET ?',
+                    (limit, offset)
+                )
             rows = cursor.fetchall()
             
-            # Contar total de registros
-            cursor.execute('SELECT COUNT(*) FROM historico')
-            total = cursor.fetchone()[0]
-        
+            # Total mantido por trigger (sem COUNT(*))
+            total = count_rows(conn)
+
         historico = [
             {
                 'id': row[0],
                 'usuario': row[1],
-                'prompt': row[2][:500] + '...' if len(row[2]) > 500 else row[2],  # Truncar prompt longo
-                'resposta': row[3][:1000] + '...' if len(row[3]) > 1000 else row[3],  # Truncar resposta longa
+                'prompt': row[2] or '',
+                'resposta': row[3] or '',
                 'data': row[4]
             }
             for row in rows
         ]
+        next_cursor = encode_historico_cursor(rows[-1][4], rows[-1][0]) if len(rows) == limit else None
         
         return jsonify({
             'historico': historico,
             'total': total,
             'limit': limit,
-            'offset': offset
+            'offset': offset,
+            'next_cursor': next_cursor
         })
     except Exception as e:
         print(f"❌ Erro ao buscar histórico: {e}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/settings', methods=['GET'])
+@bp.route('/api/historico/search', methods=['GET'])
+def search_historico():
+    """Busca textual ranqueada no histórico (FTS5), com filtros de fornecedor/item"""
+    try:
+        start_time = time.time()
+        query = request.args.get('q', '').strip()
+        fornecedor = request.args.get('fornecedor', '').strip() or None
+        item = request.args.get('item', '').strip() or None
+        usuario = request.args.get('usuario', '').strip() or None
+        limit = request.args.get('limit', 20, type=int)
+
+        if not query and not fornecedor and not item:
+            return jsonify({'error': 'Informe q, fornecedor ou item'}), 400
+
+        with get_db_connection() as conn:
+            resultados = search_history(conn, query, fornecedor, item, usuario, limit)
+
+        return jsonify({
+            'resultados': resultados,
+            'total': len(resultados),
+            'query': query,
+            'processing_time_ms': round((time.time() - start_time) * 1000, 2)
+        })
+    except sqlite3.OperationalError as e:
+        print(f"❌ Erro na busca do histórico: {e}")
+        return jsonify({'error': f'Busca inválida: {str(e)}'}), 400
+    except Exception as e:
+        print(f"❌ Erro na busca do histórico: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/precos/itens', methods=['GET'])
+def listar_itens_precos():
+    """Itens com preços extraídos das análises (busca por nome)"""
+    try:
+        query = request.args.get('q', '').strip() or None
+        limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+        with get_db_connection() as conn:
+            itens = find_items(conn, query, limit)
+        return jsonify({'itens': itens, 'total': len(itens)})
+    except Exception as e:
+        print(f"❌ Erro ao listar itens: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/precos/item', methods=['GET'])
+def estatisticas_item():
+    """Mínimo/mediana/máximo, preços por fornecedor e tendência de um item"""
+    try:
+        start_time = time.time()
+        item_id = request.args.get('item_id', type=int)
+        item = request.args.get('item', '').strip()
+        periodo = request.args.get('periodo', 'mes')
+        if not item_id and not item:
+            return jsonify({'error': 'Informe item ou item_id'}), 400
+
+        with get_db_connection() as conn:
+            if not item_id:
+                item_id = resolve_item_id(conn, item)
+            stats = item_stats(conn, item_id, periodo) if item_id else None
+
+        if not stats:
+            return jsonify({'error': 'Item não encontrado'}), 404
+        stats['processing_time_ms'] = round((time.time() - start_time) * 1000, 2)
+        return jsonify(stats)
+    except Exception as e:
+        print(f"❌ Erro ao calcular preços do item: {e}")
+        return jsonify({'error': str(e)}), 500
+
+def encode_historico_cursor(data, row_id):
+    return base64.urlsafe_b64encode(f"{data}|{row_id}".encode('utf-8')).decode('ascii')
+
+def decode_historico_cursor(value):
+    try:
+        data, row_id = base64.urlsafe_b64decode(value.encode('ascii')).decode('utf-8').rsplit('|', 1)
+        return data, int(row_id)
+    except Exception:
+        raise ValueError('cursor inválido')
+
+@bp.route('/api/settings', methods=['GET'])
 def get_settings():
-    """Endpoint para recuperar configurações do usuário"""
+    """Endpoint para recuperar configurações do usuário (cache + ETag)"""
     try:
         # Tentar obter API Key do header
         api_key = request.headers.get('X-API-Key') or request.args.get('api_key', 'default')
         
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                'SELECT modelo, max_tokens, chunk_size FROM configuracoes WHERE api_key = ?',
-                (api_key,)
-            )
-            row = cursor.fetchone()
+        settings, _ = settings_cache.get(api_key)
+        # 'cached' mantém o significado original: True = valores padrão (sem registro para a chave);
+        # acertos do cache em memória aparecem em /api/health (settings_cache)
+        cached = settings is None
+        settings = settings or DEFAULT_SETTINGS
         
-        if row:
-            return jsonify({
-                'modelo': row[0],
-                'max_tokens': row[1],
-                'chunk_size': row[2],
-                'cached': False
-            })
-        else:
-            # Retornar valores padrão se não encontrado
-            return jsonify({
-                'modelo': 'gpt-5',
-                'max_tokens': 8000,
-                'chunk_size': 8000,
-                'cached': True
-            })
+        response = jsonify({**settings, 'cached': cached})
+        # O navegador guarda a resposta e revalida a cada carga da página: 304 sem corpo se nada mudou
+        response.set_etag(settings_etag(settings))
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.vary.add('X-API-Key')
+        return response.make_conditional(request)
     except Exception as e:
         print(f"❌ Erro ao buscar configurações: {e}")
         return jsonify({
-            'modelo': 'gpt-5',
-            'max_tokens': 8000,
-            'chunk_size': 8000,
+            **DEFAULT_SETTINGS,
             'error': str(e),
             'cached': True
         }), 200  # Retornar 200 mesmo com erro para fallback
 
-@app.route('/api/settings', methods=['POST'])
+@bp.route('/api/settings', methods=['POST'])
 def save_settings():
     """Endpoint para salvar configurações do usuário"""
     try:
@@ -446,6 +1364,7 @@ def save_settings():
                     data_atualizacao = CURRENT_TIMESTAMP
             ''', (api_key, modelo, max_tokens, chunk_size))
             conn.commit()
+        settings_cache.invalidate(api_key)  # Os outros workers veem pela versão (trigger)
         
         print(f"✅ Configurações salvas para API Key: {api_key[:10]}...")
         return jsonify({
@@ -460,25 +1379,70 @@ def save_settings():
         return jsonify({'error': str(e)}), 500
 
 # Rota otimizada para servir arquivos da pasta App-IA
-@app.route('/App-IA/<path:filename>')
+@bp.route('/App-IA/<path:filename>')
 def serve_app_ia_files(filename):
     try:
-        app_ia_path = os.path.join(os.path.dirname(os.path.dirname(__file__)))
-        return send_from_directory(app_ia_path, filename, as_attachment=False, cache_timeout=3600)
+        response = static_assets.serve(request, filename)
+        if response is not None:
+            return response
+        return send_from_directory(PROJECT_ROOT, filename, as_attachment=False, max_age=3600)
     except Exception as e:
         print(f"❌ Erro ao servir arquivo App-IA {filename}: {e}")
         return jsonify({'error': 'Arquivo não encontrado'}), 404
 
 # Rota otimizada para a página principal
-@app.route('/')
+@bp.route('/')
 def index():
     try:
-        app_ia_path = os.path.dirname(os.path.dirname(__file__))
-        return send_file(os.path.join(app_ia_path, 'index.html'))
+        response = static_assets.serve(request, 'index.html')
+        if response is not None:
+            return response
+        return send_file(os.path.join(PROJECT_ROOT, 'index.html'))
     except Exception as e:
         print(f"❌ Erro ao servir página principal: {e}")
         return jsonify({'error': 'Página não encontrada'}), 404
 
+def create_app():
+    """Aplicação Flask: só rotas e middleware. Banco, cliente OpenAI e estáticos
+    ficam para o primeiro uso (ou warm_up), então importar este módulo é rápido."""
+    app = Flask(__name__)
+    CORS(app)
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.register_blueprint(bp)
+    return app
+
+def close_db_connections():
+    """Fecha as conexões SQLite do processo. No master do gunicorn, antes de cada fork:
+    um filho que fechasse a conexão herdada (sqlite3_close em handle compartilhado)
+    poderia corromper as travas do WAL."""
+    db_pool.close_all()
+    if is_loaded(response_cache):
+        response_cache.close()
+
+def warm_up():
+    """Faz de uma vez o que ficaria para o primeiro uso (gunicorn: no master, antes do fork)"""
+    started = time.perf_counter()
+    try:
+        init_db()
+    except Exception:
+        print("⚠️ Banco não inicializado no aquecimento: nova tentativa na primeira requisição")
+    else:
+        sync_semantic_index()  # Aqui mesmo: thread no master não sobrevive ao fork (e seguraria o flock)
+    static_assets.warm()
+    print(f"📦 {static_assets.stats()['assets']} arquivos estáticos prontos (gzip/brotli, nomes versionados)")
+    for lazy in (client, response_cache, single_flight):
+        load(lazy)
+    memory_manager.tune_gc()  # O que foi carregado agora também fica fora das coletas do GC
+    print(f"🔥 Aplicação aquecida em {time.perf_counter() - started:.2f}s")
+
+# Para produção (Render/Vercel: api.index:app)
+app = create_app()
+
+# Fim da importação: objetos carregados até aqui ficam fora das coletas do GC
+# (sem a coleta completa, que fica para o warm_up: não atrasa o cold start)
+memory_manager.tune_gc(collect=False)
+
 if __name__ == '__main__':
     print("=" * 70)
     print("🚀 TOOLS ENGENHARIA - DOCUMENT AI ANALYZER BACKEND")
@@ -487,15 +1451,21 @@ if __name__ == '__main__':
     print("🤖 OpenAI API: Configurada e pronta")
     print("📊 Endpoints disponíveis:")
     print("   • POST /api/chat - Análise de documentos")
+    print("   • POST /api/chat?stream=1 - Análise com streaming (SSE)")
+    print("   • POST /api/ingest - Extração de PDF/XLSX no servidor")
+    print("   • POST /api/chat/map-reduce - Análise paralela por documento")
     print("   • GET  /api/health - Status do sistema")
+    print("   • GET  /api/metrics - Métricas por etapa (Prometheus)")
     print("   • GET  /api/historico - Histórico de análises")
+    print("   • GET  /api/historico/search - Busca no histórico")
+    print("   • GET  /api/precos/itens - Itens com preços extraídos")
+    print("   • GET  /api/precos/item - Preços históricos de um item")
     print("   • GET  / - Interface principal")
+    print("   • GET  /assets/<arquivo> - Estáticos versionados (gzip/brotli)")
     print("=" * 70)
     print("💡 Logs da aplicação aparecerão abaixo:")
     print("=" * 70)
     
     # Para desenvolvimento local
+    install_signal_handlers()
     app.run(debug=False, port=5000, threaded=True)
-
-# Para produção (Render/Vercel)
-app = app
\ No newline at end of file
@@ -0,0 +1,170 @@
+"""Extração de texto de PDF/XLSX no servidor (substitui o trabalho feito no navegador)
+
+O arquivo é lido página a página / linha a linha e o filtro de conteúdo essencial
+é aplicado durante a leitura: a extração para assim que o limite de caracteres
+é atingido, sem carregar o documento inteiro em memória.
+"""
+import re
+
+# Mesmo limite por arquivo usado pelo frontend (extractEssentialContent)
+MAX_ESSENTIAL_CHARS = 8000
+TRUNCATION_NOTE = "\n\n[... conteúdo editado para espaço]"
+
+SUPPORTED_TYPES = {
+    '.pdf': 'pdf',
+    '.xlsx': 'xlsx',
+    '.xlsm': 'xlsx',
+    '.txt': 'txt',
+    '.csv': 'txt',
+}
+
+# Padrões de dados estruturados (portados de extractEssentialContent em index.html)
+CNPJ_RE = re.compile(r'\b\d{2}\.\d{3}\.\d{3}/\d{4}-\d{2}\b|\b\d{14}\b|\d{2}\s\d{3}\s\d{3}\s\d{4}\s\d{2}')
+EMAIL_RE = re.compile(r'[\w.-]+@[\w.-]+\.\w{2,}')
+PHONE_RE = re.compile(r'\(?(\d{2})\)?\s*(\d{4,5})[-\s]?(\d{4})|\+55')
+VALUE_RE = re.compile(r'R\$\s*[\d.,]+')
+PERCENT_RE = re.compile(r'\d+\s*%')
+NUMBER_RE = re.compile(r'\d+')
+IMPORTANT_CHARS_RE = re.compile(r'[\d()@\-.]')
+FILLER_LINE_RE = re.compile(r'^[\s\-=*_]{10,}$')
+COMPANY_NAME_RE = re.compile(r"^[A-Z][A-Z\s&.,'-]*[A-Z]$")
+
+IMPORTANT_KEYWORDS = (
+    "fornecedor", "cnpj", "telefone", "email", "endereço", "contato", "cargo",
+    "item", "descrição", "quantidade", "medida", "preço", "valor", "desconto",
+    "pagamento", "entrega", "garantia", "validade", "proposta", "total",
+    "subtotal", "frete", "instalação", "empresa", "razão social", "razão", "social",
+)
+
+
+class UnsupportedDocumentError(ValueError):
+    """Tipo de arquivo não suportado pela ingestão no servidor"""
+
+
+def detect_type(filename):
+    name = (filename or '').lower()
+    for extension, doc_type in SUPPORTED_TYPES.items():
+        if name.endswith(extension):
+            return doc_type
+    raise UnsupportedDocumentError(
+        f"Tipo de arquivo não suportado: {filename} (use {', '.join(SUPPORTED_TYPES)})"
+    )
+
+
+def is_essential_line(line):
+    """Mesmo critério do frontend: dados estruturados, palavras-chave, números ou nome de empresa"""
+    if (CNPJ_RE.search(line) or EMAIL_RE.search(line) or PHONE_RE.search(line)
+            or VALUE_RE.search(line) or PERCENT_RE.search(line)):
+        return True
+    lower_line = line.lower()
+    if any(keyword in lower_line for keyword in IMPORTANT_KEYWORDS):
+        return True
+    if NUMBER_RE.search(line):
+        return True
+    trimmed = line.strip()
+    return bool(COMPANY_NAME_RE.match(trimmed)) and len(trimmed) > 5 and len(trimmed.split(" ")) >= 2
+
+
+class EssentialContentFilter:
+    """Versão incremental de extractEssentialContent: recebe blocos de texto e acumula só o essencial"""
+
+    def __init__(self, max_chars=MAX_ESSENTIAL_CHARS):
+        self.max_chars = max_chars
+        self.parts = []
+        self.size = 0
+        self.truncated = False
+        self._last_line = ""
+
+    @property
+    def full(self):
+        return self.size >= self.max_chars
+
+    def feed(self, text):
+        """Processa um bloco (página, linha de planilha). Retorna False quando o limite foi atingido."""
+        for line in text.replace('\r\n', '\n').split('\n'):
+            if self.full:
+                self.truncated = True
+                return False
+            if FILLER_LINE_RE.match(line):
+                continue
+            trimmed = line.strip()
+            # Linhas idênticas seguidas só são mantidas se tiverem dado importante
+            if trimmed == self._last_line and not IMPORTANT_CHARS_RE.search(trimmed):
+                continue
+            self._last_line = trimmed
+            if not is_essential_line(line):
+                continue
+            self.parts.append(line)
+            self.size += len(line) + 1
+        return not self.full
+
+    def result(self):
+        content = "\n".join(self.parts)
+        if len(content) > self.max_chars:
+            content = content[:self.max_chars]
+            self.truncated = True
+        if self.truncated:
+            content += TRUNCATION_NOTE
+        return content
+
+
+def as_seekable(stream):
+    """Uploads grandes chegam como SpooledTemporaryFile, que só ganhou seekable() no Python 3.11"""
+    if hasattr(stream, 'seekable'):
+        return stream
+    return getattr(stream, '_file', stream)
+
+
+def iter_pdf_pages(stream):
+    """Gera o texto de cada página do PDF, uma de cada vez"""
+    from pypdf import PdfReader
+
+    reader = PdfReader(as_seekable(stream))
+    for page in reader.pages:
+        yield page.extract_text() or ""
+
+
+def iter_xlsx_rows(stream):
+    """Gera as linhas de cada planilha no formato do frontend (modo read-only do openpyxl)"""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(as_seekable(stream), read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            for index, row in enumerate(sheet.iter_rows(values_only=True), start=1):
+                values = [str(value) for value in row if value is not None]
+                if values:
+                    yield f"Linha {index}: {' | '.join(values)}"
+    finally:
+        workbook.close()
+
+
+def iter_text_lines(stream):
+    for raw_line in stream:
+        yield raw_line.decode('utf-8', errors='replace') if isinstance(raw_line, bytes) else raw_line
+
+
+def extract_document(stream, filename, max_chars=MAX_ESSENTIAL_CHARS):
+    """Extrai o conteúdo essencial de um arquivo enviado.
+
+    Retorna (tipo, conteudo, blocos_lidos, truncado).
+    """
+    doc_type = detect_type(filename)
+    if doc_type == 'pdf':
+        blocks = iter_pdf_pages(stream)
+    elif doc_type == 'xlsx':
+        blocks = iter_xlsx_rows(stream)
+    else:
+        blocks = iter_text_lines(stream)
+
+    content_filter = EssentialContentFilter(max_chars)
+    blocks_read = 0
+    try:
+        for block in blocks:
+            blocks_read += 1
+            if not content_filter.feed(block):
+                break
+    finally:
+        if hasattr(blocks, 'close'):
+            blocks.close()
+    return doc_type, content_filter.result(), blocks_read, content_filter.truncated
@@ -0,0 +1,233 @@
+"""Jobs assíncronos para análises longas (/api/jobs)
+
+Uma análise com GPT-5 pode passar do timeout do proxy (Vercel/Render) e do
+gunicorn (180s); a resposta se perdia mesmo já paga. Em modo job, o POST só
+grava o pedido na tabela jobs e devolve o ID; um pool de threads por worker
+executa a chamada e grava o resultado no SQLite, e o cliente consulta (ou
+espera por) GET /api/jobs/<id>.
+
+Qualquer worker pega qualquer job pendente (UPDATE ... RETURNING atômico), e
+quem está executando renova um heartbeat. Se o worker morrer (reciclagem,
+deploy), o job fica sem heartbeat e volta para a fila depois de
+JOB_STALE_SECONDS (até JOB_MAX_ATTEMPTS tentativas).
+"""
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 4))  # Threads por worker do gunicorn
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 1.0))  # Jobs criados por outros workers
+JOB_HEARTBEAT_SECONDS = 10
+JOB_STALE_SECONDS = float(os.getenv('JOB_STALE_SECONDS', 60))
+JOB_MAX_ATTEMPTS = 2
+JOB_RETENTION_SECONDS = float(os.getenv('JOB_RETENTION_HOURS', 24 * 7)) * 3600
+JOB_MAX_WAIT_SECONDS = 30  # Long polling em GET /api/jobs/<id>?wait=N
+
+PENDING, RUNNING, DONE, FAILED = 'pendente', 'executando', 'concluido', 'erro'
+
+
+def ensure_jobs_schema(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            modelo TEXT,
+            prioridade INTEGER DEFAULT 0,
+            payload TEXT NOT NULL,
+            resultado TEXT,
+            erro TEXT,
+            tentativas INTEGER DEFAULT 0,
+            worker TEXT,
+            criado_em REAL NOT NULL,
+            iniciado_em REAL,
+            concluido_em REAL,
+            heartbeat REAL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_fila ON jobs (status, prioridade, criado_em)')
+
+
+def _iso(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat(timespec='seconds') if timestamp else None
+
+
+class JobQueue:
+    def __init__(self, get_connection, handler, workers=JOB_WORKERS, poll_interval=JOB_POLL_INTERVAL):
+        self.get_connection = get_connection  # Context manager de conexão (pool)
+        self.handler = handler  # função(payload) -> (resultado, erro)
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+        self._worker_id = None
+        self._running = set()
+        self._stats = {}
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Processo novo (worker após fork): threads e identificador próprios
+            self._pid = os.getpid()
+            self._worker_id = f'{self._pid}-{uuid.uuid4().hex[:8]}'
+            self._running = set()
+            self._stats = {'completed': 0, 'failed': 0, 'recovered': 0}
+            for number in range(self.workers):
+                threading.Thread(target=self._run, name=f'job-{number}', daemon=True).start()
+            threading.Thread(target=self._maintain, name='job-heartbeat', daemon=True).start()
+
+    def start(self):
+        """Chamado no post_fork do gunicorn: retoma jobs pendentes sem esperar requisição"""
+        self._ensure_started()
+
+    def submit(self, payload, model=None, priority=0, result=None):
+        """Grava o job e acorda o pool. Com result, o job já nasce concluído (ex: cache hit)."""
+        self._ensure_started()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self.get_connection() as conn:
+            conn.execute(
+                'INSERT INTO jobs (id, status, modelo, prioridade, payload, resultado, criado_em, concluido_em) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, DONE if result is not None else PENDING, model, priority,
+                 json.dumps(payload, ensure_ascii=False), result, now, now if result is not None else None)
+            )
+            conn.commit()
+        self._wake.set()
+        return job_id
+
+    def get(self, job_id, wait=0):
+        """Estado do job; com wait, espera até N segundos ele terminar (None se não existe)"""
+        self._ensure_started()
+        wait = wait if math.isfinite(wait) else 0  # nan passaria pelo min/max e o prazo nunca venceria
+        deadline = time.monotonic() + min(max(wait, 0), JOB_MAX_WAIT_SECONDS)
+        while True:
+            with self.get_connection() as conn:
+                row = conn.execute(
+                    'SELECT id, status, modelo, resultado, erro, tentativas, criado_em, iniciado_em, concluido_em '
+                    'FROM jobs WHERE id = ?', (job_id,)
+                ).fetchone()
+            if row is None or row[1] in (DONE, FAILED) or time.monotonic() >= deadline:
+                break
+            time.sleep(0.5)  # O job pode estar em outro worker: consulta o banco
+        if row is None:
+            return None
+        job = {
+            'id': row[0], 'status': row[1], 'modelo': row[2], 'tentativas': row[5],
+            'criado_em': _iso(row[6]), 'iniciado_em': _iso(row[7]), 'concluido_em': _iso(row[8]),
+        }
+        if row[1] == DONE:
+            job['resultado'] = row[3]
+            job['processing_time'] = round(row[8] - (row[7] or row[6]), 2)
+        elif row[1] == FAILED:
+            job['error'] = row[4]
+        return job
+
+    def _claim(self):
+        now = time.time()
+        with self.get_connection() as conn:
+            row = conn.execute(f'''
+                UPDATE jobs SET status = '{RUNNING}', worker = ?, iniciado_em = ?, heartbeat = ?,
+                                tentativas = tentativas + 1
+                WHERE id = (SELECT id FROM jobs WHERE status = '{PENDING}' ORDER BY prioridade, criado_em LIMIT 1)
+                  AND status = '{PENDING}'
+                RETURNING id, payload
+            ''', (self._worker_id, now, now)).fetchone()
+            conn.commit()
+        return row
+
+    def _finish(self, job_id, result, error):
+        with self.get_connection() as conn:
+            conn.execute(
+                'UPDATE jobs SET status = ?, resultado = ?, erro = ?, concluido_em = ? WHERE id = ? AND worker = ?',
+                (FAILED if error else DONE, result, error, time.time(), job_id, self._worker_id)
+            )
+            conn.commit()
+
+    def _run(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            try:
+                claimed = self._claim()
+            except Exception as e:
+                print(f"❌ Erro ao buscar job pendente: {e}")
+                claimed = None
+            if claimed is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            job_id, payload = claimed
+            with self._lock:
+                self._running.add(job_id)
+            started = time.time()
+            print(f"🧵 Job {job_id[:8]} iniciado")
+            try:
+                result, error = self.handler(json.loads(payload))
+            except Exception as e:
+                result, error = None, f'Erro interno do servidor: {e}'
+            finally:
+                with self._lock:
+                    self._running.discard(job_id)
+            try:
+                self._finish(job_id, result, error)
+            except Exception as e:
+                print(f"❌ Erro ao gravar resultado do job {job_id[:8]}: {e}")
+                continue
+            with self._lock:
+                self._stats['failed' if error else 'completed'] += 1
+            print(f"{'❌' if error else '✅'} Job {job_id[:8]} {'falhou' if error else 'concluído'} "
+                  f"em {time.time() - started:.1f}s")
+
+    def _maintain(self):
+        """Heartbeat dos jobs em execução, recuperação de jobs órfãos e limpeza dos antigos"""
+        pid = os.getpid()
+        while self._pid == pid:
+            try:
+                self._heartbeat_and_recover()
+            except Exception as e:
+                print(f"❌ Erro na manutenção dos jobs: {e}")
+            time.sleep(JOB_HEARTBEAT_SECONDS)
+
+    def _heartbeat_and_recover(self):
+        now = time.time()
+        with self._lock:
+            running = list(self._running)
+        with self.get_connection() as conn:
+            conn.executemany('UPDATE jobs SET heartbeat = ? WHERE id = ? AND worker = ?',
+                             [(now, job_id, self._worker_id) for job_id in running])
+            stale = now - JOB_STALE_SECONDS
+            # Worker morreu no meio: falha definitiva após JOB_MAX_ATTEMPTS, senão volta para a fila
+            conn.execute(f'''
+                UPDATE jobs SET status = '{FAILED}', erro = 'Worker interrompido durante a execução', concluido_em = ?
+                WHERE status = '{RUNNING}' AND heartbeat < ? AND tentativas >= ?
+            ''', (now, stale, JOB_MAX_ATTEMPTS))
+            recovered = conn.execute(f'''
+                UPDATE jobs SET status = '{PENDING}', worker = NULL
+                WHERE status = '{RUNNING}' AND heartbeat < ?
+            ''', (stale,)).rowcount
+            conn.execute(f"DELETE FROM jobs WHERE status IN ('{DONE}', '{FAILED}') AND concluido_em < ?",
+                         (now - JOB_RETENTION_SECONDS,))
+            conn.commit()
+        if recovered:
+            with self._lock:
+                self._stats['recovered'] += recovered
+            print(f"♻️ {recovered} job(s) órfão(s) de volta para a fila")
+            self._wake.set()
+
+    def stats(self):
+        self._ensure_started()
+        with self.get_connection() as conn:
+            counts = dict(conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+        with self._lock:
+            stats = dict(self._stats)
+            stats['running_here'] = len(self._running)
+        stats['workers'] = self.workers
+        stats['by_status'] = counts
+        return stats
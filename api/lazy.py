@@ -0,0 +1,56 @@
+"""Inicialização preguiçosa e única por processo
+
+A importação de api/index.py criava tudo na hora (cliente OpenAI, migrações,
+estáticos comprimidos), mesmo em um processo que só ia responder /api/health.
+- once(func): func roda uma vez só; chamadas simultâneas esperam a primeira
+  terminar. Se ela falhar, a próxima chamada tenta de novo.
+- LazyObject(factory): o objeto é criado no primeiro acesso a um atributo
+  (ex: client.responses.create); quem guarda a referência não muda nada.
+  load(obj) cria na hora (aquecimento). O proxy não tem métodos públicos
+  próprios, para não esconder os do objeto (ex: response_cache.get).
+
+Com preload_app o gunicorn chama as inicializações no master (gunicorn.conf.py,
+on_starting): os workers herdam tudo pronto pelo fork.
+"""
+import functools
+import threading
+
+_UNSET = object()
+
+
+def once(func):
+    lock = threading.Lock()
+    result = _UNSET
+
+    @functools.wraps(func)
+    def wrapper():
+        nonlocal result
+        if result is _UNSET:
+            with lock:
+                if result is _UNSET:
+                    result = func()
+        return result
+
+    wrapper.done = lambda: result is not _UNSET
+    return wrapper
+
+
+class LazyObject:
+    def __init__(self, factory):
+        self._factory = once(factory)
+
+    def __getattr__(self, name):
+        return getattr(self._factory(), name)
+
+    def __repr__(self):
+        state = 'carregado' if self._factory.done() else 'pendente'
+        return f"<LazyObject {state}: {self._factory.__name__}>"
+
+
+def is_loaded(obj):
+    return not isinstance(obj, LazyObject) or obj._factory.done()
+
+
+def load(obj):
+    """Objeto real de um LazyObject (criado agora, se ainda não foi); outros objetos passam direto"""
+    return obj._factory() if isinstance(obj, LazyObject) else obj
@@ -0,0 +1,114 @@
+"""Pipeline map-reduce para BIDs com muitas propostas
+
+map:    cada documento (ou pedaço de documento) é resumido em paralelo
+reduce: uma única chamada monta a tabela comparativa a partir dos resumos
+
+O tempo total passa a acompanhar o documento mais lento, não a soma de todos.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+MAP_REDUCE_WORKERS = int(os.getenv('MAP_REDUCE_WORKERS', 6))  # Chamadas simultâneas na etapa map
+MAP_CHUNK_CHARS = int(os.getenv('MAP_CHUNK_CHARS', 12000))  # Tamanho máximo de cada pedaço
+MAP_MAX_TOKENS = 2000  # Resumos curtos: o detalhe fica para a etapa reduce
+
+MAP_SYSTEM_PROMPT = (
+    "Você é um analista de suprimentos. Extraia da proposta abaixo, sem inventar dados:\n"
+    "- Fornecedor: razão social, CNPJ, contato (telefone, email)\n"
+    "- Itens: descrição, quantidade, unidade, preço unitário e total\n"
+    "- Condições: desconto, pagamento, prazo de entrega, frete, garantia, validade\n"
+    "Responda em tópicos objetivos. Se um dado não existir, escreva 'não informado'."
+)
+
+
+def split_into_chunks(text, chunk_chars=MAP_CHUNK_CHARS):
+    """Divide o texto em pedaços de até chunk_chars, preferindo quebras de parágrafo/linha"""
+    chunks = []
+    remaining = text.strip()
+    while len(remaining) > chunk_chars:
+        cut = remaining.rfind('\n\n', 0, chunk_chars)
+        if cut < chunk_chars // 2:
+            cut = remaining.rfind('\n', 0, chunk_chars)
+        if cut < chunk_chars // 2:
+            cut = chunk_chars
+        chunks.append(remaining[:cut].strip())
+        remaining = remaining[cut:].strip()
+    if remaining:
+        chunks.append(remaining)
+    return chunks
+
+
+def build_map_tasks(documents, chunk_chars=MAP_CHUNK_CHARS):
+    """Converte [(nome, conteudo)] em tarefas (nome, parte, total_partes, texto)"""
+    tasks = []
+    for name, content in documents:
+        chunks = split_into_chunks(content or '', chunk_chars) or ['(documento vazio)']
+        for index, chunk in enumerate(chunks, start=1):
+            tasks.append((name, index, len(chunks), chunk))
+    return tasks
+
+
+def run_map_reduce(documents, messages, summarize, reduce, max_workers=MAP_REDUCE_WORKERS):
+    """Executa o pipeline completo.
+
+    documents: lista de (nome, conteudo)
+    messages:  mensagens originais do usuário (system + pedido de comparação)
+    summarize: função(map_messages) -> (texto, erro)
+    reduce:    função(reduce_messages) -> (texto, erro)
+
+    Retorna (conteudo, erro, timings).
+    """
+    pipeline_start = time.time()
+    tasks = build_map_tasks(documents)
+
+    def map_task(task):
+        name, part, total_parts, chunk = task
+        label = name if total_parts == 1 else f"{name} (parte {part}/{total_parts})"
+        task_start = time.time()
+        text, error = summarize([
+            {'role': 'system', 'content': MAP_SYSTEM_PROMPT},
+            {'role': 'user', 'content': f"ARQUIVO: {label}\n\n{chunk}"}
+        ])
+        return label, text, error, time.time() - task_start
+
+    map_start = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tasks)))) as executor:
+        results = list(executor.map(map_task, tasks))
+    map_wall = time.time() - map_start
+
+    timings = {
+        'map': [
+            {'documento': label, 'seconds': round(seconds, 2), 'ok': error is None}
+            for label, _, error, seconds in results
+        ],
+        'map_wall': round(map_wall, 2),
+        'map_tasks': len(tasks),
+    }
+
+    summaries = [(label, text) for label, text, error, _ in results if error is None]
+    failures = [(label, error) for label, _, error, _ in results if error is not None]
+    if not summaries:
+        timings['total'] = round(time.time() - pipeline_start, 2)
+        return None, f"Todas as etapas map falharam: {failures[0][1]}", timings
+
+    summaries_text = "\n\n".join(f"=== RESUMO: {label} ===\n{text}" for label, text in summaries)
+    if failures:
+        summaries_text += "\n\n[Não foi possível resumir: " + ", ".join(label for label, _ in failures) + "]"
+
+    # Reduce: mantém o system prompt original e troca o conteúdo bruto pelos resumos
+    reduce_messages = [msg for msg in messages if msg.get('role') == 'system']
+    user_request = next(
+        (msg.get('content', '') for msg in reversed(messages) if msg.get('role') == 'user'),
+        'Compare as propostas dos fornecedores em uma tabela.'
+    )
+    reduce_messages.append({
+        'role': 'user',
+        'content': f"{user_request}\n\nRESUMOS DAS PROPOSTAS:\n\n{summaries_text}"
+    })
+
+    reduce_start = time.time()
+    content, error = reduce(reduce_messages)
+    timings['reduce'] = round(time.time() - reduce_start, 2)
+    timings['total'] = round(time.time() - pipeline_start, 2)
+    return content, error, timings
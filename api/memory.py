@@ -0,0 +1,141 @@
+"""Política de memória dos workers
+
+Substitui o gc.collect() a cada requisição:
+- ajuste geracional do GC (limiares maiores) e gc.freeze() dos objetos
+  carregados na inicialização: com preload_app eles ficam fora das coletas
+  (menos pausa e menos cópia de páginas após o fork)
+- coleta completa só depois de requisições com payload grande, e fora da
+  requisição: uma thread de fundo faz a coleta
+- a mesma thread amostra a memória (psutil); acima de MEMORY_MAX_RSS_MB o
+  worker do gunicorn é reciclado com SIGTERM (termina as requisições em
+  andamento e o master sobe outro)
+
+O limite vale para a memória anônima (RSS - páginas de arquivo): páginas do
+SQLite e do índice vetorial mapeadas com mmap contam no RSS, mas o kernel as
+devolve sozinho e elas não indicam vazamento.
+"""
+import gc
+import os
+import signal
+import threading
+import time
+
+import psutil
+
+MEMORY_MAX_RSS_MB = int(os.getenv('MEMORY_MAX_RSS_MB', 256))
+MEMORY_SAMPLE_INTERVAL = float(os.getenv('MEMORY_SAMPLE_INTERVAL', 5))
+LARGE_PAYLOAD_BYTES = int(os.getenv('LARGE_PAYLOAD_BYTES', 1024 * 1024))
+# Limiares das gerações 0/1/2 (padrão do Python: 700, 10, 10)
+GC_THRESHOLDS = tuple(int(value) for value in os.getenv('GC_THRESHOLDS', '50000,20,20').split(','))
+
+
+class MemoryManager:
+    def __init__(self, max_rss_mb=MEMORY_MAX_RSS_MB, sample_interval=MEMORY_SAMPLE_INTERVAL,
+                 large_payload_bytes=LARGE_PAYLOAD_BYTES):
+        self.max_rss_mb = max_rss_mb
+        self.sample_interval = sample_interval
+        self.large_payload_bytes = large_payload_bytes
+        self.recycle_enabled = False  # Ligado pelo post_fork do gunicorn
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._collect_requested = False
+        self._pid = None
+        self._process = None
+        self._stats = {}
+
+    def tune_gc(self, collect=True):
+        """Limiares maiores e congelamento do que já foi carregado (chamar ao fim da inicialização).
+
+        collect=False pula a coleta completa antes do freeze (importação: o lixo
+        de uma importação é pouco e a coleta custaria dezenas de ms no cold start).
+        """
+        gc.set_threshold(*GC_THRESHOLDS)
+        if collect:
+            gc.collect()
+        gc.freeze()  # Módulos, app e caches iniciais não são mais percorridos pelo GC
+
+    def enable_recycling(self):
+        self.recycle_enabled = True
+        self._ensure_started()
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._process = psutil.Process(self._pid)
+            self._stats = {'rss_mb': 0.0, 'anon_mb': 0.0, 'peak_anon_mb': 0.0, 'collections': 0,
+                           'collected_objects': 0, 'last_collection_ms': 0.0, 'over_limit': False}
+            threading.Thread(target=self._run, name='memory-manager', daemon=True).start()
+
+    def after_request(self, request_bytes, response_bytes):
+        """Agenda uma coleta se a requisição movimentou muitos dados (ex: PDFs, respostas longas)"""
+        self._ensure_started()
+        if max(request_bytes or 0, response_bytes or 0) >= self.large_payload_bytes:
+            self._collect_requested = True
+            self._wake.set()
+
+    def _run(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            self._wake.wait(self.sample_interval)
+            self._wake.clear()
+            if self._collect_requested:
+                self._collect_requested = False
+                self._collect()
+            self._sample()
+
+    def _collect(self):
+        start = time.perf_counter()
+        collected = gc.collect()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self._stats['collections'] += 1
+            self._stats['collected_objects'] += collected
+            self._stats['last_collection_ms'] = round(elapsed_ms, 2)
+
+    def _memory_mb(self):
+        """(RSS, memória anônima) em MB"""
+        info = self._process.memory_info()
+        rss = info.rss / (1024 * 1024)
+        return rss, rss - getattr(info, 'shared', 0) / (1024 * 1024)
+
+    def _sample(self):
+        try:
+            rss_mb, anon_mb = self._memory_mb()
+        except psutil.Error:
+            return
+        with self._lock:
+            self._stats['rss_mb'] = round(rss_mb, 1)
+            self._stats['anon_mb'] = round(anon_mb, 1)
+            self._stats['peak_anon_mb'] = round(max(self._stats['peak_anon_mb'], anon_mb), 1)
+            over_limit = self.max_rss_mb and anon_mb > self.max_rss_mb and not self._stats['over_limit']
+        if not over_limit:
+            return
+        # Antes de reciclar, tenta liberar com uma coleta completa
+        self._collect()
+        _, anon_mb = self._memory_mb()
+        if anon_mb <= self.max_rss_mb:
+            return
+        with self._lock:
+            self._stats['over_limit'] = True  # Avisa/recicla uma vez só
+        if self.recycle_enabled:
+            print(f"♻️ Worker {self._pid} com {anon_mb:.0f}MB (limite {self.max_rss_mb}MB): reciclando")
+            os.kill(self._pid, signal.SIGTERM)  # Gunicorn: saída graciosa, o master sobe outro worker
+        else:
+            print(f"⚠️ Processo {self._pid} com {anon_mb:.0f}MB (limite {self.max_rss_mb}MB)")
+
+    def stats(self):
+        self._ensure_started()
+        with self._lock:
+            stats = dict(self._stats)
+        stats['max_rss_mb'] = self.max_rss_mb
+        stats['gc_thresholds'] = list(gc.get_threshold())
+        stats['gc_frozen_objects'] = gc.get_freeze_count()
+        stats['recycle_enabled'] = self.recycle_enabled
+        return stats
+
+
+memory_manager = MemoryManager()
@@ -0,0 +1,272 @@
+"""Métricas por etapa da requisição no formato texto do Prometheus (/api/metrics)
+
+Cada worker acumula histogramas e contadores em memória e grava um snapshot
+em METRICS_DIR (metrics-<pid>-<início>.json) a cada METRICS_FLUSH_INTERVAL
+segundos. O /api/metrics soma os arquivos de todos os workers. Quando o
+master do gunicorn recolhe um worker (max_requests), o arquivo dele é
+incorporado a metrics-finalizados.json, para os totais nunca diminuírem.
+"""
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_DIR = os.getenv(
+    'METRICS_DIR', os.path.join(tempfile.gettempdir(), f'analise-bid-metrics-{os.getuid()}')
+)
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+METRICS_PREFIX = 'analise_bid'
+FINISHED_FILE = 'metrics-finalizados.json'
+
+# Limites dos buckets em segundos: de parse de JSON (ms) até a OpenAI (minutos)
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+HELP = {
+    'stage_seconds': ('histogram', 'Duração de cada etapa da requisição'),
+    'request_seconds': ('histogram', 'Duração total da requisição HTTP'),
+    'tokens_total': ('counter', 'Tokens reportados pela OpenAI (input, cached_input = parte do input vinda do cache de prompt, output)'),
+    'errors_total': ('counter', 'Erros por endpoint e tipo de exceção'),
+    'single_flight_total': ('counter', 'Chamadas à OpenAI feitas (leader) ou compartilhadas (coalesced)'),
+    'upstream_queue_seconds': ('histogram', 'Espera na fila do agendador antes da chamada à OpenAI'),
+    'upstream_retries_total': ('counter', 'Novas tentativas de chamadas à OpenAI por modelo e erro'),
+    'db_wait_seconds': ('histogram', 'Espera por uma conexão livre no pool do SQLite'),
+    'db_hold_seconds': ('histogram', 'Tempo com a conexão do SQLite em uso (consultas + transação)'),
+    'db_busy_total': ('counter', 'Erros "database is locked/busy" do SQLite'),
+    'router_requests_total': ('counter', 'Pedidos por tipo de tarefa e modelo escolhido pelo roteador'),
+    'router_seconds': ('histogram', 'Duração da chamada à OpenAI por tipo de tarefa e modelo'),
+    'router_tokens_total': ('counter', 'Tokens reportados pela OpenAI por tipo de tarefa e modelo'),
+    'router_max_tokens_saved_total': ('counter', 'Redução do max_tokens pedido pelo cliente após o roteamento'),
+}
+
+
+# O modelo vem do cliente (campo "model"): só nomes conhecidos viram label, o resto
+# vira "other", para um cliente não criar séries sem limite nos snapshots
+METRIC_MODELS = frozenset(
+    name.strip() for name in os.getenv(
+        'METRIC_MODELS',
+        'gpt-5,gpt-5-mini,gpt-5-nano,gpt-5-chat-latest,gpt-4.1,gpt-4.1-mini,gpt-4.1-nano,'
+        'gpt-4o,gpt-4o-mini,gpt-4-turbo,gpt-4,gpt-3.5-turbo'
+    ).split(',') if name.strip()
+)
+OTHER_MODEL = 'other'
+
+
+def model_label(model):
+    return model if model in METRIC_MODELS else OTHER_MODEL
+
+
+def _empty():
+    return {'histograms': {}, 'counters': {}}
+
+
+def _key(name, labels):
+    if 'model' in labels:
+        labels['model'] = model_label(labels['model'])
+    return json.dumps([name, sorted(labels.items())], ensure_ascii=False)
+
+
+class Metrics:
+    def __init__(self, directory=METRICS_DIR, flush_interval=METRICS_FLUSH_INTERVAL):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pid = None
+        self._data = _empty()
+        self._dirty = False
+        self._path = None
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Processo novo (worker após fork): começa do zero com arquivo próprio
+            self._pid = os.getpid()
+            self._data = _empty()
+            self._path = os.path.join(self.directory, f'metrics-{self._pid}-{int(time.time() * 1000)}.json')
+            os.makedirs(self.directory, exist_ok=True)
+            threading.Thread(target=self._run, name='metrics-flush', daemon=True).start()
+
+    def _run(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def observe(self, name, seconds, **labels):
+        self._ensure_started()
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._data['histograms'].get(key)
+            if histogram is None:
+                histogram = self._data['histograms'][key] = {'buckets': [0] * len(BUCKETS), 'sum': 0.0, 'count': 0}
+            for index, limit in enumerate(BUCKETS):
+                if seconds <= limit:
+                    histogram['buckets'][index] += 1
+                    break
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+            self._dirty = True
+
+    def inc(self, name, value=1, **labels):
+        if not value:
+            return
+        self._ensure_started()
+        key = _key(name, labels)
+        with self._lock:
+            self._data['counters'][key] = self._data['counters'].get(key, 0) + value
+            self._dirty = True
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def flush(self):
+        """Grava o snapshot deste worker (escrita atômica)"""
+        if self._pid != os.getpid():
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            snapshot = json.dumps(self._data, ensure_ascii=False)
+            self._dirty = False
+        try:
+            _write_atomic(self._path, snapshot)
+        except OSError as e:
+            print(f"⚠️ Não foi possível gravar as métricas: {e}")
+
+    def collect(self):
+        """Soma os snapshots de todos os workers (vivos e finalizados)"""
+        self.flush()
+        total = _empty()
+        for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+            data = _read(path)
+            if data:
+                _merge(total, data)
+        return total
+
+    def render(self):
+        """Texto no formato de exposição do Prometheus"""
+        data = self.collect()
+        lines = []
+        by_name = {}
+        for kind in ('histograms', 'counters'):
+            for key, value in data[kind].items():
+                name, labels = json.loads(key)
+                by_name.setdefault(name, []).append((labels, value))
+        for name in sorted(by_name):
+            metric_type, help_text = HELP.get(name, ('untyped', name))
+            full_name = f'{METRICS_PREFIX}_{name}'
+            lines.append(f'# HELP {full_name} {help_text}')
+            lines.append(f'# TYPE {full_name} {metric_type}')
+            for labels, value in sorted(by_name[name], key=lambda item: item[0]):
+                if isinstance(value, dict):
+                    cumulative = 0
+                    for limit, count in zip(BUCKETS, value['buckets']):
+                        cumulative += count
+                        lines.append(f'{full_name}_bucket{_labels(labels, le=limit)} {cumulative}')
+                    lines.append(f'{full_name}_bucket{_labels(labels, le="+Inf")} {value["count"]}')
+                    lines.append(f'{full_name}_sum{_labels(labels)} {round(value["sum"], 6)}')
+                    lines.append(f'{full_name}_count{_labels(labels)} {value["count"]}')
+                else:
+                    lines.append(f'{full_name}{_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+class StageTimer:
+    """Cronômetro de voltas: cada lap(nome) registra o tempo desde a volta anterior.
+
+    Os rótulos (ex: modelo) só são conhecidos no fim, em record().
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._last = time.perf_counter()
+
+    def lap(self, name):
+        now = time.perf_counter()
+        self.stages[name] = self.stages.get(name, 0.0) + now - self._last
+        self._last = now
+
+    def skip(self):
+        """Ignora o tempo desde a última volta (etapa medida em outro lugar)"""
+        self._last = time.perf_counter()
+
+    def record(self, metrics, **labels):
+        for name, seconds in self.stages.items():
+            metrics.observe('stage_seconds', seconds, stage=name, **labels)
+        self.stages = {}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _merge(total, data):
+    for key, histogram in data.get('histograms', {}).items():
+        current = total['histograms'].get(key)
+        if current is None:
+            total['histograms'][key] = {
+                'buckets': list(histogram['buckets']), 'sum': histogram['sum'], 'count': histogram['count']
+            }
+        else:
+            current['buckets'] = [a + b for a, b in zip(current['buckets'], histogram['buckets'])]
+            current['sum'] += histogram['sum']
+            current['count'] += histogram['count']
+    for key, value in data.get('counters', {}).items():
+        total['counters'][key] = total['counters'].get(key, 0) + value
+
+
+def _read(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_atomic(path, text):
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+
+def reset_metrics_dir(directory=METRICS_DIR):
+    """Limpa os snapshots de execuções anteriores (gunicorn on_starting)"""
+    for path in glob.glob(os.path.join(directory, 'metrics-*.json*')):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def retire_worker(pid, directory=METRICS_DIR):
+    """Incorpora o snapshot de um worker finalizado ao acumulado (gunicorn child_exit)"""
+    finished_path = os.path.join(directory, FINISHED_FILE)
+    paths = glob.glob(os.path.join(directory, f'metrics-{pid}-*.json'))
+    if not paths:
+        return
+    total = _read(finished_path) or _empty()
+    for path in paths:
+        data = _read(path)
+        if data:
+            _merge(total, data)
+    _write_atomic(finished_path, json.dumps(total, ensure_ascii=False))
+    for path in paths:
+        os.remove(path)
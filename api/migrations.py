@@ -0,0 +1,150 @@
+"""Migrações versionadas do banco (PRAGMA user_version)
+
+Antes, toda inicialização rodava os CREATE TABLE/INDEX/TRIGGER de todas as
+tabelas e procurava registros no formato antigo. Agora cada migração roda uma
+vez por banco, em ordem, e grava a versão no próprio arquivo; com o banco em
+dia, a inicialização é só a leitura de user_version.
+
+Bancos já existentes (versão 0) passam por todas: os passos são idempotentes.
+Para incluir uma mudança de esquema, acrescente uma função no fim de MIGRATIONS.
+
+SKIP_MIGRATIONS=1 pula a verificação (banco migrado no build/deploy):
+    python -m api.migrations [caminho do banco]
+"""
+import os
+import sys
+
+from api.conversations import ensure_conversation_schema
+from api.db_pool import connect
+from api.history_search import ensure_search_schema
+from api.history_store import ensure_schema, migrate_legacy_rows
+from api.jobs import ensure_jobs_schema
+from api.price_store import backfill_prices, ensure_price_dedup_schema, ensure_price_schema
+from api.settings_cache import ensure_settings_schema
+
+SKIP_MIGRATIONS = os.getenv('SKIP_MIGRATIONS', '0') not in ('0', 'false', '')
+
+
+def _base_tables(conn):
+    """Histórico, configurações e documentos do /api/ingest"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS historico (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            usuario TEXT,
+            prompt TEXT,
+            resposta TEXT,
+            data DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS configuracoes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            api_key TEXT UNIQUE,
+            modelo TEXT DEFAULT 'gpt-5',
+            max_tokens INTEGER DEFAULT 8000,
+            chunk_size INTEGER DEFAULT 8000,
+            data_atualizacao DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS documentos (
+            id TEXT PRIMARY KEY,
+            nome TEXT,
+            tipo TEXT,
+            conteudo TEXT,
+            caracteres INTEGER,
+            blocos INTEGER,
+            truncado INTEGER DEFAULT 0,
+            data DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Formato compacto do histórico (system prompts deduplicados, zlib)
+    ensure_schema(conn)
+    conn.commit()
+    migrated = migrate_legacy_rows(conn)
+    if migrated:
+        print(f"🗜️ {migrated} registros do histórico migrados para o formato compacto")
+
+
+def _history_search(conn):
+    """Índice FTS5 do histórico"""
+    ensure_search_schema(conn)
+
+
+def _prices(conn):
+    """Tabelas fornecedor/item/preco extraídas das análises"""
+    ensure_price_schema(conn)
+
+
+def _settings_version(conn):
+    """Versão das configurações (invalidação do cache entre workers)"""
+    ensure_settings_schema(conn)
+
+
+def _jobs(conn):
+    """Fila de jobs assíncronos (/api/jobs)"""
+    ensure_jobs_schema(conn)
+
+
+def _conversations(conn):
+    """Conversas guardadas no servidor (conversation_id)"""
+    ensure_conversation_schema(conn)
+
+
+def _price_dedup(conn):
+    """Preços sem duplicata por resposta (hash da resposta, item, fornecedor)"""
+    ensure_price_dedup_schema(conn)
+
+
+def _history_search_sync(conn):
+    """Índice de busca mantido em Python (sem triggers com funções SQL próprias)"""
+    ensure_search_schema(conn)
+
+
+def _price_backfill(conn):
+    """Preços das análises comparativas gravadas antes da extração (uma vez por banco)"""
+    extracted = backfill_prices(conn)
+    if extracted:
+        print(f"💲 {extracted} preços extraídos do histórico existente")
+
+
+# Versão N = MIGRATIONS[N - 1]; nunca reordenar nem remover, só acrescentar
+MIGRATIONS = [_base_tables, _history_search, _prices, _settings_version, _jobs, _conversations, _price_dedup,
+              _history_search_sync, _price_backfill]
+LATEST_VERSION = len(MIGRATIONS)
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn, target=LATEST_VERSION):
+    """Aplica as migrações pendentes até target. Retorna as versões aplicadas."""
+    applied = []
+    version = schema_version(conn)
+    while version < target:
+        # Trava de escrita antes de reler a versão: outro processo pode ter migrado enquanto isso
+        conn.execute('BEGIN IMMEDIATE')
+        version = schema_version(conn)
+        if version >= target:
+            conn.rollback()
+            break
+        step = MIGRATIONS[version]
+        step(conn)  # Pode fazer commits intermediários (ex: migração do histórico em lotes)
+        if not conn.in_transaction:
+            conn.execute('BEGIN IMMEDIATE')
+        version += 1
+        conn.execute(f'PRAGMA user_version = {version}')
+        conn.commit()
+        applied.append(version)
+        print(f"🧱 Migração {version} aplicada: {step.__doc__}")
+    return applied
+
+
+if __name__ == '__main__':
+    default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'historico_base.db')
+    db_path = sys.argv[1] if len(sys.argv) > 1 else default_path
+    conn = connect(db_path)
+    applied = migrate(conn)
+    print(f"✅ Banco na versão {schema_version(conn)} ({len(applied)} migrações aplicadas)")
+    conn.close()
@@ -0,0 +1,161 @@
+"""Roteamento de modelo por tipo de tarefa (/api/chat e /api/jobs)
+
+Toda chamada ia para o modelo que o navegador mandava (gpt-5 das
+configurações), inclusive "gere o e-mail" ou "qual fornecedor entrega antes?".
+Agora o pedido é classificado localmente (tamanho da entrada + palavras-chave,
+sem chamada extra à OpenAI) e cada tipo vai para o modelo, max_tokens e
+esforço de raciocínio configurados:
+- comparacao: análise completa do BID (documentos anexados ou entrada grande);
+  fica com o modelo pedido pelo cliente
+- pergunta: acompanhamento sobre uma análise já feita
+- email: redação do e-mail para a construtora
+- conversa: saudação/agradecimento curto
+
+MODEL_ROUTES (JSON) sobrescreve as rotas, ex:
+    {"email": {"modelo": "gpt-4o-mini", "max_tokens": 1000}}
+MODEL_ROUTER=0 desliga o roteamento; no pedido, {"roteamento": false} mantém o
+modelo enviado e {"tarefa": "email"} força o tipo.
+"""
+import json
+import os
+import re
+import threading
+
+from api.metrics import model_label
+from api.token_budget import content_text, count_message_tokens, count_text_tokens, resolve_max_tokens
+
+ROUTER_ENABLED = os.getenv('MODEL_ROUTER', '1') not in ('0', 'false')
+COMPARISON_MIN_TOKENS = int(os.getenv('ROUTER_COMPARISON_MIN_TOKENS', 2500))  # Entrada a partir da qual é análise
+SMALL_TALK_MAX_TOKENS = 20
+# System prompt grande sem outro sinal (ex: o prompt unificado do BID): fica como análise
+COMPARISON_SYSTEM_TOKENS = int(os.getenv('ROUTER_COMPARISON_SYSTEM_TOKENS', 300))
+
+# modelo None = o que o cliente pediu; max_tokens None = o pedido (ou o padrão do modelo)
+DEFAULT_ROUTES = {
+    'comparacao': {'modelo': None, 'max_tokens': None, 'esforco': 'low'},
+    'pergunta': {'modelo': 'gpt-5-mini', 'max_tokens': 3000, 'esforco': 'low'},
+    'email': {'modelo': 'gpt-5-mini', 'max_tokens': 1500, 'esforco': 'minimal'},
+    'conversa': {'modelo': 'gpt-5-nano', 'max_tokens': 500, 'esforco': 'minimal'},
+}
+TASKS = tuple(DEFAULT_ROUTES)
+DEFAULT_EFFORT = 'low'  # Esforço usado antes do roteamento (e com roteamento desligado)
+
+EMAIL_RE = re.compile(r'\be-?mail\b', re.IGNORECASE)
+COMPARISON_RE = re.compile(
+    r'compar\w*\s+(as\s+|os\s+)?(propostas|or[çc]amentos|fornecedores|cota[çc][õo]es)'
+    r'|analis\w*\s+(as\s+|os\s+)?(propostas|documentos|or[çc]amentos)|an[áa]lise\s+comparativa|===\s*ARQUIVO:'
+    r'|DOCUMENTO\s+\d+:',
+    re.IGNORECASE
+)
+SMALL_TALK_RE = re.compile(
+    r'^\W*(oi|ol[áa]|bom dia|boa tarde|boa noite|obrigad[oa]|muito obrigad[oa]|valeu|tudo bem|ok|beleza|'
+    r'perfeito|[óo]timo|tchau|at[ée] mais)\b',
+    re.IGNORECASE
+)
+
+
+def load_routes(overrides=None):
+    """Rotas padrão com as sobrescritas de MODEL_ROUTES (tarefas desconhecidas são ignoradas)"""
+    if overrides is None:
+        try:
+            overrides = json.loads(os.getenv('MODEL_ROUTES') or '{}')
+        except ValueError as e:
+            print(f"⚠️ MODEL_ROUTES inválido, usando rotas padrão: {e}")
+            overrides = {}
+    routes = {task: dict(route) for task, route in DEFAULT_ROUTES.items()}
+    for task, route in overrides.items():
+        if task in routes and isinstance(route, dict):
+            routes[task].update(route)
+    return routes
+
+
+def classify(messages, has_documents=False):
+    """Tipo da tarefa pelas mensagens do pedido (antes de anexar documentos/histórico).
+
+    Marcadores de comparação vêm antes do e-mail: o prompt do BID cita "Email:" e
+    "e-mail" nas instruções. O e-mail só é reconhecido na última pergunta do usuário.
+    """
+    if has_documents or count_message_tokens(messages) >= COMPARISON_MIN_TOKENS:
+        return 'comparacao'
+    question = next((content_text(msg.get('content')) for msg in reversed(messages) if msg.get('role') == 'user'), '')
+    system = "\n".join(content_text(msg.get('content')) for msg in messages if msg.get('role') == 'system')
+    if COMPARISON_RE.search(question) or COMPARISON_RE.search(system):
+        return 'comparacao'
+    if EMAIL_RE.search(question):
+        return 'email'
+    if count_text_tokens(question) <= SMALL_TALK_MAX_TOKENS and SMALL_TALK_RE.search(question):
+        return 'conversa'
+    if count_text_tokens(system) >= COMPARISON_SYSTEM_TOKENS:
+        return 'comparacao'  # Na dúvida, o modelo pedido pelo cliente
+    return 'pergunta'
+
+
+class ModelRouter:
+    def __init__(self, routes=None, enabled=ROUTER_ENABLED, metrics=None):
+        self.routes = load_routes() if routes is None else routes
+        self.enabled = enabled
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def route(self, data, messages):
+        """Decide modelo, max_tokens e esforço do pedido.
+
+        Retorna {'tarefa', 'modelo', 'max_tokens', 'esforco', 'modelo_pedido', 'roteado', 'max_tokens_poupados'}.
+        """
+        requested_model = data.get('model', 'gpt-4')
+        requested_tokens = resolve_max_tokens(requested_model, data.get('max_tokens'))
+        task = data.get('tarefa') if data.get('tarefa') in TASKS else classify(messages, bool(data.get('document_ids')))
+        decision = {'tarefa': task, 'modelo': requested_model, 'max_tokens': requested_tokens,
+                    'esforco': DEFAULT_EFFORT, 'modelo_pedido': requested_model, 'roteado': False}
+        if self.enabled and data.get('roteamento') is not False:
+            route = self.routes[task]
+            model = route.get('modelo') or requested_model
+            cap = route.get('max_tokens')
+            wanted = data.get('max_tokens')
+            wanted = min(int(wanted), cap) if wanted and cap else (cap or wanted)
+            decision.update(modelo=model, max_tokens=resolve_max_tokens(model, wanted),
+                            esforco=route.get('esforco') or DEFAULT_EFFORT, roteado=True)
+        decision['max_tokens_poupados'] = max(0, requested_tokens - decision['max_tokens'])
+        if self.metrics:
+            self.metrics.inc('router_requests_total', task=task, model=decision['modelo'])
+        with self._lock:
+            stats = self._task_stats(task)
+            stats['requests'] += 1
+            stats['max_tokens_saved'] += decision['max_tokens_poupados']
+            label = model_label(decision['modelo'])  # Nome pedido pelo cliente: só modelos conhecidos
+            stats['models'][label] = stats['models'].get(label, 0) + 1
+        return decision
+
+    def record(self, decision, seconds, usage=None):
+        """Latência e tokens da chamada feita com a rota (usage no formato de usage_summary)"""
+        if not decision:
+            return
+        task, model = decision['tarefa'], decision['modelo']
+        usage = usage or {}
+        if self.metrics:
+            self.metrics.observe('router_seconds', seconds, task=task, model=model)
+            for direction in ('input', 'output'):
+                self.metrics.inc('router_tokens_total', usage.get(f'{direction}_tokens') or 0,
+                                 task=task, model=model, direction=direction)
+            self.metrics.inc('router_max_tokens_saved_total', decision.get('max_tokens_poupados', 0), task=task)
+        with self._lock:
+            stats = self._task_stats(task)
+            stats['calls'] += 1
+            stats['seconds'] += seconds
+            stats['input_tokens'] += usage.get('input_tokens') or 0
+            stats['output_tokens'] += usage.get('output_tokens') or 0
+
+    def _task_stats(self, task):
+        return self._stats.setdefault(task, {
+            'requests': 0, 'calls': 0, 'seconds': 0.0, 'input_tokens': 0, 'output_tokens': 0,
+            'max_tokens_saved': 0, 'models': {}
+        })
+
+    def stats(self):
+        with self._lock:
+            tasks = {}
+            for task, stats in self._stats.items():
+                tasks[task] = dict(stats, models=dict(stats['models']), seconds=round(stats['seconds'], 2),
+                                   avg_seconds=round(stats['seconds'] / stats['calls'], 2) if stats['calls'] else None)
+        return {'enabled': self.enabled, 'routes': self.routes, 'tasks': tasks}
@@ -0,0 +1,446 @@
+"""Extração das tabelas de preço das análises para tabelas SQL indexadas
+
+As respostas trazem a comparação como tabela HTML (formato pedido pelo prompt
+unificado: Item | Empresa 1 | Empresa 2 | Melhor | Economia) ou markdown.
+Depois de salvar o histórico, as tabelas das análises comparativas (não as de
+perguntas de acompanhamento ou e-mails) são lidas e normalizadas em
+fornecedor / item / preco, permitindo comparar preços históricos em SQL. A
+mesma resposta gravada de novo (cache, pedido repetido) não duplica preços:
+cada (hash da resposta, item, fornecedor) entra uma vez só.
+
+Reprocessar o histórico existente: `python -m api.price_store [caminho.db]`
+"""
+import hashlib
+import re
+import sys
+from html.parser import HTMLParser
+
+from api.db_pool import connect
+from api.history_search import fold
+from api.history_store import decompress_text, load_messages
+from api.model_router import classify
+
+MONEY_RE = re.compile(r'R\$\s*(-?[\d.]*\d(?:,\d{1,2})?)|(-?\d{1,3}(?:\.\d{3})+,\d{2}|-?\d+,\d{2})')
+
+ITEM_HEADERS = ('item', 'descricao', 'produto', 'material', 'servico')
+SUPPLIER_HEADERS = ('fornecedor', 'empresa', 'proponente', 'razao social')
+UNIT_PRICE_HEADERS = ('preco unit', 'valor unit', 'unitario', 'preco', 'valor')
+TOTAL_HEADERS = ('total',)
+QUANTITY_HEADERS = ('qtd', 'quant')
+UNIT_HEADERS = ('unid', 'un')
+# Colunas de resumo ("Melhor Preço", "Total"): nunca são o preço de um fornecedor
+SUMMARY_HEADERS = ('melhor', 'economia', 'diferenca', 'media', 'menor', 'maior', 'total')
+# Colunas da tabela larga que não são fornecedores
+NON_SUPPLIER_HEADERS = ('observ', 'obs') + SUMMARY_HEADERS + QUANTITY_HEADERS + UNIT_HEADERS
+SKIP_ITEMS = ('total', 'subtotal', 'total geral', 'frete', 'desconto')
+
+
+def ensure_price_schema(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS fornecedor (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome_normalizado TEXT UNIQUE NOT NULL,
+            nome TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS item (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            descricao_normalizada TEXT UNIQUE NOT NULL,
+            descricao TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS preco (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            historico_id INTEGER NOT NULL,
+            fornecedor_id INTEGER NOT NULL REFERENCES fornecedor(id),
+            item_id INTEGER NOT NULL REFERENCES item(id),
+            valor REAL NOT NULL,
+            valor_total REAL,
+            quantidade REAL,
+            unidade TEXT,
+            data DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_preco_item_valor ON preco(item_id, valor)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_preco_item_data ON preco(item_id, data)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_preco_fornecedor ON preco(fornecedor_id, item_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_preco_historico ON preco(historico_id)')
+    ensure_price_dedup_schema(conn)
+    # Registro de quais análises já foram processadas (para o reprocessamento em lote)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS preco_extracao (
+            historico_id INTEGER PRIMARY KEY,
+            linhas INTEGER
+        )
+    ''')
+
+
+def ensure_price_dedup_schema(conn):
+    """Hash da resposta em cada preço + índice único (resposta, item, fornecedor)"""
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(preco)')}
+    if 'resposta_hash' not in columns:
+        conn.execute('ALTER TABLE preco ADD COLUMN resposta_hash TEXT')
+    conn.execute(
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_preco_resposta ON preco(resposta_hash, item_id, fornecedor_id)'
+    )
+
+
+def response_hash(resposta):
+    return hashlib.sha256((resposta or '').encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+def normalize_name(text):
+    text = fold(re.sub(r'<[^>]+>|\*\*', '', text or ''))
+    return re.sub(r'[^\w]+', ' ', text).strip()
+
+
+def parse_money(text):
+    """'R$ 1.234,56' -> 1234.56; None se não houver valor"""
+    match = MONEY_RE.search(text or '')
+    if not match:
+        return None
+    raw = (match.group(1) or match.group(2)).replace('.', '').replace(',', '.')
+    try:
+        return float(raw)
+    except ValueError:
+        return None
+
+
+def parse_number(text):
+    match = re.search(r'\d+(?:[.,]\d+)?', text or '')
+    return float(match.group().replace(',', '.')) if match else None
+
+
+class _HTMLTableParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.tables = []
+        self._row = None
+        self._cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'table':
+            self.tables.append([])
+        elif tag == 'tr' and self.tables:
+            self._row = []
+        elif tag in ('td', 'th') and self._row is not None:
+            self._cell = []
+
+    def handle_endtag(self, tag):
+        if tag in ('td', 'th') and self._cell is not None:
+            self._row.append(' '.join(''.join(self._cell).split()))
+            self._cell = None
+        elif tag == 'tr' and self._row is not None:
+            if self._row:
+                self.tables[-1].append(self._row)
+            self._row = None
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+
+
+def parse_tables(text):
+    """Tabelas HTML e markdown do texto, como listas de linhas (lista de células)"""
+    tables = []
+    if '<table' in (text or '').lower():
+        parser = _HTMLTableParser()
+        parser.feed(text)
+        tables.extend(table for table in parser.tables if len(table) > 1)
+
+    current = []
+    for line in (text or '').splitlines():
+        stripped = line.strip()
+        if stripped.startswith('|') and stripped.count('|') >= 2:
+            cells = [cell.strip() for cell in stripped.strip('|').split('|')]
+            if all(re.fullmatch(r':?-{2,}:?', cell) for cell in cells if cell):
+                continue  # Linha separadora |---|---|
+            current.append(cells)
+        elif current:
+            if len(current) > 1:
+                tables.append(current)
+            current = []
+    if len(current) > 1:
+        tables.append(current)
+    return tables
+
+
+def _matches(cell, keywords):
+    """Cabeçalho corresponde a alguma palavra-chave (palavra inteira ou prefixo com 3+ letras)"""
+    name = normalize_name(cell)
+    words = name.split()
+    for keyword in keywords:
+        if ' ' in keyword:
+            if keyword in name:
+                return True
+        elif keyword in words or (len(keyword) >= 3 and any(word.startswith(keyword) for word in words)):
+            return True
+    return False
+
+
+def _find_column(header, keywords, exclude=()):
+    for index, cell in enumerate(header):
+        if index not in exclude and _matches(cell, keywords):
+            return index
+    return None
+
+
+def _find_columns(header, keywords, exclude=()):
+    return [index for index, cell in enumerate(header) if index not in exclude and _matches(cell, keywords)]
+
+
+def extract_price_rows(text):
+    """Lê as tabelas de preço. Retorna [(fornecedor, item, valor, valor_total, quantidade, unidade)]"""
+    results = []
+    for table in parse_tables(text):
+        header, rows = table[0], table[1:]
+        item_col = _find_column(header, ITEM_HEADERS)
+        if item_col is None:
+            continue
+        quantity_col = _find_column(header, QUANTITY_HEADERS)
+        unit_col = _find_column(header, UNIT_HEADERS)
+        # Formato longo só com UMA coluna de fornecedor e UMA de preço unitário (ou só o total).
+        # "Item | Fornecedor A | Fornecedor B | Melhor Preço" é tabela larga.
+        supplier_cols = _find_columns(header, SUPPLIER_HEADERS, exclude=(item_col,))
+        total_col = _find_column(header, TOTAL_HEADERS, exclude=(item_col,))
+        price_cols = [
+            index for index in _find_columns(header, UNIT_PRICE_HEADERS, exclude=(item_col, total_col))
+            if index not in supplier_cols and not _matches(header[index], SUMMARY_HEADERS)
+        ]
+        long_format = len(supplier_cols) == 1 and (len(price_cols) == 1 or (not price_cols and total_col is not None))
+
+        def cell(row, index):
+            return row[index] if index is not None and index < len(row) else ''
+
+        if long_format:
+            # Formato longo: uma linha por (fornecedor, item)
+            supplier_col = supplier_cols[0]
+            price_col = price_cols[0] if price_cols else None
+            for row in rows:
+                item = cell(row, item_col)
+                valor = parse_money(cell(row, price_col)) if price_col is not None else None
+                total = parse_money(cell(row, total_col)) if total_col is not None else None
+                if valor is None:
+                    valor = total
+                if not item or valor is None or normalize_name(item) in SKIP_ITEMS:
+                    continue
+                results.append((cell(row, supplier_col), item, valor, total,
+                                parse_number(cell(row, quantity_col)), cell(row, unit_col) or None))
+        else:
+            # Formato largo: cada coluna restante é um fornecedor
+            wide_cols = [
+                index for index, name in enumerate(header)
+                if index not in (item_col, quantity_col, unit_col) and name.strip()
+                and not _matches(name, NON_SUPPLIER_HEADERS)
+            ]
+            for row in rows:
+                item = cell(row, item_col)
+                if not item or normalize_name(item) in SKIP_ITEMS:
+                    continue
+                for index in wide_cols:
+                    valor = parse_money(cell(row, index))
+                    if valor is not None:
+                        results.append((header[index], item, valor, None,
+                                        parse_number(cell(row, quantity_col)), cell(row, unit_col) or None))
+    return results
+
+
+def _get_or_create(conn, table, normalized_column, display_column, value, cache):
+    normalized = normalize_name(value)
+    if not normalized:
+        return None
+    key = (table, normalized)
+    if key in cache:
+        return cache[key]
+    conn.execute(
+        f'INSERT OR IGNORE INTO {table} ({normalized_column}, {display_column}) VALUES (?, ?)',
+        (normalized, re.sub(r'<[^>]+>|\*\*', '', value).strip())
+    )
+    row_id = conn.execute(f'SELECT id FROM {table} WHERE {normalized_column} = ?', (normalized,)).fetchone()[0]
+    cache[key] = row_id
+    return row_id
+
+
+def store_prices(conn, historico_id, resposta, data=None, cache=None):
+    """Grava os preços de uma análise (sem commit). Retorna quantas linhas novas gravou.
+
+    Resposta já vista (mesmo hash) não gera linhas de novo.
+    """
+    cache = {} if cache is None else cache
+    digest = response_hash(resposta)
+    rows = []
+    for fornecedor, item, valor, total, quantidade, unidade in extract_price_rows(resposta):
+        fornecedor_id = _get_or_create(conn, 'fornecedor', 'nome_normalizado', 'nome', fornecedor, cache)
+        item_id = _get_or_create(conn, 'item', 'descricao_normalizada', 'descricao', item, cache)
+        if fornecedor_id and item_id:
+            rows.append((historico_id, fornecedor_id, item_id, valor, total, quantidade, unidade, data, digest))
+    before = conn.total_changes
+    conn.executemany(
+        'INSERT OR IGNORE INTO preco (historico_id, fornecedor_id, item_id, valor, valor_total, quantidade, unidade, '
+        "data, resposta_hash) VALUES (?, ?, ?, ?, ?, ?, ?, COALESCE(?, datetime('now')), ?)",
+        rows
+    )
+    stored = conn.total_changes - before
+    conn.execute(
+        'INSERT OR REPLACE INTO preco_extracao (historico_id, linhas) VALUES (?, ?)',
+        (historico_id, stored)
+    )
+    return stored
+
+
+def skip_prices(conn, historico_id):
+    """Marca a análise como processada sem extrair (pergunta, e-mail, resposta interrompida)"""
+    conn.execute('INSERT OR REPLACE INTO preco_extracao (historico_id, linhas) VALUES (?, 0)', (historico_id,))
+
+
+def record_prices(conn, historico_id, resposta, comparison, data=None, cache=None):
+    """Extrai os preços (comparison=True) ou só marca a análise como processada.
+
+    Roda em um SAVEPOINT: uma resposta que não dá para ler nunca desfaz o
+    resto da transação (histórico gravado, outras análises do lote) e fica
+    marcada como processada, sem preços.
+    Retorna quantas linhas de preço novas gravou.
+    """
+    conn.execute('SAVEPOINT precos')
+    try:
+        stored = store_prices(conn, historico_id, resposta, data, cache) if comparison else 0
+        if not comparison:
+            skip_prices(conn, historico_id)
+        conn.execute('RELEASE SAVEPOINT precos')
+        return stored
+    except Exception as e:
+        conn.execute('ROLLBACK TO SAVEPOINT precos')
+        conn.execute('RELEASE SAVEPOINT precos')
+        print(f"⚠️ Erro ao extrair preços da análise {historico_id}: {e}")
+        skip_prices(conn, historico_id)  # Não tenta de novo a cada backfill
+        return 0
+
+
+def is_comparison_row(conn, system_prompt_id, prompt_z):
+    """Mesma regra das análises novas (roteamento 'comparacao') aplicada a um registro gravado"""
+    try:
+        messages = load_messages(conn, system_prompt_id, prompt_z)
+    except Exception:  # Prompt antigo que não é JSON (ou BLOB corrompido): sem extração
+        return False
+    return isinstance(messages, list) and classify(messages) == 'comparacao'
+
+
+def backfill_prices(conn, batch_size=200):
+    """Processa as análises do histórico que ainda não passaram pela extração.
+
+    Só as comparativas geram preços; as demais ficam marcadas como processadas.
+    Roda uma vez, como migração (api/migrations.py), ou via linha de comando.
+    """
+    total = 0
+    cache = {}
+    while True:
+        rows = conn.execute('''
+            SELECT h.id, h.system_prompt_id, h.prompt_z, h.resposta_z, h.data FROM historico h
+            LEFT JOIN preco_extracao e ON e.historico_id = h.id
+            WHERE e.historico_id IS NULL AND h.resposta_z IS NOT NULL
+            LIMIT ?
+        ''', (batch_size,)).fetchall()
+        if not rows:
+            break
+        for historico_id, system_prompt_id, prompt_z, resposta_z, data in rows:
+            comparison = is_comparison_row(conn, system_prompt_id, prompt_z)
+            try:
+                resposta = decompress_text(resposta_z) if comparison else None
+            except Exception as e:  # BLOB corrompido: marca como processada e segue
+                print(f"⚠️ Resposta ilegível na análise {historico_id}: {e}")
+                comparison, resposta = False, None
+            total += record_prices(conn, historico_id, resposta, comparison, data, cache)
+        conn.commit()
+    return total
+
+
+# ---- Consultas agregadas ----
+
+def find_items(conn, query=None, limit=50):
+    """Itens conhecidos com contagem e faixa de preço"""
+    sql = '''
+        SELECT i.id, i.descricao, COUNT(p.id), MIN(p.valor), MAX(p.valor), AVG(p.valor), MAX(p.data)
+        FROM item i JOIN preco p ON p.item_id = i.id
+    '''
+    params = []
+    if query:
+        sql += ' WHERE i.descricao_normalizada LIKE ?'
+        params.append(f'%{normalize_name(query)}%')
+    sql += ' GROUP BY i.id ORDER BY COUNT(p.id) DESC LIMIT ?'
+    params.append(limit)
+    return [
+        {'item_id': row[0], 'item': row[1], 'ocorrencias': row[2], 'min': row[3], 'max': row[4],
+         'media': round(row[5], 2), 'ultima_cotacao': row[6]}
+        for row in conn.execute(sql, params).fetchall()
+    ]
+
+
+def resolve_item_id(conn, item):
+    row = conn.execute(
+        'SELECT id FROM item WHERE descricao_normalizada = ?', (normalize_name(item),)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def median(conn, item_id, count):
+    """Mediana pelo índice (item_id, valor): lê no máximo 2 linhas"""
+    if not count:
+        return None
+    values = [row[0] for row in conn.execute(
+        'SELECT valor FROM preco WHERE item_id = ? ORDER BY valor LIMIT ? OFFSET ?',
+        (item_id, 2 - count % 2, (count - 1) // 2)
+    )]
+    return sum(values) / len(values)
+
+
+TREND_FORMATS = {'dia': '%Y-%m-%d', 'mes': '%Y-%m', 'ano': '%Y'}
+
+
+def item_stats(conn, item_id, periodo='mes'):
+    """Mínimo, mediana, máximo, por fornecedor e tendência por período de um item"""
+    item = conn.execute('SELECT descricao FROM item WHERE id = ?', (item_id,)).fetchone()
+    if not item:
+        return None
+    count, minimum, maximum, average = conn.execute(
+        'SELECT COUNT(*), MIN(valor), MAX(valor), AVG(valor) FROM preco WHERE item_id = ?', (item_id,)
+    ).fetchone()
+    fornecedores = [
+        {'fornecedor': row[0], 'ocorrencias': row[1], 'min': row[2], 'max': row[3], 'ultima_cotacao': row[4]}
+        for row in conn.execute('''
+            SELECT f.nome, COUNT(*), MIN(p.valor), MAX(p.valor), MAX(p.data)
+            FROM preco p JOIN fornecedor f ON f.id = p.fornecedor_id
+            WHERE p.item_id = ? GROUP BY f.id ORDER BY MIN(p.valor)
+        ''', (item_id,))
+    ]
+    date_format = TREND_FORMATS.get(periodo, TREND_FORMATS['mes'])
+    tendencia = [
+        {'periodo': row[0], 'ocorrencias': row[1], 'min': row[2], 'media': round(row[3], 2), 'max': row[4]}
+        for row in conn.execute('''
+            SELECT strftime(?, data) AS periodo, COUNT(*), MIN(valor), AVG(valor), MAX(valor)
+            FROM preco WHERE item_id = ? GROUP BY periodo ORDER BY periodo
+        ''', (date_format, item_id))
+    ]
+    return {
+        'item_id': item_id,
+        'item': item[0],
+        'ocorrencias': count,
+        'min': minimum,
+        'mediana': median(conn, item_id, count),
+        'max': maximum,
+        'media': round(average, 2) if average is not None else None,
+        'fornecedores': fornecedores,
+        'tendencia': tendencia,
+    }
+
+
+if __name__ == '__main__':
+    import os
+
+    default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'historico_base.db')
+    conn = connect(sys.argv[1] if len(sys.argv) > 1 else default_path)
+    ensure_price_schema(conn)
+    conn.commit()
+    print(f"✅ {backfill_prices(conn)} preços extraídos do histórico")
+    conn.close()
@@ -0,0 +1,79 @@
+"""Prompt da Responses API com prefixo estável (prompt caching da OpenAI)
+
+A OpenAI reaproveita o processamento de prefixos idênticos byte a byte (a partir
+de 1024 tokens): a parte em cache custa menos e responde mais rápido. Antes, o
+promptUnificado (3-4KB) ia junto com o conteúdo do usuário em uma string só, e
+só a última mensagem do usuário chegava ao modelo. Agora:
+- instructions: as mensagens system do início da conversa, exatamente como
+  vieram (sem data, contagem ou outro dado variável no meio)
+- input: o restante da conversa em ordem, mensagem a mensagem (perguntas e
+  respostas anteriores); system no meio da conversa (ex: contexto histórico)
+  vira developer na posição em que estava
+- prompt_cache_key: hash das instructions, para chamadas com o mesmo prefixo
+  caírem no mesmo cache
+
+cached_tokens() lê quantos tokens de entrada vieram do cache na resposta.
+"""
+import hashlib
+
+from api.token_budget import content_text
+
+# Partes de conteúdo no formato do Chat Completions -> Responses API
+INPUT_PART_TYPES = {'text': 'input_text', 'image_url': 'input_image'}
+
+
+def _convert_content(content, role):
+    """Texto fica como está; listas de partes (texto/imagem) viram o formato da Responses API"""
+    if isinstance(content, str) or content is None:
+        return content or ""
+    text_type = 'output_text' if role == 'assistant' else 'input_text'
+    parts = []
+    for part in content:
+        if not isinstance(part, dict):
+            continue
+        if part.get('type') == 'image_url' and role != 'assistant':
+            image = part.get('image_url')
+            parts.append({'type': 'input_image', 'image_url': image.get('url') if isinstance(image, dict) else image})
+        elif 'text' in part:
+            parts.append({'type': text_type, 'text': part['text']})
+    return parts
+
+
+def split_instructions(messages):
+    """(instructions, demais mensagens): as system do início formam o prefixo fixo"""
+    leading = 0
+    while leading < len(messages) and messages[leading].get('role') == 'system':
+        leading += 1
+    instructions = "\n\n".join(
+        text for text in (content_text(msg.get('content')).strip() for msg in messages[:leading]) if text
+    )
+    return instructions, messages[leading:]
+
+
+def responses_prompt(messages):
+    """Argumentos instructions/input/prompt_cache_key para client.responses.create"""
+    instructions, conversation = split_instructions(messages)
+    items = []
+    for msg in conversation:
+        role = msg.get('role')
+        if role == 'system':
+            role = 'developer'  # Contexto injetado no meio da conversa
+        elif role not in ('user', 'assistant', 'developer'):
+            continue
+        items.append({'role': role, 'content': _convert_content(msg.get('content'), role)})
+    if not items:
+        # Só havia instruções: vão como a mensagem do usuário (input não pode ser vazio)
+        return {'input': [{'role': 'user', 'content': instructions}]}
+    prompt = {'input': items}
+    if instructions:
+        prompt['instructions'] = instructions
+        prompt['prompt_cache_key'] = hashlib.sha256(instructions.encode('utf-8')).hexdigest()[:32]
+    return prompt
+
+
+def cached_tokens(usage):
+    """Tokens de entrada servidos do cache (Responses API ou Chat Completions)"""
+    if usage is None:
+        return 0
+    details = getattr(usage, 'input_tokens_details', None) or getattr(usage, 'prompt_tokens_details', None)
+    return getattr(details, 'cached_tokens', None) or 0
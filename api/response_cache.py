@@ -0,0 +1,156 @@
+"""Cache de respostas da OpenAI endereçado por conteúdo
+
+A chave é um hash de (modelo, max_tokens, mensagens normalizadas). Duas camadas:
+- memória (LRU por processo, acesso em microssegundos)
+- SQLite em disco, compartilhado entre os workers do gunicorn
+Ambas respeitam TTL; a camada em disco é limitada por número de entradas.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from api.db_pool import SQLitePool
+
+CACHE_DB_PATH = os.getenv('RESPONSE_CACHE_DB_PATH', os.path.join(os.path.dirname(__file__), 'cache_respostas.db'))
+CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 24 * 3600))  # 24h
+CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 2000))  # Camada em disco
+CACHE_MEMORY_ENTRIES = int(os.getenv('RESPONSE_CACHE_MEMORY_ENTRIES', 100))  # LRU por worker
+CACHE_MEMORY_TTL = 60  # Memória expira antes: invalidações de outros workers chegam em até 60s
+
+
+def normalize_messages(messages):
+    """Remove diferenças irrelevantes (espaços, quebras de linha, campos extras)"""
+    normalized = []
+    for msg in messages:
+        content = msg.get('content', '')
+        if isinstance(content, str):
+            lines = content.replace('\r\n', '\n').split('\n')
+            content = '\n'.join(line.rstrip() for line in lines).strip()
+        normalized.append({'role': str(msg.get('role', '')).lower(), 'content': content})
+    return normalized
+
+
+def make_cache_key(model, max_tokens, messages):
+    """Hash SHA-256 de (modelo, max_tokens, mensagens normalizadas)"""
+    payload = json.dumps(
+        {'model': model, 'max_tokens': max_tokens, 'messages': normalize_messages(messages)},
+        ensure_ascii=False, sort_keys=True, separators=(',', ':')
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """Cache LRU em memória na frente de uma tabela SQLite com TTL"""
+
+    def __init__(self, db_path=CACHE_DB_PATH, ttl=CACHE_TTL,
+                 max_entries=CACHE_MAX_ENTRIES, memory_entries=CACHE_MEMORY_ENTRIES):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()  # key -> (content, expires_at)
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._pool = SQLitePool(db_path)
+        self._init_db()
+
+    def _init_db(self):
+        try:
+            with self._pool.connection() as conn:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS cache_respostas (
+                        chave TEXT PRIMARY KEY,
+                        modelo TEXT,
+                        resposta TEXT,
+                        criado_em REAL,
+                        expira_em REAL,
+                        ultimo_acesso REAL
+                    )
+                ''')
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_cache_ultimo_acesso ON cache_respostas(ultimo_acesso)')
+                conn.commit()
+        except Exception as e:
+            print(f"❌ Erro ao inicializar cache de respostas: {e}")
+
+    def _remember(self, key, content, expires_at):
+        expires_at = min(expires_at, time.time() + CACHE_MEMORY_TTL)
+        with self._lock:
+            self._memory[key] = (content, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Retorna a resposta em cache ou None (expirada/ausente)"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry:
+                if entry[1] > now:
+                    self._memory.move_to_end(key)
+                    return entry[0]
+                del self._memory[key]
+        try:
+            with self._pool.connection() as conn:
+                row = conn.execute(
+                    'SELECT resposta, expira_em FROM cache_respostas WHERE chave = ?', (key,)
+                ).fetchone()
+                if not row:
+                    return None
+                if row[1] <= now:
+                    conn.execute('DELETE FROM cache_respostas WHERE chave = ?', (key,))
+                    conn.commit()
+                    return None
+                conn.execute('UPDATE cache_respostas SET ultimo_acesso = ? WHERE chave = ?', (now, key))
+                conn.commit()
+        except Exception as e:
+            print(f"⚠️ Erro ao ler cache de respostas: {e}")
+            return None
+        self._remember(key, row[0], row[1])
+        return row[0]
+
+    def set(self, key, model, content):
+        """Grava a resposta nas duas camadas e aplica o limite de tamanho"""
+        now = time.time()
+        expires_at = now + self.ttl
+        self._remember(key, content, expires_at)
+        try:
+            with self._pool.connection() as conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO cache_respostas '
+                    '(chave, modelo, resposta, criado_em, expira_em, ultimo_acesso) VALUES (?, ?, ?, ?, ?, ?)',
+                    (key, model, content, now, expires_at, now)
+                )
+                self._writes += 1
+                # Limpeza a cada 50 gravações para não pagar o custo em toda requisição
+                if self._writes % 50 == 1:
+                    self._evict(conn, now)
+                conn.commit()
+        except Exception as e:
+            print(f"⚠️ Erro ao gravar cache de respostas: {e}")
+
+    def _evict(self, conn, now):
+        conn.execute('DELETE FROM cache_respostas WHERE expira_em <= ?', (now,))
+        conn.execute('''
+            DELETE FROM cache_respostas WHERE chave IN (
+                SELECT chave FROM cache_respostas ORDER BY ultimo_acesso DESC LIMIT -1 OFFSET ?
+            )
+        ''', (self.max_entries,))
+
+    def invalidate(self, key):
+        """Remove uma entrada das duas camadas"""
+        with self._lock:
+            self._memory.pop(key, None)
+        try:
+            with self._pool.connection() as conn:
+                conn.execute('DELETE FROM cache_respostas WHERE chave = ?', (key,))
+                conn.commit()
+        except Exception as e:
+            print(f"⚠️ Erro ao invalidar cache de respostas: {e}")
+
+    def close(self):
+        """Fecha as conexões ociosas (master do gunicorn, antes do fork)"""
+        self._pool.close_all()
@@ -0,0 +1,244 @@
+"""Índice vetorial local do histórico (busca semântica das análises anteriores)
+
+Sem modelo externo: cada análise vira um vetor por "feature hashing" das
+palavras e pares de palavras (sem acento, sem stopwords), normalizado (L2).
+Os vetores ficam em uma matriz float32 mapeada em memória (NumPy memmap) e
+crescem só por append, quando o gravador do histórico salva um lote.
+
+Arquivos (ao lado do banco):
+- <base>.<dim>.ids  int64, ID do historico de cada linha
+- <base>.<dim>.vec  float32, uma linha de `dim` valores por análise
+
+Vários workers podem gravar: o append é protegido por flock e os leitores
+reabrem o memmap quando o arquivo cresce.
+
+Busca em dois estágios para ficar em poucos ms com 100k análises: primeiro a
+distância de Hamming entre os sinais dos vetores (1 bit por dimensão, mantidos
+em memória em layout coluna a coluna), depois o cosseno exato só nos
+RERANK_CANDIDATES mais próximos, lidos do memmap.
+
+Reconstruir a partir do banco: `python -m api.semantic_index [caminho.db]`
+"""
+import fcntl
+import math
+import os
+import sys
+import threading
+import zlib
+
+import numpy as np
+
+from api.history_search import STOPWORDS, TERM_RE, fold
+from api.history_store import decompress_text, user_text
+
+SEMANTIC_DIM = int(os.getenv('SEMANTIC_DIM', 512))
+EMBED_MAX_CHARS = 4000  # Por campo (pergunta e resposta); o início basta para o assunto
+SYNC_BATCH = 500
+RERANK_CANDIDATES = 1024
+
+
+def _features(text):
+    words = [word for word in TERM_RE.findall(fold(text[:EMBED_MAX_CHARS])) if word not in STOPWORDS]
+    features = {}
+    for index, word in enumerate(words):
+        features[word] = features.get(word, 0) + 1
+        if index:
+            bigram = words[index - 1] + ' ' + word
+            features[bigram] = features.get(bigram, 0) + 1
+    return features
+
+
+def embed(texts, dim=SEMANTIC_DIM):
+    """Matriz (len(texts), dim) float32 com vetores normalizados"""
+    matrix = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        features = _features(text or '')
+        if not features:
+            continue
+        indexes = np.empty(len(features), dtype=np.int64)
+        weights = np.empty(len(features), dtype=np.float32)
+        for position, (feature, count) in enumerate(features.items()):
+            digest = zlib.crc32(feature.encode('utf-8'))  # Estável entre processos (hash() não é)
+            indexes[position] = digest % dim
+            # Bit alto define o sinal: colisões tendem a se cancelar; tf sublinear
+            weights[position] = (1.0 if digest & 0x80000000 else -1.0) * (1.0 + math.log(count))
+        vector = np.bincount(indexes, weights=weights, minlength=dim)
+        norm = np.linalg.norm(vector)
+        if norm:
+            matrix[row] = vector / norm
+    return matrix
+
+
+def analysis_text(messages, resposta):
+    """Texto indexado de uma análise: mensagens do usuário + início da resposta"""
+    if isinstance(messages, list):
+        question = "\n\n".join(
+            msg.get('content', '') for msg in messages
+            if isinstance(msg, dict) and msg.get('role') == 'user' and isinstance(msg.get('content'), str)
+        )
+    else:
+        question = str(messages or '')
+    return f"{question[:EMBED_MAX_CHARS]}\n\n{(resposta or '')[:EMBED_MAX_CHARS]}"
+
+
+def sign_codes(vectors):
+    """Sinais dos vetores empacotados em uint64: (palavras, linhas), uma linha de bits por dimensão/64"""
+    packed = np.packbits(np.asarray(vectors) > 0, axis=1)
+    return np.ascontiguousarray(packed.view(np.uint64).T)
+
+
+class SemanticIndex:
+    def __init__(self, base_path, dim=SEMANTIC_DIM):
+        if dim % 64:
+            raise ValueError('SEMANTIC_DIM deve ser múltiplo de 64')
+        self.dim = dim
+        self.words = dim // 64
+        self.ids_path = f"{base_path}.{dim}.ids"
+        self.vec_path = f"{base_path}.{dim}.vec"
+        self.lock_path = f"{base_path}.{dim}.lock"
+        self._lock = threading.Lock()
+        self._count = 0
+        self._ids = np.empty(0, dtype=np.int64)
+        self._vectors = np.empty((0, dim), dtype=np.float32)
+        self._codes = np.empty((self.words, 0), dtype=np.uint64)  # Capacidade cresce em dobro
+
+    def _stored_count(self):
+        try:
+            ids_bytes = os.path.getsize(self.ids_path)
+            vec_bytes = os.path.getsize(self.vec_path)
+        except OSError:
+            return 0
+        # Um append interrompido pode deixar um arquivo maior que o outro
+        return min(ids_bytes // 8, vec_bytes // (self.dim * 4))
+
+    def _load(self):
+        """(ids, vetores, códigos) até a última linha gravada por qualquer worker"""
+        count = self._stored_count()
+        if count == self._count:
+            return self._ids, self._vectors, self._codes[:, :count]
+        with self._lock:
+            if count != self._count:
+                if count < self._count:
+                    # Índice reconstruído por fora: recomeça
+                    self._count = 0
+                if count:
+                    ids = np.memmap(self.ids_path, dtype=np.int64, mode='r', shape=(count,))
+                    vectors = np.memmap(self.vec_path, dtype=np.float32, mode='r', shape=(count, self.dim))
+                    if count > self._codes.shape[1]:
+                        codes = np.empty((self.words, max(count, self._codes.shape[1] * 2)), dtype=np.uint64)
+                        codes[:, :self._count] = self._codes[:, :self._count]
+                        self._codes = codes
+                    self._codes[:, self._count:count] = sign_codes(vectors[self._count:count])
+                    self._ids, self._vectors = ids, vectors
+                else:
+                    self._ids = np.empty(0, dtype=np.int64)
+                    self._vectors = np.empty((0, self.dim), dtype=np.float32)
+                self._count = count
+            return self._ids, self._vectors, self._codes[:, :self._count]
+
+    def __len__(self):
+        return self._stored_count()
+
+    def append(self, ids, texts):
+        """Acrescenta análises ao índice (chamado pelo gravador do histórico)"""
+        if not ids:
+            return 0
+        return self._write(np.asarray(ids, dtype=np.int64), embed(texts, self.dim))
+
+    def _write(self, ids, vectors, skip_after=None):
+        """Grava as linhas no fim dos arquivos, sob flock.
+
+        skip_after (usado pelo sync): descarta IDs que outro processo gravou
+        depois da linha skip_after, entre a leitura do índice e esta gravação.
+        """
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                count = self._stored_count()
+                if skip_after is not None and count > skip_after:
+                    written = np.fromfile(self.ids_path, dtype=np.int64, count=count - skip_after,
+                                          offset=skip_after * 8)
+                    keep = ~np.isin(ids, written)
+                    ids, vectors = ids[keep], vectors[keep]
+                if not len(ids):
+                    return 0
+                with open(self.ids_path, 'ab') as ids_file, open(self.vec_path, 'ab') as vec_file:
+                    # Descarta sobras de um append interrompido antes de gravar
+                    ids_file.truncate(count * 8)
+                    vec_file.truncate(count * self.dim * 4)
+                    vec_file.write(vectors.tobytes())
+                    vec_file.flush()
+                    ids_file.write(ids.tobytes())
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return len(ids)
+
+    def _candidates(self, codes, query_code, count):
+        """Linhas com menor distância de Hamming ao código da consulta"""
+        distance = np.bitwise_count(codes[0] ^ query_code[0]).astype(np.uint16)
+        for word in range(1, self.words):
+            distance += np.bitwise_count(codes[word] ^ query_code[word])
+        return np.sort(np.argpartition(distance, count - 1)[:count])  # Ordenado: leitura sequencial no memmap
+
+    def search(self, queries, k=3):
+        """Top-k por similaridade de cosseno, em lote. Retorna [[(historico_id, score), ...], ...]"""
+        ids, vectors, codes = self._load()
+        if not len(ids) or not queries:
+            return [[] for _ in queries]
+        query_vectors = embed(queries, self.dim)
+        query_codes = sign_codes(query_vectors).T
+        rerank = max(RERANK_CANDIDATES, k)
+        results = []
+        for query_vector, query_code in zip(query_vectors, query_codes):
+            if len(ids) > rerank:
+                candidates = self._candidates(codes, query_code, rerank)
+                scores = vectors[candidates] @ query_vector
+            else:
+                candidates = np.arange(len(ids))
+                scores = vectors @ query_vector
+            # Uma análise pode aparecer duas vezes (sync e gravador ao mesmo tempo): vale a primeira
+            hits, seen = [], set()
+            for index in np.argsort(-scores)[:k * 2]:
+                hit_id = int(ids[candidates[index]])
+                if hit_id not in seen and len(hits) < k:
+                    seen.add(hit_id)
+                    hits.append((hit_id, float(scores[index])))
+            results.append(hits)
+        return results
+
+    def sync(self, conn, batch_size=SYNC_BATCH):
+        """Indexa as linhas do histórico que ainda não estão no índice.
+
+        Compara com o conjunto de IDs indexados (não só com o maior): uma
+        análise cujo append falhou no gravador entra aqui, mesmo que linhas
+        mais novas já estejam no índice.
+        """
+        ids, _, _ = self._load()
+        snapshot = len(ids)
+        indexed = set(ids.tolist())
+        missing = [
+            row[0] for row in conn.execute('SELECT id FROM historico WHERE prompt_z IS NOT NULL ORDER BY id')
+            if row[0] not in indexed
+        ]
+        added = 0
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            rows = conn.execute(
+                f'SELECT id, prompt_z, resposta_z FROM historico WHERE id IN ({",".join("?" * len(batch))}) ORDER BY id',
+                batch
+            ).fetchall()
+            texts = [analysis_text(user_text(prompt_z), decompress_text(resposta_z)) for _, prompt_z, resposta_z in rows]
+            added += self._write(np.asarray([row[0] for row in rows], dtype=np.int64), embed(texts, self.dim),
+                                 skip_after=snapshot)
+        return added
+
+
+if __name__ == '__main__':
+    from api.db_pool import connect
+
+    default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'historico_base.db')
+    db_path = sys.argv[1] if len(sys.argv) > 1 else default_path
+    index = SemanticIndex(f"{db_path}-vetores")
+    conn = connect(db_path)
+    print(f"✅ {index.sync(conn)} análises indexadas ({len(index)} no total)")
+    conn.close()
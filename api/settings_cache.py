@@ -0,0 +1,111 @@
+"""Cache das configurações (GET /api/settings) com invalidação entre workers
+
+Leitura com cache por processo (TTL). A tabela configuracoes_versao guarda um
+número de versão incrementado por triggers a cada escrita em configuracoes;
+cada worker confere esse número no máximo a cada VERSION_CHECK_INTERVAL
+segundos e descarta o cache quando ele muda. O worker que grava invalida na
+hora.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_SETTINGS = {'modelo': 'gpt-5', 'max_tokens': 8000, 'chunk_size': 8000}
+SETTINGS_CACHE_TTL = float(os.getenv('SETTINGS_CACHE_TTL', 300))  # 0 desliga o cache
+VERSION_CHECK_INTERVAL = 1.0  # Atraso máximo para ver gravações de outros workers
+# A api_key vem do cliente (header/query): sem limite, cada chave diferente ficaria na memória de cada worker
+SETTINGS_CACHE_SIZE = int(os.getenv('SETTINGS_CACHE_SIZE', 1024))
+
+
+def ensure_settings_schema(conn):
+    conn.execute('CREATE TABLE IF NOT EXISTS configuracoes_versao (id INTEGER PRIMARY KEY, versao INTEGER NOT NULL)')
+    conn.execute('INSERT OR IGNORE INTO configuracoes_versao (id, versao) VALUES (1, 0)')
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_configuracoes_versao_{event.lower()} AFTER {event} ON configuracoes BEGIN
+                UPDATE configuracoes_versao SET versao = versao + 1 WHERE id = 1;
+            END
+        ''')
+
+
+def settings_etag(settings):
+    """ETag pelo conteúdo (o flag 'cached' sai das próprias configurações)"""
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+class SettingsCache:
+    def __init__(self, get_connection, ttl=SETTINGS_CACHE_TTL, check_interval=VERSION_CHECK_INTERVAL,
+                 max_entries=SETTINGS_CACHE_SIZE):
+        self.get_connection = get_connection  # Context manager de conexão (pool)
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # api_key -> (configurações ou None, instante da leitura), LRU
+        self._version = None
+        self._checked_at = 0.0
+        self._stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'evictions': 0}
+
+    def _check_version(self, conn):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        row = conn.execute('SELECT versao FROM configuracoes_versao WHERE id = 1').fetchone()
+        version = row[0] if row else 0
+        with self._lock:
+            self._checked_at = now
+            if version != self._version:
+                if self._version is not None:
+                    self._entries.clear()  # Outro worker gravou
+                    self._stats['invalidations'] += 1
+                self._version = version
+
+    def get(self, api_key):
+        """Retorna (configurações ou None se não houver registro, veio_do_cache)"""
+        if self.ttl <= 0:
+            return self._load(api_key), False
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            with self.get_connection() as conn:
+                self._check_version(conn)
+        with self._lock:
+            entry = self._entries.get(api_key)
+            if entry and time.monotonic() - entry[1] < self.ttl:
+                self._entries.move_to_end(api_key)
+                self._stats['hits'] += 1
+                return entry[0], True
+            self._stats['misses'] += 1
+        settings = self._load(api_key)
+        with self._lock:
+            self._entries[api_key] = (settings, time.monotonic())
+            self._entries.move_to_end(api_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+        return settings, False
+
+    def _load(self, api_key):
+        with self.get_connection() as conn:
+            row = conn.execute(
+                'SELECT modelo, max_tokens, chunk_size FROM configuracoes WHERE api_key = ?', (api_key,)
+            ).fetchone()
+        return {'modelo': row[0], 'max_tokens': row[1], 'chunk_size': row[2]} if row else None
+
+    def invalidate(self, api_key=None):
+        with self._lock:
+            if api_key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(api_key, None)
+            self._checked_at = 0.0  # Relê a versão na próxima consulta
+            self._stats['invalidations'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        stats['ttl'] = self.ttl
+        stats['max_entries'] = self.max_entries
+        return stats
@@ -0,0 +1,192 @@
+"""Single-flight: requisições idênticas simultâneas compartilham uma chamada à OpenAI
+
+Duplo clique em "enviar" ou vários colegas analisando o mesmo BID ao mesmo
+tempo geram a mesma chave (mensagens normalizadas + modelo + max_tokens).
+
+- Dentro do worker: a primeira thread chama a OpenAI e as demais esperam o
+  mesmo resultado (threading.Event).
+- Entre workers: a thread líder de cada worker disputa um flock por chave em
+  SINGLE_FLIGHT_DIR. Quem não consegue espera o lock e lê o resultado que o
+  líder gravou ao lado do lock; se ele não existir (líder caiu), faz a
+  chamada por conta própria.
+"""
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+
+SINGLE_FLIGHT_DIR = os.getenv(
+    'SINGLE_FLIGHT_DIR', os.path.join(tempfile.gettempdir(), f'analise-bid-singleflight-{os.getuid()}')
+)
+SINGLE_FLIGHT_TIMEOUT = 120  # Espera máxima pelo líder (acima do OPENAI_TIMEOUT com retries)
+LOCK_POLL_INTERVAL = 0.05
+CLEANUP_EVERY = 200  # Chamadas de líder entre limpezas dos arquivos antigos
+FILE_TTL = 600  # Segundos até um arquivo de lock/resultado ser considerado lixo
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class SingleFlight:
+    def __init__(self, lock_dir=SINGLE_FLIGHT_DIR, timeout=SINGLE_FLIGHT_TIMEOUT):
+        self.lock_dir = lock_dir
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._calls = 0
+        self._stats = {'leaders': 0, 'coalesced_local': 0, 'coalesced_workers': 0}
+        os.makedirs(lock_dir, exist_ok=True)
+
+    def do(self, key, func):
+        """Executa func() uma vez por chave entre as chamadas simultâneas.
+
+        Retorna (resultado, coalescido). O resultado precisa ser serializável em JSON.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            if flight.done.wait(self.timeout):
+                with self._lock:
+                    self._stats['coalesced_local'] += 1
+                return flight.result, True
+            return func(), False  # Líder travado: segue sozinho
+
+        try:
+            flight.result, coalesced = self._do_across_workers(key, func)
+            return flight.result, coalesced
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _do_across_workers(self, key, func):
+        lock_path = os.path.join(self.lock_dir, f'{key}.lock')
+        result_path = os.path.join(self.lock_dir, f'{key}.json')
+        waiting_since = time.time()
+        lock_file, acquired = self._open_locked(lock_path)
+        with lock_file:
+            try:
+                if acquired == 'waited':
+                    result = self._read_result(result_path, waiting_since)
+                    if result is not None:
+                        with self._lock:
+                            self._stats['coalesced_workers'] += 1
+                        return result['value'], True
+                result = func()
+                self._write_result(result_path, result)
+                with self._lock:
+                    self._stats['leaders'] += 1
+                    self._calls += 1
+                    cleanup = self._calls % CLEANUP_EVERY == 0
+                if cleanup:
+                    self._cleanup()
+                return result, False
+            finally:
+                if acquired:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _open_locked(self, lock_path):
+        """Abre o arquivo de lock e o trava; (arquivo, resultado de _acquire).
+
+        A limpeza pode apagar o arquivo entre o open() e o flock(): nesse caso o
+        lock obtido é de um arquivo que ninguém mais enxerga, e é preciso abrir de novo.
+        """
+        while True:
+            lock_file = open(lock_path, 'a')
+            acquired = self._acquire(lock_file)
+            if not acquired or self._same_file(lock_file, lock_path):
+                return lock_file, acquired
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+    @staticmethod
+    def _same_file(lock_file, lock_path):
+        try:
+            current = os.stat(lock_path)
+        except OSError:
+            return False
+        opened = os.fstat(lock_file.fileno())
+        return (current.st_dev, current.st_ino) == (opened.st_dev, opened.st_ino)
+
+    def _acquire(self, lock_file):
+        """'free' se o lock estava livre, 'waited' se outro worker o segurava, None se expirou"""
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return 'free'
+        except BlockingIOError:
+            pass
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return 'waited'
+            except BlockingIOError:
+                continue
+        return None
+
+    @staticmethod
+    def _read_result(result_path, since):
+        """Resultado gravado pelo líder de outro worker enquanto esperávamos"""
+        try:
+            with open(result_path, encoding='utf-8') as f:
+                result = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return result if result.get('time', 0) >= since else None
+
+    @staticmethod
+    def _write_result(result_path, value):
+        temp_path = f'{result_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'time': time.time(), 'value': value}, f, ensure_ascii=False)
+            os.replace(temp_path, result_path)  # Leitores nunca veem arquivo pela metade
+        except (OSError, TypeError, ValueError) as e:
+            print(f"⚠️ Single-flight: não foi possível compartilhar o resultado: {e}")
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+    def _cleanup(self):
+        """Apaga arquivos antigos. O mtime de um lock é o da criação, não o do uso:
+        o lock só é apagado com o flock na mão, para não roubar o de um líder ativo."""
+        cutoff = time.time() - FILE_TTL
+        try:
+            names = os.listdir(self.lock_dir)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.lock_dir, name)
+            try:
+                if os.path.getmtime(path) >= cutoff:
+                    continue
+                if not name.endswith('.lock'):
+                    os.remove(path)
+                    continue
+                with open(path, 'a') as lock_file:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue  # Em uso por um líder
+                    if self._same_file(lock_file, path):
+                        os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._flights)
+        stats['coalesced'] = stats['coalesced_local'] + stats['coalesced_workers']
+        return stats
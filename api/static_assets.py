@@ -0,0 +1,137 @@
+"""Arquivos estáticos pré-comprimidos e com nome versionado (fingerprint)
+
+Na primeira requisição que precisa deles (uma vez por processo; com
+preload_app, antes do fork via warm() no master) os arquivos da raiz do
+projeto são lidos para a memória:
+- cada CSS/JS/imagem ganha um nome com o hash do conteúdo
+  (document_ai_styles.<hash>.css), servido em /assets/ com cache "immutable"
+- as referências dentro do HTML/CSS são reescritas para esses nomes
+- variantes gzip e brotli (se o pacote `brotli` estiver instalado) são geradas
+  uma única vez; a requisição só escolhe a variante pelo Accept-Encoding
+- o HTML não é versionado: vai com ETag e revalidação (304 quando não mudou)
+
+Ver tamanhos gerados: `python -m api.static_assets`
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+from urllib.parse import quote
+
+from flask import Response
+
+from api.lazy import once
+
+try:
+    import brotli
+except ImportError:  # Opcional: sem ele, só gzip
+    brotli = None
+
+ASSET_EXTENSIONS = {'.html', '.css', '.js', '.png', '.jpg', '.jpeg', '.gif', '.svg', '.ico', '.webp'}
+COMPRESSIBLE_TYPES = {'text/html', 'text/css', 'text/javascript', 'application/javascript', 'image/svg+xml'}
+REWRITE_TYPES = {'text/html', 'text/css'}  # Conteúdo com referências a outros arquivos
+MIN_COMPRESS_BYTES = 1024
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE = 'no-cache'  # HTML: sempre revalida, mas com ETag volta 304 sem corpo
+UNVERSIONED_CACHE = 'public, max-age=3600'  # URLs antigas (/App-IA/arquivo.css) sem fingerprint
+ASSETS_URL = '/assets/'
+
+
+class Asset:
+    def __init__(self, name, content, mimetype):
+        self.name = name
+        self.mimetype = mimetype
+        self.digest = hashlib.sha256(content).hexdigest()[:12]
+        stem, ext = os.path.splitext(name)
+        self.fingerprinted = f'{stem}.{self.digest}{ext}'
+        self.url = ASSETS_URL + quote(self.fingerprinted)
+        # Variantes por Content-Encoding; None = sem compressão
+        self.variants = {None: content}
+        if mimetype in COMPRESSIBLE_TYPES and len(content) >= MIN_COMPRESS_BYTES:
+            gzipped = gzip.compress(content, compresslevel=9, mtime=0)
+            if len(gzipped) < len(content):
+                self.variants['gzip'] = gzipped
+            if brotli is not None:
+                compressed = brotli.compress(content, quality=11)
+                if len(compressed) < len(content):
+                    self.variants['br'] = compressed
+
+    def response(self, request, cache_control):
+        encoding = None
+        for candidate in ('br', 'gzip'):
+            if candidate in self.variants and request.accept_encodings.quality(candidate) > 0:
+                encoding = candidate
+                break
+        response = Response(self.variants[encoding], mimetype=self.mimetype)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = cache_control
+        response.set_etag(f'{self.digest}-{encoding or "identity"}')
+        return response.make_conditional(request)  # If-None-Match -> 304
+
+
+def _rewrite_references(text, assets):
+    """Troca 'arquivo.css' / "arquivo.png" / url(arquivo.png) pelas URLs versionadas"""
+    for asset in assets:
+        for quote_char in ('"', "'"):
+            text = text.replace(f'{quote_char}{asset.name}{quote_char}', f'{quote_char}{asset.url}{quote_char}')
+        text = text.replace(f'url({asset.name})', f'url({asset.url})')
+    return text
+
+
+class StaticAssets:
+    def __init__(self, root):
+        self.root = root
+        self.by_name = {}
+        self.by_fingerprint = {}
+        self.warm = once(self._build)  # Brotli nível 11 leva centenas de ms: fora da importação
+
+    def _build(self):
+        files = sorted(
+            name for name in os.listdir(self.root)
+            if os.path.splitext(name)[1].lower() in ASSET_EXTENSIONS and os.path.isfile(os.path.join(self.root, name))
+        )
+        types = {name: mimetypes.guess_type(name)[0] or 'application/octet-stream' for name in files}
+        # Primeiro os arquivos sem referências, depois CSS (pode citar imagens) e por fim HTML
+        order = {'text/css': 1, 'text/html': 2}
+        for name in sorted(files, key=lambda item: order.get(types[item], 0)):
+            with open(os.path.join(self.root, name), 'rb') as f:
+                content = f.read()
+            if types[name] in REWRITE_TYPES:
+                content = _rewrite_references(content.decode('utf-8'), self.by_name.values()).encode('utf-8')
+            asset = Asset(name, content, types[name])
+            self.by_name[name] = asset
+            self.by_fingerprint[asset.fingerprinted] = asset
+
+    def serve_fingerprinted(self, request, fingerprinted):
+        self.warm()
+        asset = self.by_fingerprint.get(fingerprinted)
+        return asset.response(request, IMMUTABLE_CACHE) if asset else None
+
+    def serve(self, request, name):
+        """Arquivo pelo nome original (páginas HTML e URLs antigas)"""
+        self.warm()
+        asset = self.by_name.get(name)
+        if asset is None:
+            return None
+        cache = REVALIDATE_CACHE if asset.mimetype == 'text/html' else UNVERSIONED_CACHE
+        return asset.response(request, cache)
+
+    def stats(self):
+        self.warm()
+        return {
+            'assets': len(self.by_name),
+            'bytes': sum(len(asset.variants[None]) for asset in self.by_name.values()),
+            'brotli': brotli is not None,
+        }
+
+
+if __name__ == '__main__':
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    assets = StaticAssets(root)
+    assets.warm()
+    for asset in assets.by_name.values():
+        sizes = ' | '.join(f'{encoding or "original"}: {len(body) / 1024:.1f}KB'
+                           for encoding, body in asset.variants.items())
+        print(f"📦 {asset.name} -> {asset.url} ({sizes})")
@@ -0,0 +1,223 @@
+"""Orçamento de tokens por modelo (substitui o antigo len(str(messages)) > 50000)
+
+A contagem é local (sem rede): usa o tiktoken quando os arquivos de encoding já
+estão em cache (TIKTOKEN_CACHE_DIR) e, caso contrário, um estimador baseado em
+palavras/números/pontuação próximo do BPE da OpenAI. O resultado por conteúdo
+fica em cache, então mensagens repetidas (system prompt) não são recontadas. A
+chave é o SHA-256 do texto (não o texto em si), para o cache não segurar cópias
+de prompts de centenas de KB na memória do worker.
+"""
+import hashlib
+import math
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from api.lazy import once
+
+# Limites por família de modelo (prefixo mais específico primeiro).
+# max_output/default_output seguem os valores que o chat() já aplicava.
+MODEL_LIMITS = (
+    ('gpt-5', {'context': 400000, 'max_input': 272000, 'max_output': 12000, 'default_output': 6000}),
+    ('gpt-4.1', {'context': 1047576, 'max_input': 1000000, 'max_output': 4000, 'default_output': 2000}),
+    ('gpt-4o', {'context': 128000, 'max_input': 128000, 'max_output': 4000, 'default_output': 2000}),
+    ('gpt-4-turbo', {'context': 128000, 'max_input': 128000, 'max_output': 4000, 'default_output': 2000}),
+    ('gpt-4', {'context': 8192, 'max_input': 8192, 'max_output': 4000, 'default_output': 2000}),
+    ('gpt-3.5', {'context': 16385, 'max_input': 16385, 'max_output': 4000, 'default_output': 2000}),
+)
+DEFAULT_LIMITS = {'context': 8192, 'max_input': 8192, 'max_output': 4000, 'default_output': 2000}
+
+# Teto opcional de entrada para controlar custo (0 = só o limite do modelo)
+MAX_INPUT_TOKENS = int(os.getenv('MAX_INPUT_TOKENS', 0))
+
+MESSAGE_OVERHEAD_TOKENS = 4  # role + separadores de cada mensagem
+REPLY_OVERHEAD_TOKENS = 3
+SAFETY_MARGIN_TOKENS = 256
+TRUNCATION_MARKER = "\n\n[...TRUNCADO...]\n\n"
+TOKEN_CACHE_SIZE = 2048
+TIKTOKEN_ENCODING = 'o200k_base'
+TIKTOKEN_ENCODING_URL = 'https://openaipublic.blob.core.windows.net/encodings/o200k_base.tiktoken'
+
+TOKEN_PIECE_RE = re.compile(r"[^\W\d_]+|\d+|[^\w\s]|\s+")
+
+
+class PromptTooLargeError(ValueError):
+    """Nem mesmo cortando o conteúdo do usuário a requisição cabe no modelo"""
+
+
+def get_model_limits(model):
+    for prefix, limits in MODEL_LIMITS:
+        if model.startswith(prefix):
+            return limits
+    return DEFAULT_LIMITS
+
+
+def resolve_max_tokens(model, requested=None):
+    """max_tokens efetivo: padrão do modelo quando ausente, limitado ao teto de saída"""
+    limits = get_model_limits(model)
+    if not requested:
+        return limits['default_output']
+    return max(1, min(int(requested), limits['max_output']))
+
+
+def max_input_tokens(model, max_tokens):
+    limits = get_model_limits(model)
+    budget = min(limits['max_input'], limits['context'] - max_tokens - SAFETY_MARGIN_TOKENS)
+    if MAX_INPUT_TOKENS:
+        budget = min(budget, MAX_INPUT_TOKENS)
+    return budget
+
+
+@once
+def _load_tiktoken():
+    """tiktoken só é usado se o encoding já estiver em disco (nunca baixa nada).
+
+    Carregado na primeira contagem, não na importação. O get_encoding baixa o
+    arquivo quando ele não está no cache, então antes confere se o arquivo
+    existe (o tiktoken o grava como sha1 da URL dentro de TIKTOKEN_CACHE_DIR).
+    """
+    cache_dir = os.getenv('TIKTOKEN_CACHE_DIR')
+    if not cache_dir:
+        return None
+    cached_file = os.path.join(cache_dir, hashlib.sha1(TIKTOKEN_ENCODING_URL.encode()).hexdigest())
+    if not os.path.isfile(cached_file):
+        return None
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(TIKTOKEN_ENCODING)
+    except Exception:
+        return None
+
+
+def _estimate_tokens(text):
+    tokens = 0
+    for match in TOKEN_PIECE_RE.finditer(text):
+        piece = match.group()
+        first = piece[0]
+        if first.isspace():
+            continue  # Espaço costuma ir junto com a palavra seguinte
+        if first.isdigit():
+            tokens += math.ceil(len(piece) / 3)  # Números: ~3 dígitos por token
+        elif first.isalpha():
+            tokens += max(1, math.ceil(len(piece) / 4))
+        else:
+            tokens += 1
+    return tokens
+
+
+def _count_tokens(text):
+    encoding = _load_tiktoken()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return _estimate_tokens(text)
+
+
+_token_cache = OrderedDict()  # (sha256, tamanho) -> tokens, LRU
+_token_cache_lock = threading.Lock()
+
+
+def count_text_tokens(text):
+    if not text:
+        return 0
+    key = (hashlib.sha256(text.encode('utf-8', 'surrogatepass')).digest(), len(text))
+    with _token_cache_lock:
+        tokens = _token_cache.get(key)
+        if tokens is not None:
+            _token_cache.move_to_end(key)
+            return tokens
+    tokens = _count_tokens(text)
+    with _token_cache_lock:
+        _token_cache[key] = tokens
+        if len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+    return tokens
+
+
+def content_text(content):
+    """Texto de um content de mensagem. Usado também no roteamento, na montagem do
+    prompt e nas conversas, para todos enxergarem o mesmo texto."""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):  # Formato multimodal: [{"type": "text", "text": ...}]
+        return "\n".join(part.get('text', '') for part in content if isinstance(part, dict))
+    return str(content or '')
+
+
+def count_message_tokens(messages):
+    total = REPLY_OVERHEAD_TOKENS
+    for msg in messages:
+        total += MESSAGE_OVERHEAD_TOKENS + count_text_tokens(content_text(msg.get('content', '')))
+    return total
+
+
+def truncate_middle(text, target_tokens):
+    """Corta o meio do texto (mantém início e fim, como o createChunks do frontend)"""
+    if target_tokens <= 0:
+        return TRUNCATION_MARKER.strip()
+    current = count_text_tokens(text)
+    while current > target_tokens:
+        keep_chars = int(len(text) * target_tokens / current * 0.95)
+        half = max(0, keep_chars // 2)
+        text = text[:half] + TRUNCATION_MARKER + text[len(text) - half:] if half else TRUNCATION_MARKER.strip()
+        current = _count_tokens(text)  # Versões intermediárias não vão para o cache
+        if not half:
+            break
+    return text
+
+
+def fit_messages(messages, model, max_tokens):
+    """Garante que as mensagens cabem no orçamento de entrada do modelo.
+
+    Ordem determinística de corte:
+    1. remove as mensagens mais antigas do histórico (nunca system nem a última do usuário)
+    2. corta o meio da maior mensagem restante que não seja system
+
+    Retorna (messages, tokens_info). Levanta PromptTooLargeError se não houver como caber.
+    """
+    budget = max_input_tokens(model, max_tokens)
+    original_tokens = count_message_tokens(messages)
+    info = {
+        'input_tokens': original_tokens,
+        'original_input_tokens': original_tokens,
+        'max_input_tokens': budget,
+        'max_output_tokens': max_tokens,
+        'trimmed': False,
+        'removed_messages': 0,
+    }
+    if original_tokens <= budget:
+        return messages, info
+
+    messages = [dict(msg) for msg in messages]
+    last_user_index = max((i for i, msg in enumerate(messages) if msg.get('role') == 'user'), default=-1)
+
+    # 1. Descartar histórico antigo
+    removable = [i for i, msg in enumerate(messages) if msg.get('role') != 'system' and i != last_user_index]
+    removed = set()
+    total = original_tokens
+    for index in removable:
+        if total <= budget:
+            break
+        total -= MESSAGE_OVERHEAD_TOKENS + count_text_tokens(content_text(messages[index].get('content', '')))
+        removed.add(index)
+    messages = [msg for i, msg in enumerate(messages) if i not in removed]
+
+    # 2. Cortar a maior mensagem não-system
+    if total > budget:
+        candidates = [msg for msg in messages if msg.get('role') != 'system']
+        if not candidates:
+            raise PromptTooLargeError('O system prompt sozinho excede o limite do modelo')
+        largest = max(candidates, key=lambda msg: count_text_tokens(content_text(msg.get('content', ''))))
+        text = content_text(largest.get('content', ''))
+        overflow = total - budget
+        largest['content'] = truncate_middle(text, count_text_tokens(text) - overflow)
+        total = count_message_tokens(messages)
+        if total > budget:
+            raise PromptTooLargeError(
+                f'Prompt excede o limite do modelo ({total} > {budget} tokens) mesmo após o corte'
+            )
+
+    info.update({'input_tokens': total, 'trimmed': True, 'removed_messages': len(removed)})
+    print(f"✂️ Prompt ajustado ao orçamento: {original_tokens} → {total} tokens "
+          f"(limite {budget}, {len(removed)} mensagens removidas)")
+    return messages, info
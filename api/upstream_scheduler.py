@@ -0,0 +1,337 @@
+"""Agendador das chamadas à OpenAI (limites de taxa, concorrência e retries)
+
+Quando a organização estoura o limite de requisições/tokens por minuto (RPM/TPM),
+os retries automáticos do SDK faziam todas as análises em andamento tentarem de
+novo ao mesmo tempo e falharem juntas. Aqui, por modelo:
+- token bucket de requisições e de tokens (entrada estimada + max_tokens);
+  começa com UPSTREAM_RPM/UPSTREAM_TPM e passa a seguir os cabeçalhos
+  x-ratelimit-* de cada resposta (que refletem a organização inteira, ou seja,
+  também o consumo dos outros workers)
+- limite de chamadas simultâneas adaptativo: cai pela metade a cada 429, sobe
+  uma vaga a cada sucesso e nunca passa das requisições restantes
+- fila com prioridade: chat interativo passa na frente de tarefas em lote
+  (map-reduce) e da geração de e-mail
+- retries com backoff exponencial e jitter; um 429 pausa o modelo inteiro até o
+  retry-after, em vez de cada chamada insistir por conta própria
+
+Os cabeçalhos chegam pelo hook de resposta do httpx (observe_response). O SDK
+openai só é importado quando há um erro para classificar (startup mais rápido).
+"""
+import itertools
+import os
+import random
+import re
+import threading
+import time
+
+PRIORITIES = {'interativa': 0, 'normal': 1, 'baixa': 2}
+DEFAULT_PRIORITY = 'interativa'
+
+UPSTREAM_SCHEDULER_ENABLED = os.getenv('UPSTREAM_SCHEDULER', '1') not in ('0', 'false')
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv('UPSTREAM_MAX_CONCURRENCY', 32))  # Por modelo e por worker
+UPSTREAM_MIN_CONCURRENCY = 1
+UPSTREAM_RPM = int(os.getenv('UPSTREAM_RPM', 0))  # 0 = até aprender pelos cabeçalhos
+UPSTREAM_TPM = int(os.getenv('UPSTREAM_TPM', 0))
+UPSTREAM_MAX_RETRIES = int(os.getenv('UPSTREAM_MAX_RETRIES', 4))
+UPSTREAM_QUEUE_TIMEOUT = float(os.getenv('UPSTREAM_QUEUE_TIMEOUT', 120))
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 30.0
+
+DURATION_RE = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+class UpstreamBusyError(Exception):
+    """Chamada esperou na fila mais que UPSTREAM_QUEUE_TIMEOUT"""
+
+
+def parse_priority(value, default=DEFAULT_PRIORITY):
+    """'interativa' | 'normal' | 'baixa' (ou o número) -> nível da fila (menor passa antes)"""
+    if isinstance(value, int) and value in PRIORITIES.values():
+        return value
+    return PRIORITIES.get(str(value or default).lower(), PRIORITIES[default])
+
+
+def parse_duration(value):
+    """'6m0s', '1.5s', '20ms' (formato dos cabeçalhos da OpenAI) -> segundos"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = DURATION_RE.findall(value)
+    return sum(float(number) * DURATION_UNITS[unit] for number, unit in parts) if parts else None
+
+
+def _int_header(headers, name):
+    try:
+        return int(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after_seconds(headers):
+    if headers is None:
+        return None
+    retry_ms = headers.get('retry-after-ms')
+    if retry_ms:
+        try:
+            return float(retry_ms) / 1000
+        except ValueError:
+            pass
+    return parse_duration(headers.get('retry-after'))
+
+
+class TokenBucket:
+    """Balde por minuto; capacidade 0 = sem limite"""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        if self.capacity:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        if not self.capacity:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)  # Pedido maior que o balde: espera encher
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount, now):
+        if self.capacity:
+            self._refill(now)
+            self.level -= min(amount, self.capacity)
+
+    def sync(self, limit, remaining, reset_seconds, now):
+        """Ajusta ao estado informado pela OpenAI (vale para a organização toda)"""
+        if not limit:
+            return
+        self._refill(now)
+        learned = not self.capacity  # Primeiro cabeçalho: até aqui não havia limite
+        self.capacity = limit
+        if reset_seconds and remaining is not None and remaining < limit:
+            self.rate = (limit - remaining) / reset_seconds  # Reposição contínua até encher
+        elif not self.rate:
+            self.rate = limit / 60
+        if remaining is None:
+            remaining = limit
+        self.level = remaining if learned else min(self.level, remaining)
+
+
+class _ModelState:
+    def __init__(self, max_concurrency, rpm, tpm):
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.blocked_until = 0.0
+        self.stats = {'calls': 0, 'rate_limited': 0, 'retries': 0, 'errors': 0, 'queue_timeouts': 0}
+
+
+class _Ticket:
+    __slots__ = ('model', 'tokens', 'priority', 'seq', 'queued_seconds')
+
+    def __init__(self, model, tokens, priority, seq):
+        self.model = model
+        self.tokens = tokens
+        self.priority = priority
+        self.seq = seq
+        self.queued_seconds = 0.0
+
+
+class UpstreamScheduler:
+    def __init__(self, max_concurrency=UPSTREAM_MAX_CONCURRENCY, rpm=UPSTREAM_RPM, tpm=UPSTREAM_TPM,
+                 max_retries=UPSTREAM_MAX_RETRIES, queue_timeout=UPSTREAM_QUEUE_TIMEOUT,
+                 enabled=UPSTREAM_SCHEDULER_ENABLED, metrics=None):
+        self.max_concurrency = max_concurrency
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_retries = max_retries
+        self.queue_timeout = queue_timeout
+        self.enabled = enabled
+        self.metrics = metrics
+        self._cond = threading.Condition()
+        self._models = {}
+        self._queue = []  # Tickets esperando vaga (ordem: prioridade, seq)
+        self._seq = itertools.count()
+        self._local = threading.local()  # Modelo da chamada em andamento (para o hook do httpx)
+
+    def _state(self, model):
+        state = self._models.get(model)
+        if state is None:
+            state = self._models[model] = _ModelState(self.max_concurrency, self.rpm, self.tpm)
+        return state
+
+    def _wait_time(self, ticket, state, now):
+        """0 se o ticket pode sair da fila agora; senão quanto esperar (None = até ser avisado)"""
+        for other in self._queue:
+            # O primeiro do mesmo modelo na ordem da fila (outros modelos não bloqueiam)
+            if other.model == ticket.model and (other.priority, other.seq) < (ticket.priority, ticket.seq):
+                return None
+        if state.in_flight >= max(UPSTREAM_MIN_CONCURRENCY, int(state.limit)):
+            return None
+        return max(state.blocked_until - now,
+                   state.requests.wait_time(1, now),
+                   state.tokens.wait_time(ticket.tokens, now), 0.0)
+
+    def acquire(self, model, tokens, priority=PRIORITIES[DEFAULT_PRIORITY], seq=None):
+        ticket = _Ticket(model, tokens, priority, next(self._seq) if seq is None else seq)
+        started = time.monotonic()
+        deadline = started + self.queue_timeout
+        with self._cond:
+            state = self._state(model)
+            self._queue.append(ticket)
+            while True:
+                now = time.monotonic()
+                wait = self._wait_time(ticket, state, now)
+                if wait == 0.0:
+                    break
+                if now >= deadline:
+                    self._queue.remove(ticket)
+                    state.stats['queue_timeouts'] += 1
+                    self._cond.notify_all()
+                    raise UpstreamBusyError(f'OpenAI sobrecarregada: {model} sem vaga após {self.queue_timeout:.0f}s na fila')
+                self._cond.wait(min(wait if wait is not None else deadline - now, deadline - now))
+            self._queue.remove(ticket)
+            state.requests.take(1, now)
+            state.tokens.take(tokens, now)
+            state.in_flight += 1
+            state.stats['calls'] += 1
+            self._cond.notify_all()
+        ticket.queued_seconds = time.monotonic() - started
+        if self.metrics:
+            self.metrics.observe('upstream_queue_seconds', ticket.queued_seconds, model=model,
+                                 priority=_priority_name(priority))
+        return ticket
+
+    def release(self, ticket, error=None):
+        import openai  # Já carregado pelo cliente que fez a chamada
+
+        with self._cond:
+            state = self._state(ticket.model)
+            state.in_flight -= 1
+            if isinstance(error, openai.RateLimitError):
+                state.limit = max(UPSTREAM_MIN_CONCURRENCY, state.limit / 2)
+            elif error is None:
+                state.limit = min(self.max_concurrency, state.limit + 1)
+            else:
+                state.stats['errors'] += 1
+            self._cond.notify_all()
+
+    def retry_delay(self, error, attempt, model=None):
+        """Segundos até tentar de novo ou None se o erro não vale retry"""
+        import openai
+
+        if isinstance(error, openai.RateLimitError):
+            if getattr(error, 'code', None) == 'insufficient_quota':
+                return None  # Sem crédito: tentar de novo não resolve
+            retry_after = retry_after_seconds(getattr(error.response, 'headers', None))
+        elif isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)):
+            retry_after = None
+        else:
+            return None
+        # Full jitter: espalha as novas tentativas em vez de todas ao mesmo tempo
+        delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+        if retry_after is not None:
+            delay += retry_after
+        if model and isinstance(error, openai.RateLimitError):
+            with self._cond:
+                state = self._state(model)
+                state.stats['rate_limited'] += 1
+                # Pausa o modelo inteiro: as chamadas na fila esperam junto
+                state.blocked_until = max(state.blocked_until, time.monotonic() + (retry_after or delay))
+        return delay
+
+    def call(self, model, tokens, priority, func, hold=False):
+        """Executa func() com vaga, orçamento e retries.
+
+        hold=True (streaming) retorna (resultado, ticket) com a vaga ainda ocupada:
+        quem chamou libera com release(ticket, erro) ao terminar de ler o stream.
+        """
+        if not self.enabled:
+            return (func(), None) if hold else func()
+        seq = next(self._seq)  # Retries mantêm o lugar na fila
+        attempt = 0
+        while True:
+            ticket = self.acquire(model, tokens, priority, seq)
+            self._local.model = model
+            try:
+                result = func()
+            except Exception as e:
+                self.release(ticket, e)
+                delay = self.retry_delay(e, attempt, model) if attempt < self.max_retries else None
+                if delay is None:
+                    raise
+                attempt += 1
+                with self._cond:
+                    self._state(model).stats['retries'] += 1
+                if self.metrics:
+                    self.metrics.inc('upstream_retries_total', model=model, type=type(e).__name__)
+                print(f"🔁 {model}: {type(e).__name__}, nova tentativa {attempt}/{self.max_retries} em {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            finally:
+                self._local.model = None
+            if not hold:
+                self.release(ticket)
+                return result
+            return result, ticket
+
+    def observe_response(self, response):
+        """Hook do httpx: lê os cabeçalhos x-ratelimit-* da resposta da OpenAI"""
+        model = getattr(self._local, 'model', None)
+        if model is None or not self.enabled:
+            return
+        headers = response.headers
+        now = time.monotonic()
+        with self._cond:
+            state = self._state(model)
+            remaining_requests = _int_header(headers, 'x-ratelimit-remaining-requests')
+            state.requests.sync(_int_header(headers, 'x-ratelimit-limit-requests'), remaining_requests,
+                                parse_duration(headers.get('x-ratelimit-reset-requests')), now)
+            state.tokens.sync(_int_header(headers, 'x-ratelimit-limit-tokens'),
+                              _int_header(headers, 'x-ratelimit-remaining-tokens'),
+                              parse_duration(headers.get('x-ratelimit-reset-tokens')), now)
+            if remaining_requests is not None:
+                # Não adianta ter mais chamadas simultâneas que requisições restantes
+                state.limit = max(UPSTREAM_MIN_CONCURRENCY, min(state.limit, remaining_requests))
+            if response.status_code == 429:
+                retry_after = retry_after_seconds(headers)
+                if retry_after:
+                    state.blocked_until = max(state.blocked_until, now + retry_after)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            queued = {}
+            for ticket in self._queue:
+                queued[ticket.model] = queued.get(ticket.model, 0) + 1
+            return {
+                'enabled': self.enabled,
+                'models': {
+                    model: {
+                        'concurrency_limit': round(state.limit, 2),
+                        'in_flight': state.in_flight,
+                        'queued': queued.get(model, 0),
+                        'requests_available': round(state.requests.level, 1) if state.requests.capacity else None,
+                        'tokens_available': round(state.tokens.level) if state.tokens.capacity else None,
+                        'paused_seconds': round(max(0.0, state.blocked_until - time.monotonic()), 2),
+                        **state.stats,
+                    }
+                    for model, state in self._models.items()
+                },
+            }
+
+
+def _priority_name(priority):
+    for name, value in PRIORITIES.items():
+        if value == priority:
+            return name
+    return str(priority)
@@ -0,0 +1,124 @@
+"""Benchmark: perguntas de acompanhamento com e sem conversa no servidor
+
+Simula uma sessão típica: análise de documentos (prompt grande + propostas),
+e-mail para a construtora e algumas perguntas sobre a análise. Mede, por
+pergunta de acompanhamento, o tamanho do payload enviado ao /api/chat e os
+tokens de entrada cobrados pela OpenAI (falsa, ~4 caracteres por token):
+- antigo: o navegador manda o histórico inteiro (o e-mail colava a análise)
+- resumo: conversation_id, servidor remonta um histórico compacto
+- completo: conversation_id + previous_response_id (GPT-5)
+
+Uso:
+    python benchmarks/conversation_followup.py --doc-kb 60 --analysis-kb 12
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_openai import start_fake_openai  # noqa: E402
+
+FOLLOW_UPS = [
+    "Gere um e-mail para a construtora com a recomendação principal e os próximos passos.",
+    "Qual fornecedor tem o menor prazo de entrega?",
+    "Quais itens ficaram sem cotação?",
+    "Resuma a economia estimada em uma frase.",
+]
+
+
+def build_session(doc_kb, analysis_kb):
+    system = "Você é analista de propostas da Tools Engenharia. Compare itens, preços e prazos. " * 40
+    documents = "ARQUIVO: proposta.pdf\n" + "Item 01 | Cimento CP-II 50kg | 120 sc | R$ 34,90 | 5 dias\n" * (doc_kb * 18)
+    analysis = "<table><tr><th>Item</th><th>Fornecedor</th><th>Preço</th></tr>" + (
+        "<tr><td>Cimento CP-II 50kg</td><td>Fornecedor A</td><td>R$ 34,90</td></tr>" * (analysis_kb * 14)
+    ) + "</table><p>SEÇÃO 6 - RECOMENDAÇÃO: Fornecedor A.</p>"
+    return system, documents, analysis
+
+
+def post(client, body):
+    payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+    response = client.post('/api/chat', data=payload, content_type='application/json')
+    data = response.get_json()
+    if response.status_code != 200:
+        raise RuntimeError(f"/api/chat {response.status_code}: {data}")
+    return len(payload), data['usage']['input_tokens'], data
+
+
+def run_old(client, model, system, documents):
+    history = [{'role': 'system', 'content': system}, {'role': 'user', 'content': documents}]
+    _, _, data = post(client, {'model': model, 'messages': history, 'cache': False})
+    history.append({'role': 'assistant', 'content': data['choices'][0]['message']['content']})
+    results = []
+    for question in FOLLOW_UPS:
+        history.append({'role': 'user', 'content': question})
+        size, tokens, data = post(client, {'model': model, 'messages': history, 'cache': False})
+        history.append({'role': 'assistant', 'content': data['choices'][0]['message']['content']})
+        results.append((size, tokens))
+    return results
+
+
+def run_conversation(client, model, system, documents, mode):
+    conversation_id = client.post('/api/conversations', json={}).get_json()['conversation_id']
+    post(client, {'model': model, 'conversation_id': conversation_id, 'cache': False,
+                  'messages': [{'role': 'system', 'content': system}, {'role': 'user', 'content': documents}]})
+    return [
+        post(client, {'model': model, 'conversation_id': conversation_id, 'contexto': mode, 'cache': False,
+                      'messages': [{'role': 'user', 'content': question}]})[:2]
+        for question in FOLLOW_UPS
+    ]
+
+
+def report(label, results, baseline=None):
+    payload = sum(size for size, _ in results) / len(results)
+    tokens = sum(tokens for _, tokens in results) / len(results)
+    ratio = f" | {baseline[0] / payload:.0f}x menor payload, {baseline[1] / tokens:.1f}x menos tokens" if baseline else ""
+    print(f"📊 {label:<28}: payload médio {payload / 1024:7.1f}KB | tokens de entrada {tokens:8.0f}{ratio}")
+    return payload, tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--doc-kb", type=int, default=60, help="Tamanho dos documentos colados na análise (KB)")
+    parser.add_argument("--analysis-kb", type=int, default=12, help="Tamanho da análise devolvida (KB)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_conversation_")
+    server = None
+    try:
+        db_path = os.path.join(workdir, "historico.db")
+        shutil.copy(os.path.join(ROOT, "api", "historico_base.db"), db_path)
+        os.environ.update(
+            HISTORICO_DB_PATH=db_path,
+            RESPONSE_CACHE_DB_PATH=os.path.join(workdir, "cache.db"),
+            METRICS_DIR=os.path.join(workdir, "metrics"),
+            SINGLE_FLIGHT_DIR=os.path.join(workdir, "singleflight"),
+            OPENAI_API_KEY="sk-fake",
+        )
+        system, documents, analysis = build_session(args.doc_kb, args.analysis_kb)
+
+        from api import index  # noqa: E402
+        server, openai_url = start_fake_openai()
+        server.RequestHandlerClass.text = analysis  # Toda resposta é a análise: pior caso para o histórico
+        index.client = index.client.with_options(base_url=openai_url)
+        client = index.app.test_client()
+
+        baseline = report("antigo (histórico completo)", run_old(client, 'gpt-5', system, documents))
+        report("conversation_id + resumo", run_conversation(client, 'gpt-5', system, documents, 'resumo'), baseline)
+        report("conversation_id + completo", run_conversation(client, 'gpt-5', system, documents, 'completo'), baseline)
+        print("   (completo usa previous_response_id: payload pequeno, mas a OpenAI cobra o contexto anterior)")
+        index.history_writer.flush()
+        index.metrics.flush()  # Antes de apagar o diretório temporário
+    finally:
+        if server:
+            server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""Servidor local que imita a API da OpenAI para benchmarks (sem custo, sem rede)
+
+Com --rpm/--tpm simula os limites de taxa da organização: token buckets com
+reposição contínua, cabeçalhos x-ratelimit-* em todas as respostas e 429 com
+retry-after-ms quando o limite estoura (como a OpenAI).
+
+Tokens no usage: ~4 caracteres por token do que foi enviado. Com
+previous_response_id, o contexto guardado da resposta anterior também conta
+como entrada (como a OpenAI cobra). Cache de prompt simulado: a partir da
+segunda chamada com as mesmas instructions (ou o mesmo primeiro system no Chat
+Completions), esses tokens aparecem como cached_tokens.
+
+Serve /v1/responses e /v1/chat/completions, com e sem "stream": true (SSE no
+formato de cada API). --error-rate e --rate-limit-rate sorteiam respostas 500 e
+429 para testar retries; --jitter varia a latência.
+
+Modelos menores e menos raciocínio respondem antes (--latency vezes
+MODEL_SPEED e EFFORT_SPEED), e o esforço de raciocínio soma reasoning_tokens
+à saída, como no GPT-5.
+
+Uso:
+    python benchmarks/fake_openai.py --port 18080 --latency 5
+    python benchmarks/fake_openai.py --port 18080 --latency 1 --rpm 60 --tpm 100000
+    python benchmarks/fake_openai.py --port 18080 --latency 2 --error-rate 0.02 --rate-limit-rate 0.05
+
+Depois aponte o backend para ele:
+    OPENAI_BASE_URL=http://127.0.0.1:18080/v1 OPENAI_API_KEY=sk-fake ...
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RESPOSTA_PADRAO = (
+    "| Fornecedor | Item | Preço Unitário | Total |\n"
+    "|---|---|---|---|\n"
+    "| ACME Ltda | Cimento CP-II | R$ 32,50 | R$ 3.250,00 |\n"
+    "| Beta Materiais | Cimento CP-II | R$ 30,90 | R$ 3.090,00 |\n"
+)
+
+
+class RateLimiter:
+    """Limites por minuto de requisições e tokens (0 = sem limite)"""
+
+    def __init__(self, rpm=0, tpm=0):
+        self.limits = {"requests": rpm, "tokens": tpm}
+        self.levels = {"requests": float(rpm), "tokens": float(tpm)}
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.rejected = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        for kind, limit in self.limits.items():
+            if limit:
+                self.levels[kind] = min(limit, self.levels[kind] + (now - self.updated) * limit / 60)
+        self.updated = now
+
+    def consume(self, tokens):
+        """Retorna (aceita, cabeçalhos x-ratelimit-*)"""
+        cost = {"requests": 1, "tokens": tokens}
+        with self.lock:
+            self._refill()
+            missing = max(
+                ((cost[kind] - self.levels[kind]) * 60 / limit for kind, limit in self.limits.items()
+                 if limit and self.levels[kind] < cost[kind]),
+                default=0.0
+            )
+            if not missing:
+                for kind, limit in self.limits.items():
+                    if limit:
+                        self.levels[kind] -= cost[kind]
+            else:
+                self.rejected += 1
+            headers = {}
+            for kind, limit in self.limits.items():
+                if limit:
+                    remaining = max(0, math.floor(self.levels[kind]))
+                    headers[f"x-ratelimit-limit-{kind}"] = str(limit)
+                    headers[f"x-ratelimit-remaining-{kind}"] = str(remaining)
+                    headers[f"x-ratelimit-reset-{kind}"] = f"{(limit - self.levels[kind]) * 60 / limit:.3f}s"
+            if missing:
+                headers["retry-after-ms"] = str(math.ceil(missing * 1000))
+            return not missing, headers
+
+
+# Fração da latência por modelo (prefixo) e por esforço de raciocínio; o resto usa 1
+MODEL_SPEED = (('gpt-5-nano', 0.2), ('gpt-5-mini', 0.4), ('gpt-4o-mini', 0.3))
+EFFORT_SPEED = {'minimal': 0.5, 'low': 1.0, 'medium': 2.0, 'high': 4.0}
+REASONING_TOKENS = {'minimal': 0, 'low': 400, 'medium': 1500, 'high': 4000}
+
+STREAM_CHUNK_CHARS = 24  # Texto por evento de delta
+STREAM_TTFT_FRACTION = 0.2  # Parte da latência antes do primeiro byte no streaming
+
+
+def simulated_latency(latency, model, effort=None):
+    speed = next((factor for prefix, factor in MODEL_SPEED if model.startswith(prefix)), 1.0)
+    return latency * speed * EFFORT_SPEED.get(effort, 1.0)
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.0  # Segundos antes de responder
+    text = RESPOSTA_PADRAO
+    limiter = None  # RateLimiter quando --rpm/--tpm
+    error_rate = 0.0  # Fração de chamadas que respondem 500
+    rate_limit_rate = 0.0  # Fração de chamadas que respondem 429 (além do --rpm/--tpm)
+    jitter = 0.0  # Variação da latência (0.2 = ±20%)
+    rng = random.Random()
+    counters = {}
+    seen_prefixes = set()
+    seen_lock = threading.Lock()
+    contexts = {}  # response_id -> tokens de contexto (entrada + saída) para previous_response_id
+
+    def log_message(self, format, *args):
+        pass  # Silencioso: o benchmark mede, não loga
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _cached_tokens(self, prefix):
+        """Tokens do prefixo (~4 caracteres/token) se ele já foi visto; como a OpenAI, só acima de 1024"""
+        tokens = len(prefix or "") // 4
+        with self.seen_lock:
+            seen = prefix in self.seen_prefixes
+            self.seen_prefixes.add(prefix)
+        return tokens if seen and tokens >= 1024 else 0
+
+    def _check_faults(self, payload):
+        """429/500 antes de processar: limite de taxa (--rpm/--tpm) ou falha sorteada. Retorna True se respondeu."""
+        headers = {}
+        if self.limiter:
+            # Como a OpenAI: conta a entrada estimada (~4 caracteres/token) + a saída máxima pedida
+            tokens = len(json.dumps(payload.get("input") or payload.get("messages") or "")) // 4
+            tokens += payload.get("max_output_tokens") or payload.get("max_completion_tokens") or 0
+            accepted, headers = self.limiter.consume(tokens)
+            if not accepted:
+                self._send_json(429, {"error": {
+                    "message": "Rate limit reached (simulado)", "type": "requests", "code": "rate_limit_exceeded"
+                }}, headers)
+                return True, headers
+        draw = self.rng.random()
+        if draw < self.rate_limit_rate:
+            self._count("rate_limited")
+            self._send_json(429, {"error": {
+                "message": "Rate limit reached (sorteado)", "type": "requests", "code": "rate_limit_exceeded"
+            }}, dict(headers, **{"retry-after-ms": "200"}))
+            return True, headers
+        if draw < self.rate_limit_rate + self.error_rate:
+            self._count("errors")
+            time.sleep(self._latency(payload) * self.rng.random())  # Falha no meio do caminho
+            self._send_json(500, {"error": {
+                "message": "The server had an error while processing your request (simulado)",
+                "type": "server_error", "code": None
+            }}, headers)
+            return True, headers
+        return False, headers
+
+    def _count(self, name):
+        with self.seen_lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def _latency(self, payload):
+        latency = simulated_latency(self.latency, payload.get("model", "gpt-5"),
+                                    (payload.get("reasoning") or {}).get("effort"))
+        if self.jitter:
+            latency *= 1 + self.jitter * (2 * self.rng.random() - 1)
+        return max(0.0, latency)
+
+    def _responses_body(self, payload):
+        model = payload.get("model", "gpt-5")
+        effort = (payload.get("reasoning") or {}).get("effort")
+        response_id = f"resp_{uuid.uuid4().hex}"
+        instructions = payload.get("instructions") or ""
+        input_tokens = (len(instructions) + len(json.dumps(payload.get("input") or "", ensure_ascii=False))) // 4
+        reasoning_tokens = REASONING_TOKENS.get(effort, 0)
+        output_tokens = len(self.text) // 4 + reasoning_tokens
+        with self.seen_lock:
+            input_tokens += self.contexts.get(payload.get("previous_response_id"), 0)
+            self.contexts[response_id] = input_tokens + len(self.text) // 4
+        return {
+            "id": response_id,
+            "object": "response",
+            "created_at": int(time.time()),
+            "model": model,
+            "status": "completed",
+            "output": [{
+                "type": "message",
+                "id": "msg_fake",
+                "status": "completed",
+                "role": "assistant",
+                "content": [{"type": "output_text", "text": self.text, "annotations": []}]
+            }],
+            "parallel_tool_calls": True,
+            "tool_choice": "auto",
+            "tools": [],
+            "usage": {
+                "input_tokens": input_tokens,
+                "input_tokens_details": {"cached_tokens": self._cached_tokens(instructions)},
+                "output_tokens": output_tokens,
+                "output_tokens_details": {"reasoning_tokens": reasoning_tokens},
+                "total_tokens": input_tokens + output_tokens
+            }
+        }
+
+    def _chat_body(self, payload):
+        system = next((m.get("content") for m in payload.get("messages", []) if m.get("role") == "system"), "")
+        prompt_tokens = len(json.dumps(payload.get("messages", []), ensure_ascii=False)) // 4
+        return {
+            "id": f"chatcmpl_{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "gpt-4o"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": self.text},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "prompt_tokens_details": {"cached_tokens": self._cached_tokens(system)},
+                "completion_tokens": len(self.text) // 4,
+                "total_tokens": prompt_tokens + len(self.text) // 4
+            }
+        }
+
+    def _stream_events(self, body):
+        """Eventos SSE no formato de cada API; o texto sai em pedaços de STREAM_CHUNK_CHARS"""
+        chunks = [self.text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(self.text), STREAM_CHUNK_CHARS)]
+        if body["object"] == "response":
+            yield "response.created", dict(body, status="in_progress", output=[], usage=None)
+            for chunk in chunks:
+                yield "response.output_text.delta", {
+                    "item_id": "msg_fake", "output_index": 0, "content_index": 0, "delta": chunk, "logprobs": []
+                }
+            yield "response.completed", {"response": body}
+        else:
+            base = {"id": body["id"], "object": "chat.completion.chunk", "created": body["created"],
+                    "model": body["model"]}
+            for chunk in chunks:
+                yield None, dict(base, choices=[{"index": 0, "delta": {"content": chunk}, "finish_reason": None}])
+            yield None, dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+
+    def _send_stream(self, body, latency, headers):
+        """Primeiro byte após STREAM_TTFT_FRACTION da latência; o resto dela se espalha entre os pedaços"""
+        self._count("streams")
+        time.sleep(latency * STREAM_TTFT_FRACTION)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")  # Sem Content-Length: o fim do corpo é o fim da conexão
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.close_connection = True
+        events = list(self._stream_events(body))
+        pause = latency * (1 - STREAM_TTFT_FRACTION) / max(1, len(events))
+        for sequence, (event_type, data) in enumerate(events):
+            if event_type:
+                data = dict(data, type=event_type, sequence_number=sequence)
+                self.wfile.write(f"event: {event_type}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+            else:
+                self.wfile.write(f"data: {json.dumps(data)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(pause)
+        if body["object"] != "response":
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+    def do_POST(self):
+        payload = self._read_json()
+        if self.path.endswith("/responses"):
+            build = self._responses_body
+        elif self.path.endswith("/chat/completions"):
+            build = self._chat_body
+        else:
+            self._send_json(404, {"error": {"message": f"Rota desconhecida: {self.path}"}})
+            return
+        self._count("requests")
+        answered, headers = self._check_faults(payload)
+        if answered:
+            return
+        latency = self._latency(payload)
+        if payload.get("stream"):
+            self._send_stream(build(payload), latency, headers)
+            return
+        time.sleep(latency)
+        self._send_json(200, build(payload), headers)
+
+
+def start_fake_openai(port=0, latency=0.0, rpm=0, tpm=0, error_rate=0.0, rate_limit_rate=0.0, jitter=0.0, seed=None):
+    """Inicia o servidor em uma thread daemon e retorna (server, base_url).
+
+    Contadores (requests, streams, errors, rate_limited) em server.RequestHandlerClass.counters.
+    """
+    limiter = RateLimiter(rpm, tpm) if rpm or tpm else None
+    handler = type("Handler", (FakeOpenAIHandler,), {
+        "latency": latency, "limiter": limiter, "error_rate": error_rate, "rate_limit_rate": rate_limit_rate,
+        "jitter": jitter, "rng": random.Random(seed), "counters": {},
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI falsa para benchmarks")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--latency", type=float, default=5.0, help="Latência simulada (s)")
+    parser.add_argument("--rpm", type=int, default=0, help="Limite de requisições por minuto (0 = sem limite)")
+    parser.add_argument("--tpm", type=int, default=0, help="Limite de tokens por minuto (0 = sem limite)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fração de respostas 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fração de respostas 429 sorteadas")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Variação da latência (0.2 = ±20%%)")
+    args = parser.parse_args()
+
+    server, base_url = start_fake_openai(args.port, args.latency, args.rpm, args.tpm,
+                                         args.error_rate, args.rate_limit_rate, args.jitter)
+    print(f"🤖 OpenAI falsa em {base_url} (latência {args.latency}s, RPM {args.rpm or '∞'}, TPM {args.tpm or '∞'}, "
+          f"erros {args.error_rate:.0%}, 429 {args.rate_limit_rate:.0%})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
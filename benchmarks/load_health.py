@@ -0,0 +1,136 @@
+"""Teste de carga: /api/health deve continuar rápido com 50 /api/chat pendentes
+
+Sobe a OpenAI falsa (latência alta), inicia o backend no gunicorn com o
+gunicorn.conf.py real, dispara N chamadas /api/chat simultâneas e mede a
+latência de /api/health enquanto elas estão pendentes.
+
+Uso:
+    python benchmarks/load_health.py --pending 50 --latency 10
+    GUNICORN_WORKER_CLASS=sync python benchmarks/load_health.py   # comparação
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_openai import start_fake_openai  # noqa: E402
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def wait_until_ready(base_url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"{base_url}/api/health", timeout=2)
+            return
+        except Exception:
+            time.sleep(0.2)
+    raise RuntimeError("Backend não respondeu a tempo")
+
+
+def post_chat(base_url, results):
+    body = json.dumps({
+        "model": "gpt-5",
+        "messages": [{"role": "user", "content": "Compare as propostas"}]
+    }).encode("utf-8")
+    req = urllib.request.Request(
+        f"{base_url}/api/chat", data=body, headers={"Content-Type": "application/json"}
+    )
+    start = time.perf_counter()
+    try:
+        urllib.request.urlopen(req, timeout=300).read()
+        results.append(time.perf_counter() - start)
+    except Exception as e:
+        results.append(None)
+        print(f"❌ /api/chat falhou: {e}")
+
+
+def measure_health(base_url, samples):
+    latencies = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        urllib.request.urlopen(f"{base_url}/api/health", timeout=60).read()
+        latencies.append((time.perf_counter() - start) * 1000)
+        time.sleep(0.02)
+    return latencies
+
+
+def summarize(label, latencies):
+    print(f"   {label}: p50={percentile(latencies, 50):.1f}ms "
+          f"p99={percentile(latencies, 99):.1f}ms max={max(latencies):.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pending", type=int, default=50, help="Chamadas /api/chat simultâneas")
+    parser.add_argument("--latency", type=float, default=10.0, help="Latência da OpenAI falsa (s)")
+    parser.add_argument("--samples", type=int, default=100, help="Amostras de /api/health")
+    parser.add_argument("--port", type=int, default=18000)
+    args = parser.parse_args()
+
+    fake_server, openai_url = start_fake_openai(latency=args.latency)
+    workdir = tempfile.mkdtemp(prefix="bench_bid_")
+    env = dict(
+        os.environ,
+        OPENAI_BASE_URL=openai_url,
+        OPENAI_API_KEY="sk-fake",
+        HISTORICO_DB_PATH=os.path.join(workdir, "historico.db"),
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+         "-b", f"127.0.0.1:{args.port}", "api.index:app"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_until_ready(base_url)
+        print(f"🔬 Worker: {env.get('GUNICORN_WORKER_CLASS', 'gthread')} | "
+              f"{args.pending} /api/chat pendentes | latência upstream {args.latency}s")
+
+        baseline = measure_health(base_url, args.samples)
+
+        chat_results = []
+        chat_threads = [
+            threading.Thread(target=post_chat, args=(base_url, chat_results), daemon=True)
+            for _ in range(args.pending)
+        ]
+        for thread in chat_threads:
+            thread.start()
+        time.sleep(0.5)  # Garantir que as chamadas já estão pendentes no upstream
+        under_load = measure_health(base_url, args.samples)
+
+        for thread in chat_threads:
+            thread.join()
+
+        print("📊 /api/health")
+        summarize("ocioso      ", baseline)
+        summarize(f"{args.pending} pendentes".ljust(12), under_load)
+        ok = [r for r in chat_results if r is not None]
+        if ok:
+            print(f"📊 /api/chat: {len(ok)}/{len(chat_results)} ok | "
+                  f"p50={percentile(ok, 50):.2f}s max={max(ok):.2f}s")
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+        fake_server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,465 @@
+"""Suíte de carga: backend no gunicorn (gunicorn.conf.py real) contra a OpenAI falsa
+
+Sobe a OpenAI falsa (latência, jitter, streaming, 500 e 429 configuráveis),
+inicia api/index.py no gunicorn com o gunicorn.conf.py do deploy em um banco
+temporário (cópia do historico_base.db) e roda cenários de carga em laço
+fechado (cada cliente manda a próxima requisição quando a anterior termina):
+- chat: POST /api/chat (--stream-ratio das chamadas com streaming SSE)
+- historico: GET /api/historico
+- settings: GET /api/settings com X-API-Key (--settings-write-ratio de POSTs)
+- misto: os três ao mesmo tempo (metade dos clientes no chat)
+
+Para cada cenário: vazão, latência p50/p95/p99 por endpoint, RSS máximo de
+cada worker e disputa pelo SQLite (espera por conexão do pool, tempo com a
+conexão e erros "database is locked", lidos do /api/metrics). O resultado vai
+para um JSON, e --compare mostra a diferença entre duas rodadas.
+
+Uso:
+    python benchmarks/load_suite.py --duration 20 --concurrency 32 --output antes.json
+    GUNICORN_WORKERS=4 python benchmarks/load_suite.py --scenarios chat,misto --output depois.json
+    python benchmarks/load_suite.py --compare antes.json depois.json
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from datetime import datetime, timezone
+
+import psutil
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_openai import start_fake_openai  # noqa: E402
+
+RESULT_VERSION = 1
+SCENARIOS = ('chat', 'historico', 'settings', 'misto')
+SYSTEM_PROMPT = "Você é analista de propostas da Tools Engenharia. Compare itens, preços e prazos. " * 40
+API_KEYS = [f"bench-{number}" for number in range(20)]
+METRIC_RE = re.compile(r'^analise_bid_(\w+?)(_bucket|_sum|_count)?(\{[^}]*\})?\s+(\S+)$')
+LE_RE = re.compile(r'le="([^"]+)"')
+SQLITE_METRICS = ('db_wait_seconds', 'db_hold_seconds')
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] if ordered else 0.0
+
+
+class Client:
+    """Conexão keep-alive de um cliente simulado.
+
+    Como navegadores e o urllib3: se uma conexão reaproveitada foi fechada pelo
+    servidor (keep-alive expirado, worker reciclado), repete uma vez em uma
+    conexão nova; falha em conexão nova conta como erro.
+    """
+
+    def __init__(self, port):
+        self.port = port
+        self.conn = None
+
+    def request(self, method, path, body=None, headers=None, stream=False):
+        """Retorna (status, segundos até o primeiro byte do corpo)"""
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        headers = dict(headers or {}, **({"Content-Type": "application/json"} if data else {}))
+        reused = self.conn is not None
+        try:
+            return self._send(method, path, data, headers, stream)
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            if not reused:
+                raise
+            return self._send(method, path, data, headers, stream)
+
+    def _send(self, method, path, data, headers, stream):
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=300)
+        started = time.perf_counter()
+        try:
+            self.conn.request(method, path, body=data, headers=headers)
+            response = self.conn.getresponse()
+            first_byte = None
+            if stream:
+                response.readline()
+                first_byte = time.perf_counter() - started
+            response.read()
+            if response.will_close:
+                self.close()
+            return response.status, first_byte
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def chat_request(client, rng, counter, stream_ratio):
+    number = next(counter)
+    stream = rng.random() < stream_ratio
+    body = {
+        "model": "gpt-5",
+        "max_tokens": 2000,
+        "cache": False,  # Cada chamada vai à OpenAI falsa (sem cache nem single-flight)
+        "stream": stream,
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": f"Compare as propostas dos fornecedores (pedido {number})"},
+        ],
+    }
+    return ("chat_stream" if stream else "chat"), client.request("POST", "/api/chat", body, stream=stream)
+
+
+def historico_request(client, rng, counter, stream_ratio):
+    return "historico", client.request("GET", f"/api/historico?limit={rng.choice((20, 50, 100))}")
+
+
+def settings_request(client, rng, counter, stream_ratio, write_ratio=0.05):
+    api_key = rng.choice(API_KEYS)
+    if rng.random() < write_ratio:
+        body = {"api_key": api_key, "modelo": "gpt-5", "max_tokens": rng.choice((4000, 8000)), "chunk_size": 8000}
+        return "settings_post", client.request("POST", "/api/settings", body)
+    return "settings", client.request("GET", "/api/settings", headers={"X-API-Key": api_key})
+
+
+def run_load(port, plan, duration, stream_ratio, settings_write_ratio):
+    """plan: [(função, clientes)]. Retorna {endpoint: [(status, segundos, primeiro_byte)]}"""
+    results = {}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    counter = iter(range(10 ** 9))
+
+    def worker(request_func, seed):
+        client = Client(port)
+        rng = random.Random(seed)
+        local = []
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                if request_func is settings_request:
+                    label, (status, first_byte) = request_func(client, rng, counter, stream_ratio,
+                                                               settings_write_ratio)
+                else:
+                    label, (status, first_byte) = request_func(client, rng, counter, stream_ratio)
+            except Exception as e:
+                label, status, first_byte = request_func.__name__.replace('_request', ''), type(e).__name__, None
+            local.append((label, status, time.perf_counter() - started, first_byte))
+        client.close()
+        with lock:
+            for label, status, seconds, first_byte in local:
+                results.setdefault(label, []).append((status, seconds, first_byte))
+
+    threads = [
+        threading.Thread(target=worker, args=(request_func, f"{request_func.__name__}-{number}"), daemon=True)
+        for request_func, clients in plan for number in range(clients)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def summarize_endpoint(samples, duration):
+    ok = [seconds for status, seconds, _ in samples if status in (200, 201, 304)]
+    statuses = {}
+    for status, _, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    summary = {
+        "requisicoes": len(samples),
+        "erros": len(samples) - len(ok),
+        "status": statuses,
+        "vazao_rps": round(len(ok) / duration, 2),
+        "p50_ms": round(percentile(ok, 50) * 1000, 1),
+        "p95_ms": round(percentile(ok, 95) * 1000, 1),
+        "p99_ms": round(percentile(ok, 99) * 1000, 1),
+        "max_ms": round(max(ok, default=0) * 1000, 1),
+    }
+    first_bytes = [first_byte for status, _, first_byte in samples if status == 200 and first_byte is not None]
+    if first_bytes:
+        summary["primeiro_byte_p50_ms"] = round(percentile(first_bytes, 50) * 1000, 1)
+        summary["primeiro_byte_p99_ms"] = round(percentile(first_bytes, 99) * 1000, 1)
+    return summary
+
+
+class RssSampler:
+    """RSS máximo de cada worker do gunicorn (filhos do master) durante o cenário"""
+
+    def __init__(self, master_pid, interval=0.5):
+        self.master = psutil.Process(master_pid)
+        self.interval = interval
+        self.peaks = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.sample()
+            self._stop.wait(self.interval)
+
+    def sample(self):
+        for process in [self.master] + self.master.children():
+            try:
+                rss = process.memory_info().rss / (1024 * 1024)
+            except psutil.Error:
+                continue  # Worker reciclado entre a listagem e a leitura
+            label = "master" if process.pid == self.master.pid else str(process.pid)
+            self.peaks[label] = round(max(self.peaks.get(label, 0.0), rss), 1)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+def scrape_metrics(base_url):
+    """Histogramas e contadores do /api/metrics somados entre rótulos: {nome: {...}}"""
+    text = urllib.request.urlopen(f"{base_url}/api/metrics", timeout=30).read().decode("utf-8")
+    totals = {}
+    for line in text.splitlines():
+        match = METRIC_RE.match(line)
+        if not match:
+            continue
+        name, suffix, labels, value = match.groups()
+        entry = totals.setdefault(name, {"buckets": {}, "sum": 0.0, "count": 0.0, "value": 0.0})
+        if suffix == "_bucket":
+            limit = LE_RE.search(labels).group(1)
+            entry["buckets"][limit] = entry["buckets"].get(limit, 0.0) + float(value)
+        elif suffix == "_sum":
+            entry["sum"] += float(value)
+        elif suffix == "_count":
+            entry["count"] += float(value)
+        else:
+            entry["value"] += float(value)
+    return totals
+
+
+def histogram_delta(before, after, name):
+    """Contagem, média e p99 (limite do bucket) do histograma entre duas leituras"""
+    old = before.get(name, {"buckets": {}, "sum": 0.0, "count": 0.0})
+    new = after.get(name, {"buckets": {}, "sum": 0.0, "count": 0.0})
+    count = new["count"] - old["count"]
+    if count <= 0:
+        return {"contagem": 0}
+    limits = sorted((float(limit), new["buckets"][limit] - old["buckets"].get(limit, 0.0))
+                    for limit in new["buckets"])
+    p99 = next((limit for limit, cumulative in limits if cumulative >= 0.99 * count), float("inf"))
+    over_10ms = count - next((cumulative for limit, cumulative in limits if limit >= 0.01), count)
+    return {
+        "contagem": int(count),
+        "media_ms": round((new["sum"] - old["sum"]) / count * 1000, 3),
+        "p99_ate_ms": p99 * 1000 if p99 != float("inf") else None,
+        "acima_10ms": int(over_10ms),
+    }
+
+
+def sqlite_contention(before, after):
+    contention = {name: histogram_delta(before, after, name) for name in SQLITE_METRICS}
+    contention["db_busy_total"] = int(after.get("db_busy_total", {}).get("value", 0)
+                                      - before.get("db_busy_total", {}).get("value", 0))
+    return contention
+
+
+def scenario_plan(name, concurrency):
+    if name == "misto":
+        chat = max(1, concurrency // 2)
+        historico = max(1, (concurrency - chat) // 2)
+        return [(chat_request, chat), (historico_request, historico),
+                (settings_request, max(1, concurrency - chat - historico))]
+    return [({"chat": chat_request, "historico": historico_request, "settings": settings_request}[name], concurrency)]
+
+
+def wait_until_ready(base_url, server, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("gunicorn terminou antes de ficar pronto")
+        try:
+            urllib.request.urlopen(f"{base_url}/api/health", timeout=2)
+            return
+        except Exception:
+            time.sleep(0.2)
+    raise RuntimeError("Backend não respondeu a tempo")
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def print_scenario(name, result):
+    print(f"📊 {name} ({result['duracao_s']}s, {result['clientes']} clientes)")
+    for label, summary in result["endpoints"].items():
+        first_byte = (f" | 1º byte p50={summary['primeiro_byte_p50_ms']:.0f}ms"
+                      if "primeiro_byte_p50_ms" in summary else "")
+        print(f"   {label:<14} {summary['vazao_rps']:8.1f} req/s | p50={summary['p50_ms']:8.1f}ms "
+              f"p95={summary['p95_ms']:8.1f}ms p99={summary['p99_ms']:8.1f}ms | "
+              f"erros {summary['erros']}/{summary['requisicoes']}{first_byte}")
+    workers = {pid: rss for pid, rss in result["rss_mb"].items() if pid != "master"}
+    print(f"   RSS máximo: master {result['rss_mb'].get('master', 0):.0f}MB | workers "
+          f"{', '.join(f'{rss:.0f}MB' for rss in workers.values()) or '-'}")
+    sqlite = result["sqlite"]
+    wait, hold = sqlite["db_wait_seconds"], sqlite["db_hold_seconds"]
+    if wait.get("contagem"):
+        print(f"   SQLite: {wait['contagem']} conexões | espera média {wait['media_ms']:.3f}ms "
+              f"(p99 ≤ {wait['p99_ate_ms']}ms, {wait['acima_10ms']} acima de 10ms) | "
+              f"em uso média {hold['media_ms']:.2f}ms (p99 ≤ {hold['p99_ate_ms']}ms) | "
+              f"locked/busy {sqlite['db_busy_total']}")
+
+
+def compare(old_path, new_path):
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"📊 {old_path} ({old.get('git') or '?'}) -> {new_path} ({new.get('git') or '?'})")
+
+    def change(before, after):
+        return f"{(after - before) / before * 100:+.0f}%" if before else "  n/a"
+
+    for name, scenario in new["cenarios"].items():
+        previous = old["cenarios"].get(name)
+        if not previous:
+            continue
+        print(f"   {name}")
+        for label, summary in scenario["endpoints"].items():
+            before = previous["endpoints"].get(label)
+            if not before:
+                continue
+            print(f"     {label:<14} vazão {before['vazao_rps']:7.1f} -> {summary['vazao_rps']:7.1f} "
+                  f"({change(before['vazao_rps'], summary['vazao_rps'])}) | "
+                  + " ".join(f"{p} {before[p]:.0f}->{summary[p]:.0f}ms ({change(before[p], summary[p])})"
+                             for p in ("p50_ms", "p95_ms", "p99_ms")))
+        rss_before = max((rss for pid, rss in previous["rss_mb"].items() if pid != "master"), default=0)
+        rss_after = max((rss for pid, rss in scenario["rss_mb"].items() if pid != "master"), default=0)
+        print(f"     RSS máximo por worker {rss_before:.0f} -> {rss_after:.0f}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Lista entre {', '.join(SCENARIOS)}")
+    parser.add_argument("--duration", type=float, default=15.0, help="Segundos medidos por cenário")
+    parser.add_argument("--concurrency", type=int, default=32, help="Clientes simultâneos por cenário")
+    parser.add_argument("--latency", type=float, default=1.0, help="Latência da OpenAI falsa (s)")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Variação da latência (0.2 = ±20%%)")
+    parser.add_argument("--stream-ratio", type=float, default=0.2, help="Fração das chamadas ao chat com streaming")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fração de respostas 500 da OpenAI falsa")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fração de 429 sorteados")
+    parser.add_argument("--rpm", type=int, default=0, help="Limite de requisições por minuto da OpenAI falsa")
+    parser.add_argument("--settings-write-ratio", type=float, default=0.05, help="Fração de POST /api/settings")
+    parser.add_argument("--port", type=int, default=18100)
+    parser.add_argument("--output", help="Arquivo JSON com os resultados")
+    parser.add_argument("--compare", nargs=2, metavar=("ANTES", "DEPOIS"), help="Compara dois JSON e sai")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"cenário desconhecido: {', '.join(sorted(unknown))}")
+
+    fake_server, openai_url = start_fake_openai(
+        latency=args.latency, rpm=args.rpm, error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate, jitter=args.jitter
+    )
+    fake_counters = fake_server.RequestHandlerClass.counters
+    workdir = tempfile.mkdtemp(prefix="bench_suite_")
+    db_path = os.path.join(workdir, "historico.db")
+    shutil.copy(os.path.join(ROOT, "api", "historico_base.db"), db_path)
+    env = dict(
+        os.environ,
+        OPENAI_BASE_URL=openai_url,
+        OPENAI_API_KEY="sk-fake",
+        HISTORICO_DB_PATH=db_path,
+        RESPONSE_CACHE_DB_PATH=os.path.join(workdir, "cache.db"),
+        METRICS_DIR=os.path.join(workdir, "metrics"),
+        METRICS_FLUSH_INTERVAL="0.5",  # Métricas do SQLite lidas logo após cada cenário
+        SINGLE_FLIGHT_DIR=os.path.join(workdir, "singleflight"),
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+    log_path = os.path.join(workdir, "gunicorn.log")
+    with open(log_path, "wb") as log:
+        server = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+             "-b", f"127.0.0.1:{args.port}", "api.index:app"],
+            cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+    config = {
+        "worker_class": env.get("GUNICORN_WORKER_CLASS", "gthread"),
+        "workers": env.get("GUNICORN_WORKERS"),
+        "threads": env.get("GUNICORN_THREADS"),
+        **{key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+    }
+    results = {
+        "versao": RESULT_VERSION,
+        "data": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git": git_revision(),
+        "config": config,
+        "cenarios": {},
+    }
+    try:
+        wait_until_ready(base_url, server)
+        print(f"🔬 gunicorn {config['worker_class']} | OpenAI falsa {args.latency}s ±{args.jitter:.0%} | "
+              f"{args.concurrency} clientes por cenário")
+        # Aquecimento: primeira chamada de cada rota (imports, pools, cache de settings)
+        run_load(args.port, scenario_plan("misto", 3), 1.0, args.stream_ratio, args.settings_write_ratio)
+
+        for name in scenarios:
+            before = scrape_metrics(base_url)
+            counters_before = dict(fake_counters)
+            with RssSampler(server.pid) as rss:
+                samples = run_load(args.port, scenario_plan(name, args.concurrency), args.duration,
+                                   args.stream_ratio, args.settings_write_ratio)
+            time.sleep(1.5)  # Workers gravam o snapshot das métricas a cada 0,5s
+            after = scrape_metrics(base_url)
+            result = {
+                "duracao_s": args.duration,
+                "clientes": sum(clients for _, clients in scenario_plan(name, args.concurrency)),
+                "endpoints": {label: summarize_endpoint(values, args.duration)
+                              for label, values in sorted(samples.items())},
+                "rss_mb": rss.peaks,
+                "sqlite": sqlite_contention(before, after),
+                "openai_falsa": {key: value - counters_before.get(key, 0) for key, value in fake_counters.items()},
+            }
+            results["cenarios"][name] = result
+            print_scenario(name, result)
+    except Exception:
+        with open(log_path, encoding="utf-8", errors="replace") as log:
+            print("".join(log.readlines()[-40:]))
+        raise
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        fake_server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"💾 Resultados em {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Benchmark: gc.collect() a cada requisição (antigo) x política de memória gerenciada
+
+Importa o backend em um banco temporário e mede a latência de /api/health
+pelo cliente de teste do Flask nos dois modos:
+- antigo: teardown com gc.collect(), limiares padrão do GC, sem gc.freeze()
+- gerenciado: api/memory.py (limiares maiores, freeze, coleta só após payload grande)
+
+--heap-objects simula um worker aquecido (caches, respostas em memória).
+
+Uso:
+    python benchmarks/memory_policy.py --requests 500 --heap-objects 200000
+"""
+import argparse
+import gc
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] if ordered else 0.0
+
+
+def measure(client, requests):
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = client.get('/api/health')
+        latencies.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.status_code
+    return latencies
+
+
+def report(label, latencies):
+    print(f"📊 {label}: p50={percentile(latencies, 50) * 1000:.2f}ms "
+          f"p99={percentile(latencies, 99) * 1000:.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--heap-objects", type=int, default=200000,
+                        help="Objetos vivos extras simulando um worker aquecido")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_memory_")
+    try:
+        db_path = os.path.join(workdir, "historico.db")
+        shutil.copy(os.path.join(ROOT, "api", "historico_base.db"), db_path)
+        os.environ.update(
+            HISTORICO_DB_PATH=db_path,
+            RESPONSE_CACHE_DB_PATH=os.path.join(workdir, "cache.db"),
+            METRICS_DIR=os.path.join(workdir, "metrics"),
+            SINGLE_FLIGHT_DIR=os.path.join(workdir, "singleflight"),
+        )
+        os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+        from api import index  # noqa: E402
+        # Objetos de vida longa criados depois da inicialização (como caches aquecidos)
+        warm_heap = [{'id': i, 'texto': str(i)} for i in range(args.heap_objects)]
+        client = index.app.test_client()
+        measure(client, 20)  # Aquecimento
+
+        report("gerenciado", measure(client, args.requests))
+
+        # Modo antigo: sem freeze, limiares padrão e gc.collect() no teardown
+        gc.unfreeze()
+        gc.set_threshold(700, 10, 10)
+        index.app.teardown_appcontext_funcs.append(lambda exception: gc.collect())
+        measure(client, 20)
+        report("gc.collect() por requisição", measure(client, args.requests))
+        del warm_heap
+        index.metrics.flush()  # Antes de apagar o diretório temporário
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
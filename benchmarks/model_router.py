@@ -0,0 +1,119 @@
+"""Benchmark: roteamento de modelo por tipo de tarefa
+
+Manda ao /api/chat uma sessão típica (análise comparativa com documentos,
+perguntas de acompanhamento, e-mail para a construtora e mensagens curtas),
+primeiro com {"roteamento": false} (tudo no gpt-5 pedido pelo navegador) e
+depois com o roteador. A OpenAI falsa responde mais rápido para modelos
+menores/menos raciocínio e soma reasoning_tokens à saída.
+
+Mostra, por rota: decisão (modelo, max_tokens, esforço), latência média e
+tokens de entrada/saída com e sem roteamento.
+
+Uso:
+    python benchmarks/model_router.py --latency 2 --rounds 3
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_openai import start_fake_openai  # noqa: E402
+
+SYSTEM_ANALYSIS = "Você é analista de propostas da Tools Engenharia. Compare itens, preços e prazos. " * 40
+DOCUMENTS = "=== ARQUIVO: proposta.pdf ===\n" + "Item 01 | Cimento CP-II 50kg | 120 sc | R$ 34,90 | 5 dias\n" * 800
+
+SESSION = [
+    ('comparacao', [{'role': 'system', 'content': SYSTEM_ANALYSIS},
+                    {'role': 'user', 'content': f"Analise as propostas abaixo.\n\n{DOCUMENTS}"}]),
+    ('pergunta', [{'role': 'system', 'content': "Você é um assistente especializado em análise de documentos."},
+                  {'role': 'user', 'content': "Com base nas análises, qual fornecedor tem o menor prazo de entrega?"}]),
+    ('email', [{'role': 'system', 'content': "Você é especialista em comunicação comercial. Gere um e-mail profissional."},
+               {'role': 'user', 'content': "Com base na análise acima, gere um e-mail para a construtora."}]),
+    ('conversa', [{'role': 'user', 'content': "Obrigado!"}]),
+]
+
+
+def run_session(client, rounds, routed):
+    results = {}
+    for round_number in range(rounds):
+        for expected, messages in SESSION:
+            messages = [dict(msg) for msg in messages]
+            messages[-1]['content'] += f" ({round_number})"  # Sem cache/single-flight entre rodadas
+            started = time.perf_counter()
+            response = client.post('/api/chat', json={
+                'model': 'gpt-5', 'max_tokens': 12000, 'messages': messages, 'cache': False, 'roteamento': routed,
+            })
+            seconds = time.perf_counter() - started
+            data = response.get_json()
+            if response.status_code != 200:
+                raise RuntimeError(f"/api/chat {response.status_code}: {data}")
+            route = data['roteamento']
+            if routed and route['tarefa'] != expected:
+                print(f"⚠️ Esperado {expected}, roteado como {route['tarefa']}")
+            entry = results.setdefault(expected, {'route': route, 'seconds': [], 'input': [], 'output': []})
+            entry['seconds'].append(seconds)
+            entry['input'].append(data['usage']['input_tokens'])
+            entry['output'].append(data['usage']['output_tokens'])
+    return results
+
+
+def mean(values):
+    return sum(values) / len(values) if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=2.0, help="Latência do gpt-5 com esforço low (s)")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_router_")
+    server = None
+    try:
+        db_path = os.path.join(workdir, "historico.db")
+        shutil.copy(os.path.join(ROOT, "api", "historico_base.db"), db_path)
+        os.environ.update(
+            HISTORICO_DB_PATH=db_path,
+            RESPONSE_CACHE_DB_PATH=os.path.join(workdir, "cache.db"),
+            METRICS_DIR=os.path.join(workdir, "metrics"),
+            SINGLE_FLIGHT_DIR=os.path.join(workdir, "singleflight"),
+            OPENAI_API_KEY="sk-fake",
+        )
+
+        from api import index  # noqa: E402
+        server, openai_url = start_fake_openai(latency=args.latency)
+        index.client = index.client.with_options(base_url=openai_url)
+        client = index.app.test_client()
+
+        baseline = run_session(client, args.rounds, routed=False)
+        routed = run_session(client, args.rounds, routed=True)
+
+        print(f"📊 {'rota':<11} {'decisão':<34} {'latência':>17} {'entrada':>15} {'saída':>15}")
+        for task, entry in routed.items():
+            before = baseline[task]
+            route = entry['route']
+            decision = f"{route['modelo']} max={route['max_tokens']} {route['esforco']}"
+            print(f"   {task:<11} {decision:<34} "
+                  f"{mean(before['seconds']):5.2f}s -> {mean(entry['seconds']):5.2f}s "
+                  f"{mean(before['input']):6.0f} -> {mean(entry['input']):6.0f} "
+                  f"{mean(before['output']):6.0f} -> {mean(entry['output']):6.0f}")
+        total_before = sum(sum(entry['seconds']) for entry in baseline.values())
+        total_after = sum(sum(entry['seconds']) for entry in routed.values())
+        print(f"📊 sessão: {total_before:.1f}s -> {total_after:.1f}s")
+        print(f"   {index.model_router.stats()['tasks']}")
+        index.history_writer.flush()
+        index.metrics.flush()  # Antes de apagar o diretório temporário
+    finally:
+        if server:
+            server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
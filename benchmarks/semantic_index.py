@@ -0,0 +1,94 @@
+"""Benchmark: busca top-k no índice semântico do histórico
+
+Monta um índice temporário com N análises sintéticas e mede a latência da
+busca (uma consulta e em lote) e a qualidade frente ao cosseno exato sobre a
+matriz inteira.
+
+Uso:
+    python benchmarks/semantic_index.py --rows 100000 --batch 8
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from api.semantic_index import SemanticIndex, embed  # noqa: E402
+
+WORDS = (
+    'cimento areia brita concreto usinado aço CA-50 tijolo tubo PVC preço fornecedor prazo frete '
+    'pagamento telha madeira tinta parafuso cabo elétrico disjuntor luva bota capacete entrega '
+    'garantia desconto proposta cotação vergalhão argamassa bloco cerâmico impermeabilizante'
+).split()
+SUPPLIERS = ['ACME', 'Beta', 'Gama', 'Delta', 'Construmax', 'Ferragens Silva', 'Casa do Aço']
+
+
+def synthetic_text(rng):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(20, 120))]
+    return f"Compare {rng.choice(SUPPLIERS)} e {rng.choice(SUPPLIERS)}: " + ' '.join(words)
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] if ordered else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--batch", type=int, default=8, help="Consultas por chamada no modo em lote")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    workdir = tempfile.mkdtemp(prefix="bench_semantic_")
+    try:
+        index = SemanticIndex(os.path.join(workdir, "historico.db-vetores"))
+        start = time.perf_counter()
+        for offset in range(0, args.rows, 10000):
+            count = min(10000, args.rows - offset)
+            index.append(list(range(offset + 1, offset + count + 1)), [synthetic_text(rng) for _ in range(count)])
+        print(f"🔬 {args.rows} análises indexadas em {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        index.search(["aquecimento"])  # Primeira busca monta os códigos em memória
+        print(f"   carga inicial: {(time.perf_counter() - start) * 1000:.1f}ms")
+
+        queries = [synthetic_text(rng) for _ in range(args.queries)]
+        single = []
+        for query in queries:
+            start = time.perf_counter()
+            index.search([query], args.k)
+            single.append(time.perf_counter() - start)
+        batched = []
+        for offset in range(0, len(queries), args.batch):
+            start = time.perf_counter()
+            index.search(queries[offset:offset + args.batch], args.k)
+            batched.append(time.perf_counter() - start)
+
+        print(f"📊 1 consulta: p50={percentile(single, 50) * 1000:.2f}ms p99={percentile(single, 99) * 1000:.2f}ms")
+        print(f"📊 lote de {args.batch}: p50={percentile(batched, 50) * 1000:.2f}ms "
+              f"p99={percentile(batched, 99) * 1000:.2f}ms")
+
+        # Qualidade: score do k-ésimo resultado frente ao cosseno exato
+        vectors = np.asarray(index._load()[1])
+        ratios = []
+        for query, vector in zip(queries[:50], embed(queries[:50])):
+            exact = np.sort(vectors @ vector)[-args.k]
+            found = index.search([query], args.k)[0][-1][1]
+            ratios.append(found / exact if exact else 1.0)
+        print(f"🎯 score do {args.k}º resultado / exato: {np.mean(ratios):.3f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Benchmark: GET /api/settings numa rajada de cargas de página
+
+Importa o backend em um banco temporário e dispara rajadas de GET
+/api/settings em paralelo (várias abas/usuários abrindo a página ao mesmo
+tempo), pelo cliente de teste do Flask, em três modos:
+- sem cache: SETTINGS_CACHE_TTL=0, uma leitura no SQLite por requisição
+- cache em memória: leitura só na primeira vez de cada chave
+- cache + If-None-Match: navegador com a resposta guardada (304 sem corpo)
+
+Uso:
+    python benchmarks/settings_cache.py --burst 50 --rounds 20 --keys 10
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] if ordered else 0.0
+
+
+def burst(app, keys, size, rounds, etags=None):
+    def load_page(i):
+        api_key = keys[i % len(keys)]
+        headers = {'X-API-Key': api_key}
+        if etags:
+            headers['If-None-Match'] = etags[api_key]
+        start = time.perf_counter()
+        response = app.test_client().get('/api/settings', headers=headers)
+        elapsed = time.perf_counter() - start
+        assert response.status_code == (304 if etags else 200), response.status_code
+        return elapsed
+
+    latencies = []
+    with ThreadPoolExecutor(max_workers=size) as pool:
+        for _ in range(rounds):
+            latencies.extend(pool.map(load_page, range(size)))
+    return latencies
+
+
+def report(label, latencies):
+    print(f"📊 {label}: p50={percentile(latencies, 50) * 1000:.2f}ms "
+          f"p99={percentile(latencies, 99) * 1000:.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--burst", type=int, default=50, help="Requisições simultâneas por rajada")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--keys", type=int, default=10, help="API keys distintas")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_settings_")
+    try:
+        db_path = os.path.join(workdir, "historico.db")
+        shutil.copy(os.path.join(ROOT, "api", "historico_base.db"), db_path)
+        os.environ.update(
+            HISTORICO_DB_PATH=db_path,
+            RESPONSE_CACHE_DB_PATH=os.path.join(workdir, "cache.db"),
+            METRICS_DIR=os.path.join(workdir, "metrics"),
+            SINGLE_FLIGHT_DIR=os.path.join(workdir, "singleflight"),
+        )
+        os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+        from api import index  # noqa: E402
+        client = index.app.test_client()
+        keys = [f"sk-bench-{i}" for i in range(args.keys)]
+        for i, api_key in enumerate(keys):
+            client.post('/api/settings', json={'api_key': api_key, 'modelo': 'gpt-5',
+                                               'max_tokens': 1000 + i, 'chunk_size': 8000})
+
+        cache_ttl = index.settings_cache.ttl
+        index.settings_cache.ttl = 0
+        burst(index.app, keys, args.burst, 2)  # Aquecimento
+        report("sem cache", burst(index.app, keys, args.burst, args.rounds))
+
+        index.settings_cache.ttl = cache_ttl
+        burst(index.app, keys, args.burst, 2)
+        report("cache em memória", burst(index.app, keys, args.burst, args.rounds))
+
+        etags = {api_key: client.get('/api/settings', headers={'X-API-Key': api_key}).headers['ETag']
+                 for api_key in keys}
+        report("cache + If-None-Match (304)", burst(index.app, keys, args.burst, args.rounds, etags))
+        print(f"   {index.settings_cache.stats()}")
+        index.metrics.flush()  # Antes de apagar o diretório temporário
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
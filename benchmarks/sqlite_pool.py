@@ -0,0 +1,139 @@
+"""Benchmark: conexão nova por chamada (comportamento antigo) x pool com WAL
+
+Leitores simulam /api/historico e escritores simulam save_to_history_async,
+todos em paralelo sobre um banco temporário com o schema do historico.
+
+Uso:
+    python benchmarks/sqlite_pool.py --readers 8 --writers 4 --seconds 5
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from api.db_pool import SQLitePool  # noqa: E402
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS historico (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        usuario TEXT,
+        prompt TEXT,
+        resposta TEXT,
+        data DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+PROMPT = "x" * 4000
+RESPOSTA = "| Fornecedor | Item | Preço |\n" * 200
+
+
+def connect_per_call(db_path):
+    @contextmanager
+    def get_connection():
+        conn = sqlite3.connect(db_path, timeout=10)
+        try:
+            yield conn
+        finally:
+            conn.close()
+    return get_connection
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] if ordered else 0.0
+
+
+def run(label, get_connection, readers, writers, seconds):
+    stop = threading.Event()
+    read_latencies, write_latencies, errors = [], [], []
+
+    def reader():
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                with get_connection() as conn:
+                    conn.execute(
+                        'SELECT id, usuario, prompt, resposta, data FROM historico ORDER BY data DESC LIMIT 50'
+                    ).fetchall()
+                    conn.execute('SELECT COUNT(*) FROM historico').fetchone()
+                read_latencies.append(time.perf_counter() - start)
+            except sqlite3.Error as e:
+                errors.append(str(e))
+
+    def writer():
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                with get_connection() as conn:
+                    conn.execute(
+                        'INSERT INTO historico (usuario, prompt, resposta) VALUES (?, ?, ?)',
+                        ('bench', PROMPT, RESPOSTA)
+                    )
+                    conn.commit()
+                write_latencies.append(time.perf_counter() - start)
+            except sqlite3.Error as e:
+                errors.append(str(e))
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads += [threading.Thread(target=writer) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    print(f"📊 {label}")
+    print(f"   leituras: {len(read_latencies) / seconds:8.1f}/s | "
+          f"p50={percentile(read_latencies, 50) * 1000:.2f}ms p99={percentile(read_latencies, 99) * 1000:.2f}ms")
+    print(f"   escritas: {len(write_latencies) / seconds:8.1f}/s | "
+          f"p50={percentile(write_latencies, 50) * 1000:.2f}ms p99={percentile(write_latencies, 99) * 1000:.2f}ms")
+    if errors:
+        print(f"   erros: {len(errors)} (ex: {errors[0]})")
+
+
+def prepare(db_path, rows):
+    conn = sqlite3.connect(db_path)
+    conn.execute(SCHEMA)
+    conn.executemany(
+        'INSERT INTO historico (usuario, prompt, resposta) VALUES (?, ?, ?)',
+        [('seed', PROMPT, RESPOSTA)] * rows
+    )
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--rows", type=int, default=2000, help="Linhas iniciais no historico")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_sqlite_")
+    try:
+        legacy_path = os.path.join(workdir, "legacy.db")
+        pooled_path = os.path.join(workdir, "pooled.db")
+        prepare(legacy_path, args.rows)
+        prepare(pooled_path, args.rows)
+
+        print(f"🔬 {args.readers} leitores + {args.writers} escritores por {args.seconds}s")
+        run("conexão por chamada (rollback journal)", connect_per_call(legacy_path),
+            args.readers, args.writers, args.seconds)
+        pool = SQLitePool(pooled_path)
+        run("pool + WAL + pragmas", pool.connection, args.readers, args.writers, args.seconds)
+        pool.close_all()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Benchmark: tempo de importação e cold start até a primeira resposta
+
+Cada rodada é um processo Python novo (como uma instância nova na Vercel ou um
+worker sem preload), com uma cópia do banco já migrada. O processo importa
+api.index e faz GET /api/health, POST /api/chat (OpenAI falsa via
+OPENAI_BASE_URL) e um segundo /api/chat já aquecido. Mostra a mediana de:
+- importação de api.index
+- início do processo até a primeira resposta do /api/health e do /api/chat
+- os módulos mais caros da importação (python -X importtime)
+
+--baseline REV roda o mesmo em uma cópia da revisão REV (git worktree), para
+comparar antes/depois.
+
+Uso:
+    python benchmarks/startup.py --runs 5 --baseline HEAD~1
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_openai import start_fake_openai  # noqa: E402
+
+# Roda no processo novo: marca os instantes (time.time, comparável com o do pai)
+CHILD = r"""
+import json, sys, time
+marks = {'interpreter': time.time()}
+sys.path.insert(0, sys.argv[1])
+from api import index
+marks['import'] = time.time()
+client = index.app.test_client()
+status = {'health': client.get('/api/health').status_code}
+marks['health'] = time.time()
+body = {'model': 'gpt-5-mini', 'messages': [{'role': 'user', 'content': 'Qual fornecedor entrega antes?'}],
+        'cache': False}
+status['chat'] = client.post('/api/chat', json=body).status_code
+marks['chat'] = time.time()
+status['chat_warm'] = client.post('/api/chat', json=body).status_code
+marks['chat_warm'] = time.time()
+index.history_writer.flush()
+index.metrics.flush()
+print('STARTUP ' + json.dumps({'marks': marks, 'status': status}))
+"""
+
+PHASES = [
+    ('interpretador', 'start', 'interpreter'),
+    ('import api.index', 'interpreter', 'import'),
+    ('1º /api/health', 'start', 'health'),
+    ('1º /api/chat', 'start', 'chat'),
+    ('2º /api/chat (quente)', 'chat', 'chat_warm'),
+]
+
+
+def child_env(workdir, openai_url):
+    env = dict(os.environ)
+    env.update(
+        HISTORICO_DB_PATH=os.path.join(workdir, "historico.db"),
+        RESPONSE_CACHE_DB_PATH=os.path.join(workdir, "cache.db"),
+        METRICS_DIR=os.path.join(workdir, "metrics"),
+        SINGLE_FLIGHT_DIR=os.path.join(workdir, "singleflight"),
+        OPENAI_API_KEY="sk-fake",
+        OPENAI_BASE_URL=openai_url,
+    )
+    return env
+
+
+def cold_start(root, env):
+    """Um processo novo: {'marks', 'status'} com marks relativos ao início (s)"""
+    started = time.time()
+    result = subprocess.run([sys.executable, "-c", CHILD, root], cwd=root, env=env,
+                            capture_output=True, text=True, timeout=120)
+    line = next((line for line in result.stdout.splitlines() if line.startswith("STARTUP ")), None)
+    if result.returncode != 0 or line is None:
+        raise RuntimeError(f"processo falhou ({result.returncode}):\n{result.stderr[-2000:]}")
+    data = json.loads(line[len("STARTUP "):])
+    data['marks'] = dict({name: value - started for name, value in data['marks'].items()}, start=0.0)
+    return data
+
+
+def import_profile(root, env, top):
+    """Pacotes/módulos com maior tempo acumulado na importação de api.index"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import sys; sys.path.insert(0, {root!r}); "
+                             "import api.index"], cwd=root, env=env, capture_output=True, text=True, timeout=120)
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        # Pacotes de terceiros agrupados pela raiz (openai.types.* conta em openai); módulos api.* separados
+        key = name if name.startswith("api.") else name.split(".")[0]
+        if key not in ("api", "api.index"):
+            modules[key] = max(modules.get(key, 0.0), int(cumulative) / 1e6)
+    return sorted(modules.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+def measure(root, runs, workdir, openai_url, top):
+    shutil.copy(os.path.join(root, "api", "historico_base.db"), os.path.join(workdir, "historico.db"))
+    env = child_env(workdir, openai_url)
+    cold_start(root, env)  # Migra o banco e gera os .pyc: as rodadas medem o caso normal
+    samples = []
+    for _ in range(runs):
+        data = cold_start(root, env)
+        if any(code != 200 for code in data['status'].values()):
+            raise RuntimeError(f"respostas inesperadas: {data['status']}")
+        samples.append(data['marks'])
+    phases = {label: statistics.median(marks[end] - marks[begin] for marks in samples)
+              for label, begin, end in PHASES}
+    return phases, import_profile(root, env, top)
+
+
+def report(title, phases, modules, baseline=None):
+    print(f"📊 {title}")
+    for label, seconds in phases.items():
+        ratio = ""
+        if baseline and seconds > 0:
+            before = baseline[label]
+            ratio = f" (antes {before * 1000:6.0f}ms, {before / seconds:.1f}x)"
+        print(f"   {label:<22} {seconds * 1000:7.0f}ms{ratio}")
+    print("   importação (acumulado):", ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in modules))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Processos novos por medição (mediana)")
+    parser.add_argument("--top", type=int, default=8, help="Módulos mostrados no perfil de importação")
+    parser.add_argument("--baseline", help="Revisão do git para comparar (ex: HEAD~1)")
+    args = parser.parse_args()
+
+    server, openai_url = start_fake_openai(latency=0.05)
+    workdir = tempfile.mkdtemp(prefix="bench_startup_")
+    worktree = None
+    try:
+        baseline = None
+        if args.baseline:
+            worktree = os.path.join(workdir, "baseline")
+            subprocess.run(["git", "worktree", "add", "--detach", worktree, args.baseline], cwd=ROOT,
+                           check=True, capture_output=True)
+            os.makedirs(os.path.join(workdir, "antes"))
+            baseline, modules = measure(worktree, args.runs, os.path.join(workdir, "antes"), openai_url, args.top)
+            report(f"{args.baseline}", baseline, modules)
+        os.makedirs(os.path.join(workdir, "atual"))
+        phases, modules = measure(ROOT, args.runs, os.path.join(workdir, "atual"), openai_url, args.top)
+        report("árvore atual", phases, modules, baseline)
+    finally:
+        server.shutdown()
+        if worktree:
+            subprocess.run(["git", "worktree", "remove", "--force", worktree], cwd=ROOT, capture_output=True)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Benchmark: rajada de análises contra uma OpenAI com limite de taxa
+
+Sobe a OpenAI falsa com --rpm (429 + cabeçalhos x-ratelimit-*), importa o
+backend em um banco temporário e dispara ao mesmo tempo chamadas /api/chat
+interativas e de geração de e-mail ("prioridade": "baixa"), nos dois modos:
+- antigo: retries do SDK (max_retries=2), sem agendador
+- agendador: api/upstream_scheduler.py (fila com prioridade, buckets, backoff)
+
+Uso:
+    python benchmarks/upstream_scheduler.py --rpm 30 --interactive 20 --background 40
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_openai import start_fake_openai  # noqa: E402
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] if ordered else 0.0
+
+
+def run_burst(app, interactive, background):
+    results = {'interativa': [], 'baixa': []}
+    lock = threading.Lock()
+
+    def post(priority, number):
+        start = time.perf_counter()
+        response = app.test_client().post('/api/chat', json={
+            'model': 'gpt-5',
+            'messages': [{'role': 'user', 'content': f'Compare as propostas ({priority} {number})'}],
+            'max_tokens': 500,
+            'cache': False,
+            'prioridade': priority,
+        })
+        with lock:
+            results[priority].append((response.status_code == 200, time.perf_counter() - start))
+
+    # E-mails chegam primeiro: o agendador ainda deve atender o chat antes
+    threads = [threading.Thread(target=post, args=('baixa', i)) for i in range(background)]
+    threads += [threading.Thread(target=post, args=('interativa', i)) for i in range(interactive)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+        time.sleep(0.005)
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started
+
+
+def report(label, results, elapsed):
+    print(f"📊 {label} (total {elapsed:.1f}s)")
+    for priority, values in results.items():
+        ok = [seconds for success, seconds in values if success]
+        print(f"   {priority:<10}: {len(ok)}/{len(values)} ok | "
+              f"p50={percentile(ok, 50):.1f}s max={max(ok, default=0):.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rpm", type=int, default=30, help="Limite de requisições por minuto da OpenAI falsa")
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--interactive", type=int, default=20)
+    parser.add_argument("--background", type=int, default=40)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_upstream_")
+    servers = []
+    try:
+        db_path = os.path.join(workdir, "historico.db")
+        shutil.copy(os.path.join(ROOT, "api", "historico_base.db"), db_path)
+        os.environ.update(
+            HISTORICO_DB_PATH=db_path,
+            RESPONSE_CACHE_DB_PATH=os.path.join(workdir, "cache.db"),
+            METRICS_DIR=os.path.join(workdir, "metrics"),
+            SINGLE_FLIGHT_DIR=os.path.join(workdir, "singleflight"),
+            OPENAI_API_KEY="sk-fake",
+        )
+
+        from api import index  # noqa: E402
+        base_client = index.client
+
+        # Cada modo com uma OpenAI falsa nova (balde cheio)
+        server, openai_url = start_fake_openai(latency=args.latency, rpm=args.rpm)
+        servers.append(server)
+        index.upstream_scheduler.enabled = False
+        index.client = base_client.with_options(base_url=openai_url, max_retries=2)
+        report("antigo: retries do SDK", *run_burst(index.app, args.interactive, args.background))
+        print(f"   429 na OpenAI falsa: {server.RequestHandlerClass.limiter.rejected}")
+
+        server, openai_url = start_fake_openai(latency=args.latency, rpm=args.rpm)
+        servers.append(server)
+        index.upstream_scheduler.enabled = True  # Desligado, ele não guardou estado da primeira rodada
+        index.client = base_client.with_options(base_url=openai_url)
+        report("agendador", *run_burst(index.app, args.interactive, args.background))
+        print(f"   429 na OpenAI falsa: {server.RequestHandlerClass.limiter.rejected}")
+        print(f"   {index.upstream_scheduler.stats()['models']}")
+        index.metrics.flush()  # Antes de apagar o diretório temporário
+    finally:
+        for server in servers:
+            server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,10 @@ echo "=========================================="
 echo "📦 Instalando dependências Python..."
 pip install -r requirements.txt
 
+# Esquema do banco (versionado): a aplicação pode subir com SKIP_MIGRATIONS=1
+echo "🧱 Aplicando migrações do banco..."
+python -m api.migrations
+
 # Tornar o script de start executável
 echo "🔧 Configurando permissões..."
 
@@ -4,9 +4,15 @@ import multiprocessing
 
 # Configurações básicas
 bind = "0.0.0.0:10000"
-workers = min(2, multiprocessing.cpu_count())  # Limitado para evitar uso excessivo de memória
-worker_class = "sync"
-worker_connections = 100
+workers = int(os.getenv("GUNICORN_WORKERS", min(2, multiprocessing.cpu_count())))  # Limitado para evitar uso excessivo de memória
+
+# Modelo de worker: chamadas à OpenAI passam a maior parte do tempo esperando rede,
+# então cada worker segura muitas requisições em paralelo em vez de 1 por processo.
+# - "gthread" (padrão): pool de threads por worker, sem dependências extras
+# - "gevent": greenlets (requer `pip install gevent`), para milhares de conexões
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.getenv("GUNICORN_THREADS", 200))  # Requisições simultâneas por worker (gthread)
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", 1000))  # Idem para gevent
 
 # Configurações de timeout
 timeout = 180  # 3 minutos para requisições longas da OpenAI
@@ -33,10 +39,48 @@ tmp_upload_dir = None
 
 # Configurações de graceful restart
 graceful_timeout = 120
-max_worker_memory = 256 * 1024 * 1024  # 256MB por worker
+
+# Memória: o gunicorn não tem limite por worker; api/memory.py amostra a
+# memória e recicla o worker (SIGTERM gracioso) acima de MEMORY_MAX_RSS_MB
+def post_fork(server, worker):
+    from api.memory import memory_manager
+    memory_manager.enable_recycling()
+    # Jobs assíncronos (/api/jobs): o pool do worker retoma os pendentes sem esperar requisição
+    from api.index import init_db, job_queue
+    try:
+        init_db()  # Tabela de jobs antes de retomar a fila (com preload_app já rodou no master)
+    except Exception:
+        pass  # Já registrado; a primeira requisição tenta de novo
+    job_queue.start()
+
+# Métricas (/api/metrics): cada worker grava um snapshot em METRICS_DIR
+def on_starting(server):
+    from api.metrics import reset_metrics_dir
+    reset_metrics_dir()
+    # A importação da app deixa banco, cliente OpenAI e estáticos para o primeiro uso;
+    # com preload_app é melhor fazer tudo aqui, uma vez, e os workers herdarem pelo fork
+    if server.cfg.preload_app:
+        from api.index import warm_up
+        warm_up()
+
+def pre_fork(server, worker):
+    # Conexões SQLite abertas no master (aquecimento) não podem ser herdadas pelos workers
+    if server.cfg.preload_app:
+        from api.index import close_db_connections
+        close_db_connections()
+
+def child_exit(server, worker):
+    # Worker reciclado (max_requests): os totais dele passam para o acumulado
+    from api.metrics import retire_worker
+    retire_worker(worker.pid)
 
 print("🚀 Configuração do Gunicorn carregada:")
-print(f"   Workers: {workers}")
+print(f"   Workers: {workers} ({worker_class})")
+if worker_class == "gthread":
+    print(f"   Threads por worker: {threads}")
+elif worker_class == "gevent":
+    print(f"   Conexões por worker: {worker_connections}")
 print(f"   Timeout: {timeout}s")
 print(f"   Max requests per worker: {max_requests}")
+print(f"   Memória máxima por worker: {os.getenv('MEMORY_MAX_RSS_MB', 256)}MB")
 print(f"   Bind: {bind}")
\ No newline at end of file